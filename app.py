@@ -61,5 +61,35 @@ with app.app_context():
         # Shut down the scheduler when exiting the app
         atexit.register(lambda: scheduler.shutdown())
 
+    # Close pooled FTP/SFTP sessions that have been idle too long
+    from connection_pool import connection_pool
+    scheduler.add_job(
+        func=connection_pool.evict_idle,
+        trigger='interval',
+        seconds=60,
+        id='connection_pool_eviction',
+        replace_existing=True
+    )
+    atexit.register(connection_pool.close_all)
+
+    # Unmount shared NFS mounts nobody has used for a while
+    from nfs_mounts import nfs_mounts
+    scheduler.add_job(
+        func=nfs_mounts.evict_idle,
+        trigger='interval',
+        seconds=60,
+        id='nfs_mount_eviction',
+        replace_existing=True
+    )
+    atexit.register(nfs_mounts.close_all)
+
+    # Probe mount helpers, sudo and kernel filesystems once for NFS and network drives
+    from capabilities import capabilities
+    capabilities.snapshot()
+
+    # Global bandwidth limit from the settings; sites and jobs are configured per client
+    from utils import apply_bandwidth_settings
+    apply_bandwidth_settings()
+
 # Import routes after app initialization
 from routes import *  # noqa: F401, E402
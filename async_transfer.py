@@ -0,0 +1,638 @@
+"""
+Asyncio transfer core.
+
+With one thread per parallel session, a job fetching thousands of small
+files keeps its threads waiting on round trips most of the time, and many
+such jobs at once need hundreds of threads. FTP downloads therefore run on
+one asyncio event loop shared by the whole process (transfer_loop): every
+session is a coroutine with its own control connection and passive data
+connections, so the sessions of all jobs and sites run on a single thread.
+
+Jobs stay synchronous. download_tasks() is the facade the transfer engine
+calls from a job's thread: it hands the tasks to the loop - one by one while
+a tree scan is still producing them - and blocks until they are done, with
+the same per-task results as the thread engine.
+
+A session downloads a whole file in stream mode the way
+FTPClient.download_file() does: into a '.part' file that a retry continues,
+hashed and throttled as the data arrives and compared with its sidecars.
+Sessions are the connection pool's: a worker leases a logged-in session
+(reusing an idle one like any blocking client does), drives its control
+socket from the loop and returns it to the pool afterwards, so the site's
+connection limit covers them and repeated jobs do not log in again.
+
+Nothing on the loop touches the local disk. Opening, hashing, writing and
+renaming files run on a small executor of their own (DISK_THREADS), and the
+data of a file is handed over in WRITE_BUFFER_SIZE pieces with one write in
+flight while the next piece is received, so a slow network drive or the
+re-hash of a large resumed part only holds up its own download. Tasks the sessions do not take
+(see runs_async()) stay with the thread engine: files large enough for a
+segmented download, MODE Z transfers, and SFTP and NFS, whose libraries
+block and already run on a thread pool executor.
+"""
+import asyncio
+import ftplib
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from checksums import StreamHasher, check_sidecars
+from compression import MIN_COMPRESSED_SIZE
+from connection_pool import connection_pool, describe_pool_key
+from local_writes import open_part
+from resumable import PartialDownload
+from transfer_tuning import apply_socket_buffer
+
+logger = logging.getLogger(__name__)
+
+ASYNC_PROTOCOLS = ('ftp',)
+TIMEOUT = 30  # seconds for connecting and for each read, as on the blocking FTP sessions
+SLOT_RETRY_INTERVAL = 0.25  # seconds between tries for a connection slot while the site is at its limit
+DISK_THREADS = 8  # threads doing the local file work of all async downloads
+WRITE_BUFFER_SIZE = 1024 * 1024  # bytes received before they are handed to a disk thread
+
+_PASV_REPLY = re.compile(r'(\d+),(\d+),(\d+),(\d+),(\d+),(\d+)')
+_EPSV_REPLY = re.compile(r'\(([^\d])\1\1(\d+)\1\)')
+
+
+class TransferLoop:
+    """The event loop all async transfers share, running on a daemon thread of its own"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='transfer-loop', daemon=True).start()
+            return self._loop
+
+    def run(self, coroutine):
+        """Run coroutine on the loop and wait for its result; never call this from the loop itself"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def call(self, function, *args):
+        """Call function(*args) on the loop thread"""
+        self.loop.call_soon_threadsafe(function, *args)
+
+
+# Single loop for every job in the process
+transfer_loop = TransferLoop()
+
+_disk = ThreadPoolExecutor(max_workers=DISK_THREADS, thread_name_prefix='transfer-disk')
+
+
+async def _on_disk(function, *args):
+    """Run function(*args) on a disk thread, so local file work never blocks the loop"""
+    return await asyncio.get_running_loop().run_in_executor(_disk, functools.partial(function, *args))
+
+
+class AsyncFTPSession:
+    """A pooled FTP session whose control connection is driven from the event loop
+
+    The session is leased from the connection pool and logged in by the
+    blocking client code. attach() puts a duplicate of its control socket on
+    the loop; detach() closes the duplicate and hands the socket back to
+    ftplib with the timeout it had and a fresh line reader, so the session
+    goes back to the pool for any client. A session detached in the middle
+    of an exchange (a failed or cancelled command or transfer) still owes
+    replies and is reported out of step, to be discarded rather than pooled.
+    Replies raise the same ftplib exceptions as a blocking session does, so
+    the clients' error handling applies unchanged.
+    """
+
+    def __init__(self, pooled):
+        self.pooled = pooled
+        self.encoding = pooled.connection.encoding
+        self._reader = None
+        self._writer = None
+        self._peer = None
+        self._timeout = None  # the control socket's timeout before attach()
+        self._in_step = True  # False while the server owes a reply
+
+    async def attach(self):
+        sock = self.pooled.connection.sock
+        self._peer = sock.getpeername()[0]
+        self._timeout = sock.gettimeout()
+        self._reader, self._writer = await asyncio.open_connection(sock=sock.dup())
+        # Blocking sessions switch the type per transfer, so it is not known here
+        await self.void_command('TYPE I')
+
+    async def _line(self):
+        async with asyncio.timeout(TIMEOUT):
+            line = await self._reader.readline()
+        if not line:
+            raise EOFError
+        return line.decode(self.encoding, errors='replace').rstrip('\r\n')
+
+    async def _reply(self):
+        """Read one reply, following multi-line replies, and raise for 4xx/5xx like FTP.getresp()"""
+        reply = await self._line()
+        if reply[3:4] == '-':
+            code = reply[:3]
+            while True:
+                line = await self._line()
+                reply += '\n' + line
+                if line[:3] == code and line[3:4] != '-':
+                    break
+        self._in_step = True
+        if reply[:1] == '4':
+            raise ftplib.error_temp(reply)
+        if reply[:1] == '5':
+            raise ftplib.error_perm(reply)
+        if reply[:1] not in ('1', '2', '3'):
+            raise ftplib.error_proto(reply)
+        return reply
+
+    async def command(self, command):
+        self._in_step = False
+        self._writer.write(f'{command}\r\n'.encode(self.encoding))
+        await self._writer.drain()
+        return await self._reply()
+
+    async def void_command(self, command):
+        reply = await self.command(command)
+        if reply[0] != '2':
+            raise ftplib.error_reply(reply)
+        return reply
+
+    async def size(self, path):
+        """Size of path, 0 if the server will not say"""
+        try:
+            reply = await self.command(f'SIZE {path}')
+        except ftplib.error_perm:
+            return 0
+        return int(reply[3:].strip()) if reply[:3] == '213' else 0
+
+    async def modified(self, path):
+        """MDTM timestamp of path, None if the server will not say"""
+        try:
+            return (await self.command(f'MDTM {path}')).split()[-1]
+        except ftplib.error_perm:
+            return None
+
+    async def _passive_address(self):
+        """(host, port) of a passive data connection; like ftplib, always the control connection's host"""
+        if ':' in self._peer:
+            reply = await self.command('EPSV')
+            match = _EPSV_REPLY.search(reply)
+        else:
+            reply = await self.command('PASV')
+            match = _PASV_REPLY.search(reply)
+        if not match:
+            raise ftplib.error_proto(reply)
+        numbers = match.groups()
+        port = int(numbers[1]) if len(numbers) == 2 else (int(numbers[4]) << 8) + int(numbers[5])
+        return self._peer, port
+
+    async def retrieve(self, path, callback, block_size, rest=None):
+        """RETR path, awaiting callback(data) for each block received; rest starts at that offset"""
+        host, port = await self._passive_address()
+        async with asyncio.timeout(TIMEOUT):
+            reader, writer = await asyncio.open_connection(host, port)
+        apply_socket_buffer(writer.get_extra_info('socket'), getattr(self.pooled.connection, 'socket_buffer', None))
+        try:
+            if rest:
+                await self.command(f'REST {rest}')
+            reply = await self.command(f'RETR {path}')
+            if reply[0] == '2':
+                reply = await self._reply()
+            if reply[0] != '1':
+                raise ftplib.error_reply(reply)
+            # The transfer's final reply is still to come
+            self._in_step = False
+            while True:
+                async with asyncio.timeout(TIMEOUT):
+                    data = await reader.read(block_size)
+                if not data:
+                    break
+                await callback(data)
+        finally:
+            writer.close()
+        reply = await self._reply()
+        if reply[0] != '2':
+            raise ftplib.error_reply(reply)
+        return reply
+
+    async def detach(self):
+        """Stop driving the session from the loop; False if its control connection is out of step
+
+        The pooled session itself stays open either way.
+        """
+        if self._writer is None:
+            return self._in_step
+        writer, self._writer = self._writer, None
+        writer.close()
+        try:
+            async with asyncio.timeout(5):
+                await writer.wait_closed()
+        except Exception:
+            pass
+        connection = self.pooled.connection
+        if connection.sock is not None:
+            # The duplicate shares the socket's file status, which the loop changed
+            connection.sock.settimeout(self._timeout)
+            # Whatever ftplib's reader buffered before attach() is stale now
+            stale, connection.file = connection.file, connection.sock.makefile('r', encoding=connection.encoding)
+            if stale is not None:
+                stale.close()
+        return self._in_step
+
+
+def runs_async(client, task):
+    """Whether a download task goes to the event loop rather than to the thread engine"""
+    if client.protocol not in ASYNC_PROTOCOLS:
+        return False
+    size = task.get('size')
+    if size and client.segment_threshold and client.max_connections > 1 and size >= client.segment_threshold:
+        # Segmented over several sessions
+        return False
+    if client.compression and (size is None or size >= MIN_COMPRESSED_SIZE):
+        # May go in MODE Z
+        return False
+    return True
+
+
+class _Downloads:
+    """The tasks, results and sessions of one download_tasks() call, living on the loop"""
+
+    def __init__(self, client, max_workers, initial_workers):
+        self.client = client
+        self.max_workers = max_workers
+        self.initial_workers = initial_workers
+        self.tasks = []
+        self.results = []
+        self.sessions = 0  # sessions that logged in
+        self._ready = deque()  # indexes of tasks no other worker holds the target of
+        self._waiting = {}  # local_path -> indexes queued behind the one being transferred
+        self._workers = set()
+        self._started = 0
+        self._finished = False
+        self._wakeup = asyncio.Event()
+        self._done = asyncio.get_running_loop().create_future()
+
+    def add(self, task):
+        index = len(self.tasks)
+        self.tasks.append(task)
+        self.results.append(None)
+        key = task['local_path']
+        if key in self._waiting:
+            # Same target as an earlier task: runs after it on the same worker
+            self._waiting[key].append(index)
+            return
+        self._waiting[key] = deque()
+        self._ready.append(index)
+        self._wakeup.set()
+        if self._started < self.initial_workers:
+            self._start_worker()
+
+    def finish(self):
+        """No more tasks; bring in the remaining workers if there is work left for them"""
+        self._finished = True
+        self._wakeup.set()
+        for _ in range(min(self.max_workers - self._started, len(self._ready))):
+            self._start_worker()
+        self._check_done()
+
+    async def wait(self):
+        await self._done
+        return self.tasks, self.results, self.sessions
+
+    def _start_worker(self):
+        self._started += 1
+        worker = asyncio.get_running_loop().create_task(self._work())
+        self._workers.add(worker)
+        worker.add_done_callback(self._worker_done)
+
+    def _worker_done(self, worker):
+        self._workers.discard(worker)
+        if not worker.cancelled() and worker.exception() is not None:
+            logger.error(f"Download worker for {self.client.host} failed: {str(worker.exception())}")
+        self._check_done()
+
+    def _check_done(self):
+        if self._finished and not self._workers and not self._done.done():
+            self._done.set_result(None)
+
+    async def _next(self):
+        """Index of the next task to start, None once there are no more"""
+        while not self._ready:
+            if self._finished:
+                return None
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        return self._ready.popleft()
+
+    async def _work(self):
+        """One session: take tasks until there are none left"""
+        session = await self._lease()
+        if session is None:
+            return
+        self.sessions += 1
+        try:
+            while (index := await self._next()) is not None:
+                key = self.tasks[index]['local_path']
+                while index is not None:
+                    try:
+                        self.results[index], session = await self._download(session, self.tasks[index])
+                    except Exception as e:
+                        # Local errors such as a folder that cannot be created
+                        self.results[index] = {'success': False, 'error': str(e)}
+                    index = self._waiting[key].popleft() if self._waiting[key] else None
+                del self._waiting[key]
+        finally:
+            if session is not None:
+                await self._release(session)
+
+    async def _lease(self):
+        """A pooled session to the client's site on the loop, waiting for a slot while there is work
+
+        None if no slot became free or the site cannot be logged in to.
+        """
+        client = self.client
+        key = client.pool_key
+        deadline = time.monotonic() + connection_pool.lease_timeout
+        while True:
+            try:
+                # Only a free slot (timeout 0): the login and health check are blocking, waiting here is not
+                pooled = await asyncio.to_thread(connection_pool.acquire, key, client._open_session, 0)
+            except TimeoutError:
+                if (self._finished and not self._ready) or time.monotonic() >= deadline:
+                    logger.debug(f"No free connection slot to {describe_pool_key(key)}")
+                    return None
+                await asyncio.sleep(SLOT_RETRY_INTERVAL)
+                continue
+            except Exception as e:
+                logger.error(f"Connection failed: {str(e) or type(e).__name__}")
+                return None
+            session = AsyncFTPSession(pooled)
+            try:
+                await session.attach()
+                return session
+            except Exception as e:
+                # A pooled session that died since its last health check; the next try opens a new one
+                logger.debug(f"Pooled session to {describe_pool_key(key)} unusable: {str(e) or type(e).__name__}")
+                await self._release(session, discard=True)
+
+    async def _release(self, session, discard=False):
+        """Give session back to the pool, closing it if discard is set or its control connection is out of step"""
+        in_step = await session.detach()
+        await asyncio.to_thread(connection_pool.release, session.pooled, discard or not in_step)
+
+    async def _download(self, session, task):
+        """Download one task on session; returns the result and the session to go on with (None if lost)"""
+        client = self.client
+        local_path = task['local_path']
+        remote_path = task['remote_path']
+        if task['skip_existing'] and await _on_disk(_exists, local_path):
+            return {'success': True, 'skipped': True}, session
+
+        sidecars = task.get('sidecars')
+        hasher = StreamHasher([client.checksum_algorithm, *(sidecars or ())])
+        partial = None
+        result = None
+        try:
+            for attempt in range(client.max_retries + 1):
+                try:
+                    if session is None:
+                        session = await self._lease()
+                        if session is None:
+                            raise ConnectionError('Connection failed')
+                    if partial is None:
+                        remote_size = task['size'] or await session.size(remote_path) or None
+                        remote_mtime = await session.modified(remote_path)
+                        partial, local_file, offset = await _on_disk(_begin, task, remote_size, remote_mtime, hasher)
+                        if partial.resumed:
+                            logger.info(f"Resuming download of {remote_path}")
+                    else:
+                        local_file, offset = await _on_disk(_open_part, partial, hasher)
+                    # Without sidecars to fetch, the file is checked right after it is complete, in the same step
+                    finish = functools.partial(_complete, task, partial, client.local_writes,
+                                               None if sidecars else hasher)
+                    result = await self._retrieve(session, remote_path, partial, hasher, local_file, offset, finish)
+                    break
+                except Exception as e:
+                    retry = client._is_connection_error(e) and attempt < client.max_retries
+                    if session is not None and not isinstance(e, ftplib.error_perm):
+                        # Anything but a permanent reply leaves the control connection out of step
+                        await self._release(session, discard=True)
+                        session = None
+                    if not retry:
+                        raise
+                    logger.warning(f"Session to {client.host} lost ({str(e) or type(e).__name__}), reconnecting "
+                                   f"(retry {attempt + 1}/{client.max_retries})")
+                    await asyncio.sleep(attempt + 1)
+        except Exception as e:
+            if "550" in str(e):
+                error = f'File not found or access denied: {remote_path}'
+            elif "426" in str(e):
+                error = f'Connection closed during transfer: {remote_path}'
+            else:
+                error = f'Failed to download {remote_path}: {str(e) or type(e).__name__}'
+            await _on_disk(_discard_failed, task, partial)
+            return {'success': False, 'error': error}, session
+        if not sidecars or not result['success']:
+            return result, session
+
+        contents = {}
+        for algorithm, sidecar_path in sidecars.items():
+            chunks = []
+            try:
+                session = session or await self._lease()
+                if session is None:
+                    raise ConnectionError('Connection failed')
+                await session.retrieve(sidecar_path, self._writer(_appender(chunks)), client.block_size)
+                contents[algorithm] = (sidecar_path, b''.join(chunks))
+            except Exception as e:
+                logger.warning(f"Cannot read checksum file {sidecar_path}: {str(e)}")
+                if session is not None and not isinstance(e, ftplib.error_perm):
+                    await self._release(session, discard=True)
+                    session = None
+        result = await _on_disk(_check_download, task, result['bytes_transferred'], hasher, contents)
+        return result, session
+
+    async def _retrieve(self, session, remote_path, partial, hasher, local_file, offset, finish):
+        """Transfer remote_path into the open part file after offset bytes (as FTPClient._retrieve_file)
+
+        finish() runs on the disk thread that writes the last data, once the
+        file is closed; its return value is the result.
+        """
+        try:
+            return await self._retrieve_into(session, remote_path, hasher, local_file, offset, finish)
+        except ftplib.error_perm:
+            if not offset:
+                raise
+            logger.info(f"Server refused to resume {remote_path}, downloading from the start")
+            local_file, offset = await _on_disk(_open_part, partial, hasher, 0)
+            return await self._retrieve_into(session, remote_path, hasher, local_file, 0, finish)
+
+    async def _retrieve_into(self, session, remote_path, hasher, local_file, offset, finish):
+        writer = _PartWriter(local_file, hasher.wrap(local_file.write))
+        try:
+            await session.retrieve(remote_path, self._writer(writer.write), self.client.block_size,
+                                   rest=offset or None)
+        except BaseException:
+            await writer.close()
+            raise
+        return await writer.close(finish)
+
+    def _writer(self, write):
+        """Data callback for AsyncFTPSession.retrieve(): await write, then wait out the bandwidth limits"""
+        throttle = self.client.throttle.download
+
+        async def throttled_write(data):
+            await write(data)
+            if throttle:
+                wait = throttle.reserve(len(data))
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+        return throttled_write
+
+
+class _PartWriter:
+    """Collects received data into an open part file, writing on a disk thread with one buffer in flight"""
+
+    def __init__(self, local_file, write):
+        self._file = local_file
+        self._write = write  # hashes and writes, on the disk thread
+        self._buffer = bytearray()
+        self._pending = None
+
+    async def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= WRITE_BUFFER_SIZE:
+            # The previous write has to be done first (and reports its errors here)
+            await self._wait()
+            self._pending = asyncio.ensure_future(_on_disk(self._write, self._take()))
+
+    def _take(self):
+        data, self._buffer = bytes(self._buffer), bytearray()
+        return data
+
+    async def _wait(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            await pending
+
+    async def close(self, then=None):
+        """Write what is left and close the file in one disk step, followed by then() if given (its result is returned)
+
+        After a failed transfer the data received so far is still written, so a
+        retry continues after it.
+        """
+        try:
+            await self._wait()
+        except BaseException:
+            await _on_disk(self._file.close)
+            raise
+        return await _on_disk(self._finish, self._take(), then)
+
+    def _finish(self, data, then):
+        with self._file:
+            if data:
+                self._write(data)
+        return then() if then else None
+
+
+def _appender(chunks):
+    async def append(data):
+        chunks.append(data)
+    return append
+
+
+def _exists(local_path):
+    """Whether a non-empty file is already at local_path"""
+    return os.path.exists(local_path) and os.path.getsize(local_path) > 0
+
+
+def _begin(task, remote_size, remote_mtime, hasher):
+    """Create the target's folder and its partial download, and open the part; (partial, file, offset)"""
+    local_dir = os.path.dirname(task['local_path'])
+    if local_dir:
+        os.makedirs(local_dir, exist_ok=True)
+    partial = PartialDownload(task['local_path'], task['remote_path'], remote_size, remote_mtime)
+    return (partial,) + _open_part(partial, hasher)
+
+
+def _open_part(partial, hasher, offset=None):
+    """Open partial's part to continue after offset bytes (default all it holds), hashing those; (file, offset)"""
+    if offset is None:
+        offset = partial.offset()
+    hasher.reset()
+    if offset:
+        hasher.update_from_file(partial.path, offset)
+    return open_part(partial.path, offset, partial.remote_size), offset
+
+
+def _complete(task, partial, local_writes, hasher):
+    """Move the finished part into place; the checked result if hasher is given, else the unchecked one
+
+    A part that cannot be completed (size mismatch, disk error) fails the
+    download here rather than as a transfer error, since the session is fine.
+    """
+    try:
+        file_size = partial.complete(local_writes)
+    except Exception as e:
+        _discard_failed(task, partial)
+        return {'success': False, 'error': f"Failed to download {task['remote_path']}: {str(e) or type(e).__name__}"}
+    if hasher is None:
+        return {'success': True, 'bytes_transferred': file_size}
+    return _check_download(task, file_size, hasher, {})
+
+
+def _discard_failed(task, partial):
+    """Clean up after a failed download: a part without progress, and the target if the task needs content"""
+    if partial is not None and not partial.has_progress():
+        partial.discard()
+    if task['require_content'] and os.path.exists(task['local_path']):
+        os.remove(task['local_path'])
+
+
+def _check_download(task, file_size, hasher, contents):
+    """Result of a completed download: its sidecars checked, and empty files rejected if the task needs content"""
+    local_path = task['local_path']
+    result = check_sidecars({'success': True, 'bytes_transferred': file_size}, local_path, hasher, contents)
+    if task['require_content']:
+        if result['success'] and result['bytes_transferred'] == 0:
+            os.remove(local_path)
+            result = {'success': False, 'error': 'empty file (0 bytes)'}
+        elif not result['success'] and os.path.exists(local_path):
+            os.remove(local_path)
+    return result
+
+
+async def _start_downloads(client, max_workers, initial_workers):
+    return _Downloads(client, max_workers, initial_workers)
+
+
+def download_tasks(client, tasks, max_workers=1, initial_workers=None):
+    """Download tasks over up to max_workers async sessions of client's site, from a synchronous caller
+
+    tasks may be an iterable that is still producing them, such as a tree
+    scan: initial_workers sessions (default max_workers) start with the first
+    task and the rest join once it is exhausted. Returns the tasks, their
+    results in the same order (None where no session got to a task) and the
+    number of sessions used.
+    """
+    max_workers = max(1, int(max_workers or 1))
+    initial_workers = max(1, min(int(initial_workers or max_workers), max_workers))
+    # Back to the pool, where one of the async sessions leases it again
+    client.release_session()
+    downloads = transfer_loop.run(_start_downloads(client, max_workers, initial_workers))
+    try:
+        for task in tasks:
+            transfer_loop.call(downloads.add, task)
+    finally:
+        transfer_loop.call(downloads.finish)
+        tasks, results, sessions = transfer_loop.run(downloads.wait())
+    logger.debug(f"Downloaded {len(tasks)} files from {client.host} over {sessions} async sessions")
+    return tasks, results, sessions
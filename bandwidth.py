@@ -0,0 +1,307 @@
+"""
+Bandwidth shaping for transfers.
+
+Transfers draw from up to three token buckets: one global, one per site and
+one per job. Each bucket has a base limit and an optional time-of-day
+schedule that overrides it, one window per line:
+
+    01:00-05:00 unlimited
+    08:00-18:00 10
+
+(times are server local time, windows may wrap past midnight, rates are
+Mbit/s). The first window containing the current time wins; outside all
+windows the base limit applies, and no limit means full speed.
+
+Downloads and uploads have a bucket each per limit (see TransferThrottle).
+The transfer callbacks (FTP/SFTP writes and reads, NFS copies, relay
+streams) call Throttle.consume() for every chunk. To keep locks out of the
+per-chunk path, each thread takes tokens from the buckets in quanta of about
+1/20 of a second of traffic and spends them locally; a bucket's lock is only
+taken once per quantum. Buckets go into debt rather than refusing, and the
+thread that took the quantum sleeps until the debt is paid off, so parallel
+transfers share a limit fairly. The same grants feed each bucket's rate
+meter, so the current rate is accurate to within a quantum per transfer.
+"""
+import logging
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+BYTES_PER_MBIT = 125000
+QUANTA_PER_SECOND = 20  # a thread takes tokens about this often at the limit
+MIN_QUANTUM = 64 * 1024
+UNLIMITED_QUANTUM = 4 * 1024 * 1024  # only for the rate meter when nothing is limited
+RATE_WINDOW = 5.0  # seconds the current rate is averaged over
+
+_WINDOW_LINE = re.compile(r'^(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s+(\S+)$')
+
+
+def parse_schedule(text):
+    """[(start minute, end minute, bytes per second or None)] from a schedule; raises ValueError"""
+    windows = []
+    for number, line in enumerate((text or '').splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        match = _WINDOW_LINE.match(line)
+        if not match:
+            raise ValueError(f"Schedule line {number}: expected 'HH:MM-HH:MM <Mbit/s or unlimited>', got '{line}'")
+        start_hour, start_minute, end_hour, end_minute, rate = match.groups()
+        start = int(start_hour) * 60 + int(start_minute)
+        end = int(end_hour) * 60 + int(end_minute)
+        if start >= 24 * 60 or end > 24 * 60 or int(start_minute) > 59 or int(end_minute) > 59:
+            raise ValueError(f"Schedule line {number}: invalid time in '{line}'")
+        windows.append((start, end, _parse_rate(rate, number)))
+    return windows
+
+
+def _parse_rate(rate, number):
+    if rate.lower() in ('unlimited', 'full', 'off'):
+        return None
+    try:
+        mbps = float(rate)
+    except ValueError:
+        raise ValueError(f"Schedule line {number}: '{rate}' is not a rate in Mbit/s or 'unlimited'")
+    if mbps <= 0:
+        raise ValueError(f"Schedule line {number}: rate must be above 0 (use 'unlimited' for full speed)")
+    return mbps * BYTES_PER_MBIT
+
+
+def parse_limit(value):
+    """Limit in Mbit/s from a form field; None for empty or 0 (unlimited), ValueError if not a number"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    try:
+        mbps = float(value)
+    except ValueError:
+        raise ValueError(f"Bandwidth limit '{value}' is not a number of Mbit/s")
+    if mbps < 0:
+        raise ValueError("Bandwidth limit cannot be negative")
+    return mbps or None
+
+
+def limit_bytes(mbps):
+    """Bytes per second for a limit in Mbit/s; None (unlimited) for empty or 0"""
+    return float(mbps) * BYTES_PER_MBIT if mbps else None
+
+
+class TokenBucket:
+    """A rate limit with a time-of-day schedule, shared by every transfer it applies to"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._base = None  # bytes per second outside schedule windows, None = unlimited
+        self._windows = []
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._grants = deque()  # (monotonic time, bytes) within RATE_WINDOW, for the rate meter
+        self._granted = 0
+        self.last_used = 0.0
+
+    def configure(self, base, windows=()):
+        """Set the limit (bytes per second or None) and schedule windows from parse_schedule()"""
+        with self._lock:
+            self._base = base
+            self._windows = list(windows)
+
+    def limit(self, now=None):
+        """Bytes per second in effect now, None if unlimited"""
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self._windows:
+            if start <= minute < end or (end <= start and (minute >= start or minute < end)):
+                return rate
+        return self._base
+
+    @property
+    def limited(self):
+        return self._base is not None or any(rate is not None for _, _, rate in self._windows)
+
+    def take(self, size):
+        """Take size bytes of tokens; returns how many seconds the caller has to wait for them"""
+        with self._lock:
+            now = time.monotonic()
+            self._meter(now, size)
+            rate = self.limit()
+            if rate is None:
+                self._tokens = 0.0
+                self._updated = now
+                return 0.0
+            # At most one second of burst builds up while idle
+            self._tokens = min(rate, self._tokens + (now - self._updated) * rate) - size
+            self._updated = now
+            return -self._tokens / rate if self._tokens < 0 else 0.0
+
+    def _meter(self, now, size):
+        self._grants.append((now, size))
+        self._granted += size
+        while self._grants and now - self._grants[0][0] > RATE_WINDOW:
+            self._granted -= self._grants.popleft()[1]
+        self.last_used = now
+
+    def quantum(self):
+        """Tokens a thread takes at once from this bucket"""
+        rate = self.limit()
+        return max(MIN_QUANTUM, int(rate / QUANTA_PER_SECOND)) if rate else UNLIMITED_QUANTUM
+
+    def status(self):
+        """{'limit', 'rate'} in bytes per second (limit None = unlimited)"""
+        with self._lock:
+            now = time.monotonic()
+            while self._grants and now - self._grants[0][0] > RATE_WINDOW:
+                self._granted -= self._grants.popleft()[1]
+            rate = self._granted / RATE_WINDOW if self._grants else 0.0
+        return {'limit': self.limit(), 'rate': rate}
+
+
+class Throttle:
+    """What one direction of a transfer client draws from: its buckets, with a per-thread token allowance"""
+
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self._local = threading.local()
+
+    def __bool__(self):
+        return bool(self.buckets)
+
+    @property
+    def limited(self):
+        """Whether any of the buckets has a limit (now or at some time of day)"""
+        return any(bucket.limited for bucket in self.buckets)
+
+    def consume(self, size):
+        """Account for size bytes, sleeping when a bucket is over its limit"""
+        wait = self.reserve(size)
+        if wait > 0:
+            time.sleep(wait)
+
+    def reserve(self, size):
+        """Account for size bytes without sleeping; returns the seconds the caller has to wait before sending more
+
+        For the asyncio transfer core, which waits with asyncio.sleep() instead.
+        """
+        allowance = getattr(self._local, 'allowance', 0) - size
+        wait = 0.0
+        if allowance < 0:
+            quantum = max(-allowance, min(bucket.quantum() for bucket in self.buckets))
+            wait = max(bucket.take(quantum) for bucket in self.buckets)
+            allowance += quantum
+        self._local.allowance = allowance
+        return wait
+
+    def wrap(self, write):
+        """write, consuming each chunk first; write itself if there is nothing to throttle"""
+        if not self.buckets:
+            return write
+
+        def throttled_write(data):
+            self.consume(len(data))
+            return write(data)
+
+        return throttled_write
+
+    def iterate(self, chunks):
+        """Yield chunks, consuming each one on the way"""
+        if not self.buckets:
+            yield from chunks
+            return
+        for data in chunks:
+            self.consume(len(data))
+            yield data
+
+    def reader(self, file_object):
+        """File object whose reads are consumed, for ftplib's storbinary"""
+        return _ThrottledReader(file_object, self) if self.buckets else file_object
+
+
+class _ThrottledReader:
+    def __init__(self, file_object, throttle):
+        self._file = file_object
+        self._throttle = throttle
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self._throttle.consume(len(data))
+        return data
+
+
+class TransferThrottle:
+    """A client's throttles: downloads and uploads draw from separate buckets of the same limits
+
+    A limit applies to each direction on its own, the way a link's capacity
+    does, so a relay (which reads and writes the same bytes) or a staged
+    upload is not counted twice.
+    """
+
+    def __init__(self, download, upload):
+        self.download = download
+        self.upload = upload
+
+
+class BandwidthManager:
+    """The global, per-site and per-job buckets, kept for the life of the process"""
+
+    DIRECTIONS = ('download', 'upload')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> {direction: TokenBucket}
+
+    def buckets(self, key):
+        """{direction: TokenBucket} for key ('global', ('site', id) or ('job', id))"""
+        with self._lock:
+            buckets = self._buckets.get(key)
+            if buckets is None:
+                buckets = self._buckets[key] = {direction: TokenBucket(f"{key} {direction}")
+                                                for direction in self.DIRECTIONS}
+            return buckets
+
+    def configure(self, key, mbps, schedule=None):
+        """Set key's base limit (Mbit/s, empty = unlimited) and schedule text"""
+        try:
+            windows = parse_schedule(schedule)
+        except ValueError as e:
+            # Schedules are validated when saved; an old invalid one only loses its windows
+            logger.warning(f"Ignoring bandwidth schedule of {key}: {str(e)}")
+            windows = []
+        for bucket in self.buckets(key).values():
+            bucket.configure(limit_bytes(mbps), windows)
+
+    def throttle(self, site=None, job=None):
+        """Throttle for a client: the global buckets plus the site's and job's (from their current settings)"""
+        keys = ['global']
+        if site is not None:
+            self.configure(('site', site.id), site.bandwidth_limit_mbps, site.bandwidth_schedule)
+            keys.append(('site', site.id))
+        if job is not None:
+            self.configure(('job', job.id), job.bandwidth_limit_mbps, job.bandwidth_schedule)
+            keys.append(('job', job.id))
+        # Unlimited buckets still meter the rate, so the API shows what every site and job moves
+        buckets = [self.buckets(key) for key in keys]
+        return TransferThrottle(*(Throttle(bucket[direction] for bucket in buckets) for direction in self.DIRECTIONS))
+
+    def status(self, active_within=60.0):
+        """Limit and current download/upload rates of the global buckets and of each site and job used lately"""
+        with self._lock:
+            entries = list(self._buckets.items())
+        now = time.monotonic()
+        result = {'global': None, 'sites': {}, 'jobs': {}}
+        for key, buckets in entries:
+            download, upload = buckets['download'].status(), buckets['upload'].status()
+            entry = {'limit': download['limit'], 'download_rate': download['rate'], 'upload_rate': upload['rate']}
+            if key == 'global':
+                result['global'] = entry
+            elif (download['limit'] is not None or download['rate'] or upload['rate']
+                  or now - max(bucket.last_used for bucket in buckets.values()) <= active_within):
+                result['sites' if key[0] == 'site' else 'jobs'][key[1]] = entry
+        return result
+
+
+# Single manager shared by all clients in the process
+bandwidth_manager = BandwidthManager()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark file_copy.copy_file against shutil.copy2.
+
+Creates one large file and many small ones in SOURCE_DIR and copies them to
+DEST_DIR with shutil.copy2 and with copy_file limited to each of its
+methods, then copies the small files in parallel the way the transfer engine
+does for an NFS site. Point SOURCE_DIR at an NFS mount or network drive and
+DEST_DIR at local disk (or the other way round) to measure a real setup; by
+default both are temporary directories on the same filesystem, which is a
+tmpfs or ext4 stand-in.
+
+Usage:
+    python benchmark_file_copy.py [SOURCE_DIR [DEST_DIR]] [WORKERS ...]
+
+The source files stay in the page cache after the first pass, so the numbers
+compare the copy paths rather than the disks.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from file_copy import copy_file
+
+LARGE_FILE_SIZE = 512 * 1024 * 1024
+SMALL_FILE_SIZE = 256 * 1024
+SMALL_FILE_COUNT = 1000
+
+CONFIGURATIONS = [
+    # (label, copy function)
+    ('shutil.copy2', shutil.copy2),
+    ('copy_file read/write', lambda source, dest: copy_file(source, dest, methods=('read/write',))),
+    ('copy_file sendfile', lambda source, dest: copy_file(source, dest, methods=('sendfile',))),
+    ('copy_file copy_file_range', lambda source, dest: copy_file(source, dest, methods=('copy_file_range',))),
+    ('copy_file (all methods)', copy_file),
+]
+
+
+def make_files(source_dir):
+    large = os.path.join(source_dir, 'large.bin')
+    with open(large, 'wb') as large_file:
+        for _ in range(LARGE_FILE_SIZE // (16 * 1024 * 1024)):
+            large_file.write(os.urandom(16 * 1024 * 1024))
+    small = []
+    for index in range(SMALL_FILE_COUNT):
+        path = os.path.join(source_dir, f"small_{index:05d}.bin")
+        with open(path, 'wb') as small_file:
+            small_file.write(os.urandom(SMALL_FILE_SIZE))
+        small.append(path)
+    return large, small
+
+
+def timed(label, size, func, *args):
+    start = time.monotonic()
+    func(*args)
+    elapsed = time.monotonic() - start
+    print(f"  {label:<28} {elapsed:7.2f}s  {size / elapsed / 1048576:8.1f} MB/s")
+
+
+def copy_serial(copy, sources, dest_dir):
+    for source in sources:
+        copy(source, os.path.join(dest_dir, os.path.basename(source)))
+
+
+def copy_parallel(copy, sources, dest_dir, workers):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda source: copy(source, os.path.join(dest_dir, os.path.basename(source))), sources))
+
+
+def run(source_dir, dest_dir, worker_counts):
+    source_dir = tempfile.mkdtemp(prefix='copy_bench_src_', dir=source_dir)
+    dest_dir = tempfile.mkdtemp(prefix='copy_bench_dst_', dir=dest_dir)
+    try:
+        large, small = make_files(source_dir)
+        small_size = SMALL_FILE_SIZE * SMALL_FILE_COUNT
+        print(f"{source_dir} -> {dest_dir}")
+
+        print(f" one file of {LARGE_FILE_SIZE // 1048576} MB")
+        for label, copy in CONFIGURATIONS:
+            timed(label, LARGE_FILE_SIZE, copy, large, os.path.join(dest_dir, 'large.bin'))
+
+        print(f" {SMALL_FILE_COUNT} files of {SMALL_FILE_SIZE // 1024} KB")
+        for label, copy in CONFIGURATIONS:
+            timed(label, small_size, copy_serial, copy, small, dest_dir)
+
+        print(f" {SMALL_FILE_COUNT} files of {SMALL_FILE_SIZE // 1024} KB in parallel")
+        for workers in worker_counts:
+            timed(f"shutil.copy2 x {workers}", small_size, copy_parallel, shutil.copy2, small, dest_dir, workers)
+            timed(f"copy_file x {workers}", small_size, copy_parallel, copy_file, small, dest_dir, workers)
+    finally:
+        shutil.rmtree(source_dir, ignore_errors=True)
+        shutil.rmtree(dest_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    directories = [argument for argument in arguments if not argument.isdigit()]
+    workers = [int(argument) for argument in arguments if argument.isdigit()] or [4, 8]
+    run(directories[0] if directories else None, directories[1] if len(directories) > 1 else None, workers)
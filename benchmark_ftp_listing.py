@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark FTP directory listing: commands sent and time taken.
+
+Compares the old list_files approach (NLST, then NOOP + MLSD for every
+name) with the current FTPClient.list_files (one MLSD, or LIST when the
+server has no MLSD). Commands are counted on the client side, so any server
+can be used.
+
+Usage:
+    python benchmark_ftp_listing.py HOST PORT USERNAME PASSWORD REMOTE_DIR [CREATE_FILES]
+
+With CREATE_FILES, a temporary folder with that many small files is created
+under REMOTE_DIR for the run and removed afterwards.
+"""
+import ftplib
+import io
+import sys
+import time
+
+from ftp_client import FTPClient
+
+command_count = 0
+_putcmd = ftplib.FTP.putcmd
+
+
+def counting_putcmd(self, line):
+    global command_count
+    command_count += 1
+    return _putcmd(self, line)
+
+
+ftplib.FTP.putcmd = counting_putcmd
+
+
+def legacy_list_files(ftp, remote_path):
+    """list_files as it was: NLST plus a NOOP and an MLSD per file"""
+    ftp.cwd(remote_path)
+    files = []
+    for filename in ftp.nlst():
+        try:
+            ftp.voidcmd('NOOP')
+            for name, facts in ftp.mlsd(filename):
+                if name == filename:
+                    files.append({'name': name, 'size': int(facts.get('size', 0)),
+                                  'modify': facts.get('modify', ''),
+                                  'type': 'directory' if facts.get('type') == 'dir' else 'file'})
+                    break
+        except ftplib.error_perm:
+            files.append({'name': filename, 'size': 0, 'modify': '', 'type': 'file'})
+    return files
+
+
+def measure(label, func, *args):
+    global command_count
+    command_count = 0
+    start = time.monotonic()
+    entries = func(*args)
+    elapsed = time.monotonic() - start
+    print(f"  {label:<22} {len(entries):7d} entries  {command_count:7d} commands  {elapsed:8.2f}s")
+
+
+def run(host, port, username, password, remote_dir, create_files=0):
+    client = FTPClient('ftp', host, port, username, password)
+    ftp = ftplib.FTP()
+    ftp.connect(host, port, timeout=30)
+    ftp.login(username, password)
+
+    bench_dir = remote_dir
+    if create_files:
+        bench_dir = f"{remote_dir.rstrip('/')}/listing_bench_{int(time.time())}"
+        ftp.mkd(bench_dir)
+        for index in range(create_files):
+            ftp.storbinary(f"STOR {bench_dir}/cdr_{index:06d}.csv", io.BytesIO(b'x' * 64))
+        print(f"Created {create_files} files in {bench_dir}")
+
+    try:
+        client.connect()
+        print(f"Listing {bench_dir}")
+        measure('NLST + MLSD per file', legacy_list_files, ftp, bench_dir)
+        measure('list_files', lambda: client.list_files(bench_dir)['files'])
+    finally:
+        client.disconnect(discard=True)
+        if create_files:
+            ftp.cwd('/')
+            for name in ftp.nlst(bench_dir):
+                ftp.delete(name if '/' in name else f"{bench_dir}/{name}")
+            ftp.rmd(bench_dir)
+        ftp.quit()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 6:
+        print(__doc__)
+        sys.exit(1)
+    run(sys.argv[1], int(sys.argv[2]), sys.argv[3], sys.argv[4], sys.argv[5],
+        int(sys.argv[6]) if len(sys.argv) > 6 else 0)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark the FTP listing parser.
+
+Generates synthetic LIST (Unix and MS-DOS/IIS) and MLSD listings and times
+ftp_list_parser against the old split()-based parsing, which only understood
+Unix lines and returned names and the directory flag.
+
+Usage:
+    python benchmark_list_parser.py [LINES]
+
+LINES defaults to 1,000,000 per listing.
+"""
+import random
+import sys
+import time
+
+from ftp_list_parser import parse_list, entry_from_mlsd, to_record
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def unix_listing(count):
+    rng = random.Random(1)
+    lines = ['total 123456']
+    for index in range(count):
+        is_dir = index % 50 == 0
+        stamp = f"{rng.randint(10, 23)}:{rng.randint(10, 59)}" if index % 3 else f" {rng.randint(2015, 2025)}"
+        lines.append(f"{'d' if is_dir else '-'}rw-r--r--   1 ftpuser  ftpgroup {rng.randint(0, 10 ** 9):>10} "
+                     f"{MONTHS[index % 12]} {rng.randint(1, 28):>2} {stamp:>5} cdr_{index:07d}.csv")
+    return lines
+
+
+def dos_listing(count):
+    rng = random.Random(2)
+    lines = []
+    for index in range(count):
+        size = '<DIR>         ' if index % 50 == 0 else f"{rng.randint(0, 10 ** 9):>14}"
+        lines.append(f"{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}-{rng.randint(15, 25)}  "
+                     f"{rng.randint(1, 12):02d}:{rng.randint(10, 59)}{'AM' if index % 2 else 'PM'}       {size} cdr_{index:07d}.csv")
+    return lines
+
+
+def mlsd_listing(count):
+    """(name, facts) pairs as ftplib's mlsd() yields them"""
+    rng = random.Random(3)
+    return [(f"cdr_{index:07d}.csv",
+             {'type': 'dir' if index % 50 == 0 else 'file', 'size': str(rng.randint(0, 10 ** 9)),
+              'modify': f"2025{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}101010", 'unix.mode': '0644'})
+            for index in range(count)]
+
+
+def split_parse(lines):
+    """The per-call parsing download_all_files used before"""
+    entries = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) >= 9:
+            filename = ' '.join(parts[8:])
+            if filename not in ['.', '..']:
+                entries.append((filename, parts[0].startswith('d')))
+    return entries
+
+
+def timed(label, count, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<38} {len(result):>9} entries {elapsed:7.2f}s  {count / elapsed / 1e6:6.2f} M lines/s")
+
+
+def run(count):
+    print(f"{count:,} lines per listing")
+    unix = unix_listing(count)
+    dos = dos_listing(count)
+    mlsd = mlsd_listing(count)
+
+    timed('unix: split() (names + dir flag only)', count, split_parse, unix)
+    timed('unix: parse_list, dialect detected', count, parse_list, unix)
+    timed('unix: parse_list, dialect cached', count, parse_list, unix, 'bench-unix')
+    timed('unix: parse_list + mtime of every entry', count,
+          lambda lines: [e.mtime for e in parse_list(lines, 'bench-unix')], unix)
+    timed('unix: parse_list + to_record (list_files)', count,
+          lambda lines: [to_record(e) for e in parse_list(lines, 'bench-unix')], unix)
+    timed('dos: split() (misparses)', count, split_parse, dos)
+    timed('dos: parse_list, dialect cached', count, parse_list, dos, 'bench-dos')
+    timed('mlsd: entry_from_mlsd + to_record', count,
+          lambda pairs: [to_record(entry_from_mlsd(name, facts)) for name, facts in pairs], mlsd)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Benchmark SFTP throughput against link latency.
+
+Connects to an SFTP server through a local TCP proxy that delays traffic by a
+fixed one-way latency, then times the same download and upload with
+one-request-at-a-time reads/writes and with the pipelined path from
+sftp_transfer.py at several block sizes and prefetch windows.
+
+Usage:
+    python benchmark_sftp_pipelining.py HOST PORT USERNAME PASSWORD REMOTE_FILE [RTT_MS ...]
+
+Use a file of 8-32 MB; the unpipelined runs get slow quickly as RTT grows.
+"""
+import os
+import queue
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import paramiko
+
+from sftp_transfer import pipelined_get, pipelined_put
+
+CONFIGURATIONS = [
+    # (label, block size, prefetch window)
+    ('pipelined 32K x 16', 32768, 16),
+    ('pipelined 32K x 64', 32768, 64),
+    ('pipelined 128K x 64', 131072, 64),
+]
+
+
+class LatencyProxy:
+    """Local TCP proxy adding one_way_delay seconds in each direction"""
+
+    def __init__(self, host, port, one_way_delay):
+        self.upstream = (host, port)
+        self.delay = one_way_delay
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            server = socket.create_connection(self.upstream)
+            for source, target in ((client, server), (server, client)):
+                source.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                pending = queue.Queue()
+                threading.Thread(target=self._receive, args=(source, pending), daemon=True).start()
+                threading.Thread(target=self._deliver, args=(target, pending), daemon=True).start()
+
+    def _receive(self, sock, pending):
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                data = b''
+            pending.put((time.monotonic() + self.delay, data))
+            if not data:
+                return
+
+    def _deliver(self, sock, pending):
+        while True:
+            due, data = pending.get()
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            if not data:
+                try:
+                    sock.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+                return
+            try:
+                sock.sendall(data)
+            except OSError:
+                return
+
+    def close(self):
+        self.listener.close()
+
+
+def unpipelined_get(sftp, remote_path, local_path, block_size=32768):
+    """One read request per round trip, as a plain file read loop does"""
+    with sftp.open(remote_path, 'rb') as remote_file, open(local_path, 'wb') as local_file:
+        while True:
+            data = remote_file.read(block_size)
+            if not data:
+                break
+            local_file.write(data)
+
+
+def unpipelined_put(sftp, local_path, remote_path, block_size=32768):
+    """One write request per round trip"""
+    with open(local_path, 'rb') as local_file, sftp.open(remote_path, 'wb') as remote_file:
+        while True:
+            data = local_file.read(block_size)
+            if not data:
+                break
+            remote_file.write(data)
+
+
+def timed(label, size, func, *args):
+    start = time.monotonic()
+    func(*args)
+    elapsed = time.monotonic() - start
+    print(f"  {label:<24} {elapsed:7.2f}s  {size / elapsed / 1048576:8.2f} MB/s")
+
+
+def run(host, port, username, password, remote_file, rtts):
+    work_dir = tempfile.mkdtemp(prefix='sftp_bench_')
+    local_copy = os.path.join(work_dir, 'download.bin')
+    upload_target = f"{remote_file}.bench_upload"
+
+    for rtt in rtts:
+        proxy = LatencyProxy(host, port, rtt / 2000.0)
+        transport = paramiko.Transport(('127.0.0.1', proxy.port))
+        transport.connect(username=username, password=password)
+        sftp = paramiko.SFTPClient.from_transport(transport)
+        size = sftp.stat(remote_file).st_size
+
+        print(f"RTT {rtt} ms, {size / 1048576:.1f} MB")
+        print(" download")
+        timed('unpipelined 32K', size, unpipelined_get, sftp, remote_file, local_copy)
+        for label, block_size, window in CONFIGURATIONS:
+            timed(label, size, pipelined_get, sftp, remote_file, local_copy, block_size, window)
+
+        print(" upload")
+        timed('unpipelined 32K', size, unpipelined_put, sftp, local_copy, upload_target)
+        for label, block_size, _ in CONFIGURATIONS[1:]:
+            timed(label.rsplit(' x ', 1)[0], size, pipelined_put, sftp, local_copy, upload_target, block_size)
+
+        try:
+            sftp.remove(upload_target)
+        except IOError:
+            pass
+        sftp.close()
+        transport.close()
+        proxy.close()
+
+    os.remove(local_copy)
+    os.rmdir(work_dir)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 6:
+        print(__doc__)
+        sys.exit(1)
+    rtt_values = [int(value) for value in sys.argv[6:]] or [0, 20, 50, 100]
+    run(sys.argv[1], int(sys.argv[2]), sys.argv[3], sys.argv[4], sys.argv[5], rtt_values)
@@ -0,0 +1,133 @@
+"""
+What this host can do for NFS and CIFS mounts.
+
+Whether mount helpers are installed, whether sudo works without a password
+and which filesystems the kernel knows do not change while the process runs,
+but they used to be re-checked with a `which` or `sudo -n` subprocess on
+every mount, connection test and page view. They are now probed once - at
+startup, or on first use - and kept in a registry:
+
+- helpers: the mount helpers and tools found on PATH or in the sbin
+  directories (mount.nfs, mount.nfs4, mount.cifs, showmount, mountpoint)
+- sudo: whether `sudo -n mount --help` succeeds
+- kernel filesystems: the nfs/nfs4/cifs/smb3 entries of /proc/filesystems.
+  Modules are loaded on first mount, so a missing entry is informational
+  and does not block mounting
+- container: whether the process runs in a Docker or Podman container
+
+refresh() probes again, e.g. after installing nfs-common; the registry is
+exposed at /api/capabilities.
+"""
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MOUNT_HELPERS = ('mount.nfs', 'mount.nfs4', 'mount.cifs', 'showmount', 'mountpoint')
+KERNEL_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smb3')
+# Mount helpers live in sbin, which is not on every user's PATH
+_SEARCH_PATH = os.pathsep.join([os.environ.get('PATH', os.defpath), '/sbin', '/usr/sbin', '/usr/local/sbin'])
+
+
+def _find_helper(name):
+    return shutil.which(name, path=_SEARCH_PATH)
+
+
+def _probe_sudo():
+    """Whether sudo can run mount without asking for a password"""
+    if _find_helper('sudo') is None:
+        return False
+    try:
+        result = subprocess.run(['sudo', '-n', 'mount', '--help'], capture_output=True, text=True, timeout=5)
+        return result.returncode == 0
+    except Exception as e:
+        logger.debug(f"sudo check failed: {str(e)}")
+        return False
+
+
+def _probe_kernel_filesystems():
+    """The KERNEL_FILESYSTEMS listed in /proc/filesystems (empty where there is none)"""
+    try:
+        with open('/proc/filesystems', 'r') as f:
+            known = {line.split()[-1] for line in f if line.strip()}
+    except OSError:
+        return []
+    return [name for name in KERNEL_FILESYSTEMS if name in known]
+
+
+class Capabilities:
+    """Probe results, taken once and kept until refresh()"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._probe = None
+
+    def _current(self):
+        with self._lock:
+            if self._probe is None:
+                self._probe = self._run_probe()
+            return self._probe
+
+    def _run_probe(self):
+        start = time.monotonic()
+        helpers = {name: _find_helper(name) for name in MOUNT_HELPERS}
+        probe = {
+            'helpers': helpers,
+            'sudo': _probe_sudo(),
+            'kernel_filesystems': _probe_kernel_filesystems(),
+            'container': os.path.exists('/.dockerenv') or os.path.exists('/run/.containerenv'),
+            'probed_at': time.time()
+        }
+        missing = [name for name, path in helpers.items() if path is None]
+        logger.info(f"Mount capabilities probed in {time.monotonic() - start:.2f}s: "
+                    f"missing helpers {missing or 'none'}, sudo {'available' if probe['sudo'] else 'unavailable'}, "
+                    f"kernel filesystems {probe['kernel_filesystems'] or 'none loaded'}"
+                    f"{', in a container' if probe['container'] else ''}")
+        return probe
+
+    def refresh(self):
+        """Probe again and return the new snapshot"""
+        probe = self._run_probe()
+        with self._lock:
+            self._probe = probe
+        return self.snapshot()
+
+    def has_helper(self, name):
+        return self._current()['helpers'].get(name) is not None
+
+    @property
+    def sudo(self):
+        return self._current()['sudo']
+
+    @property
+    def container(self):
+        return self._current()['container']
+
+    def can_mount_nfs(self):
+        """NFS mounts need mount.nfs (or mount.nfs4) and sudo"""
+        return (self.has_helper('mount.nfs') or self.has_helper('mount.nfs4')) and self.sudo
+
+    def can_mount_cifs(self):
+        """CIFS mounts need mount.cifs and sudo"""
+        return self.has_helper('mount.cifs') and self.sudo
+
+    def snapshot(self):
+        """Everything the probe found, for the API"""
+        probe = self._current()
+        return {
+            'helpers': dict(probe['helpers']),
+            'sudo': probe['sudo'],
+            'kernel_filesystems': list(probe['kernel_filesystems']),
+            'container': probe['container'],
+            'can_mount_nfs': self.can_mount_nfs(),
+            'can_mount_cifs': self.can_mount_cifs(),
+            'probed_at': probe['probed_at']
+        }
+
+
+# Probed once for the whole process
+capabilities = Capabilities()
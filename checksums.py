@@ -0,0 +1,188 @@
+"""
+Streaming checksums for transfers.
+
+Checksums are computed from the bytes as they pass through a transfer (the
+download write callback, the upload read, the relay stream), so a file is not
+read a second time just to hash it. The exceptions are the bytes a resumed
+transfer already moved in an earlier attempt and segmented downloads, whose
+ranges arrive out of order; those are hashed from the local file.
+
+A checksum is written as '<algorithm>:<hex digest>', e.g. 'sha256:9f86d0...'.
+Downloads are compared with '<name>.sha256' / '<name>.md5' sidecar files
+that sit next to the file on the server, and uploads can be compared with a
+hash the server computes itself (FTP HASH/XSHA256/XMD5, SFTP check-file).
+
+xxh64 is much cheaper than SHA-256 on fast links but needs the optional
+xxhash package; without it sites configured for xxh64 fall back to SHA-256.
+"""
+import hashlib
+import logging
+import os
+import re
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ALGORITHM = 'sha256'
+SIDECAR_SUFFIXES = (('.sha256', 'sha256'), ('.md5', 'md5'))
+HASH_CHUNK_SIZE = 1024 * 1024  # read size when a file has to be hashed from disk
+
+_HEX_DIGEST = re.compile(r'\b([0-9a-fA-F]{32,128})\b')
+
+
+def available_algorithms():
+    """Algorithms a site can be configured with on this host"""
+    return ['sha256', 'md5'] + (['xxh64'] if xxhash is not None else [])
+
+
+def algorithm_choices():
+    """(value, label) pairs for the site form"""
+    labels = {'sha256': 'SHA-256', 'md5': 'MD5', 'xxh64': 'xxHash64 (fastest, not cryptographic)'}
+    return [(algorithm, labels[algorithm]) for algorithm in available_algorithms()] + [('none', 'Off')]
+
+
+def normalize_algorithm(algorithm):
+    """The algorithm to use for a site setting; None when checksums are switched off"""
+    algorithm = (algorithm or '').lower()
+    if algorithm in ('', 'none'):
+        return None
+    if algorithm not in available_algorithms():
+        logger.warning(f"Checksum algorithm {algorithm} is not available, using {DEFAULT_ALGORITHM}")
+        return DEFAULT_ALGORITHM
+    return algorithm
+
+
+def new_hash(algorithm):
+    if algorithm == 'xxh64':
+        return xxhash.xxh64()
+    return hashlib.new(algorithm)
+
+
+def format_checksum(algorithm, hexdigest):
+    return f"{algorithm}:{hexdigest}"
+
+
+class StreamHasher:
+    """Feeds every chunk of a transfer to one hash per algorithm"""
+
+    def __init__(self, algorithms):
+        self.algorithms = list(dict.fromkeys(algorithm for algorithm in algorithms if algorithm))
+        self.reset()
+
+    def __bool__(self):
+        return bool(self.algorithms)
+
+    def reset(self):
+        """Start over, e.g. when a transfer restarts from the first byte"""
+        self._hashes = [(algorithm, new_hash(algorithm)) for algorithm in self.algorithms]
+
+    def update(self, data):
+        for _, digest in self._hashes:
+            digest.update(data)
+
+    def wrap(self, write):
+        """write, hashing each chunk on the way; write itself if there is nothing to compute"""
+        if not self._hashes:
+            return write
+
+        def hashing_write(data):
+            self.update(data)
+            return write(data)
+
+        return hashing_write
+
+    def iterate(self, chunks):
+        """Yield chunks, hashing each one on the way"""
+        for data in chunks:
+            self.update(data)
+            yield data
+
+    def update_from_file(self, path, length=None):
+        """Hash the first length bytes (default all) of a local file"""
+        if not self._hashes:
+            return
+        with open(path, 'rb') as local_file:
+            remaining = length
+            while remaining is None or remaining > 0:
+                data = local_file.read(HASH_CHUNK_SIZE if remaining is None else min(HASH_CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                self.update(data)
+                if remaining is not None:
+                    remaining -= len(data)
+
+    def hexdigest(self, algorithm):
+        for name, digest in self._hashes:
+            if name == algorithm:
+                return digest.hexdigest()
+        return None
+
+    def checksum(self, algorithm):
+        """Formatted checksum for algorithm, or None if it is not being computed"""
+        hexdigest = self.hexdigest(algorithm)
+        return format_checksum(algorithm, hexdigest) if hexdigest is not None else None
+
+
+class HashingReader:
+    """File object wrapper that hashes what is read from it, for ftplib's storbinary"""
+
+    def __init__(self, file_object, hasher):
+        self._file = file_object
+        self._hasher = hasher
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self._hasher.update(data)
+        return data
+
+
+def sidecars_for(remote_path, names):
+    """{algorithm: sidecar path} of the sidecar files listed next to remote_path, or None"""
+    name = remote_path.rsplit('/', 1)[-1]
+    sidecars = {algorithm: remote_path + suffix for suffix, algorithm in SIDECAR_SUFFIXES
+                if name + suffix in names}
+    return sidecars or None
+
+
+def parse_sidecar(data):
+    """The hex digest in a sidecar file ('<digest>  <name>' or BSD '<ALG> (<name>) = <digest>')"""
+    text = data.decode('utf-8', errors='replace')
+    if ' = ' in text:
+        text = text.rsplit(' = ', 1)[1]
+    match = _HEX_DIGEST.search(text)
+    return match.group(1).lower() if match else None
+
+
+def check_sidecars(result, local_path, hasher, sidecar_contents):
+    """Add the checksum to a download result and compare it with the contents of the file's sidecars
+
+    sidecar_contents maps each algorithm to (sidecar path, bytes read from it).
+    A file that does not match is removed and the download fails; a sidecar
+    without a digest in it only leaves the file unverified.
+    """
+    verified = False
+    for algorithm, (sidecar_path, data) in sidecar_contents.items():
+        expected = parse_sidecar(data)
+        if expected is None:
+            logger.warning(f"No checksum found in {sidecar_path}")
+            continue
+        actual = hasher.hexdigest(algorithm)
+        if actual != expected:
+            os.remove(local_path)
+            return {'success': False,
+                    'error': f'Checksum mismatch: {algorithm} {actual}, {os.path.basename(sidecar_path)} has {expected}'}
+        verified = True
+
+    result['checksum'] = hasher.checksum(hasher.algorithms[0]) if hasher else None
+    result['verified'] = verified
+    return result
+
+
+def checksum_lines(tasks):
+    """Job log record of the checksums of transferred tasks, one '<checksum>  <name>' line each"""
+    lines = [f"{task['checksum']}  {task['name']}" for task in tasks if task.get('checksum')]
+    return '\n'.join(lines) or None
@@ -0,0 +1,200 @@
+"""
+On-the-wire compression for FTP and SFTP transfers.
+
+FTP uses MODE Z (deflate on the data connection) when the server announces
+it in FEAT; SFTP uses SSH transport compression (zlib@openssh.com / zlib),
+which paramiko negotiates when the session is opened. Text such as CDRs and
+logs shrinks about tenfold, but on a fast link or with already compressed
+files the CPU time costs more than the bytes saved, so each site is set to
+'on', 'off' or 'auto'.
+
+In 'auto' a site is probed when its first transfer starts, in a background
+scheduler job (scheduler.queue_site_check) while that transfer goes ahead
+uncompressed: a sample file from its remote path is read raw and compressed
+on fresh sessions and the faster one wins. The outcome is stored on the site (compression_enabled,
+compression_probe, compression_probed_at) and reused by every job until it
+is PROBE_MAX_AGE old - PROBE_RETRY_AGE after a failed probe - or the probe is
+run again from the sites page.
+
+Only whole files starting at byte 0 are sent compressed over FTP: a resumed
+transfer or a byte range continues in stream mode, since servers disagree on
+what a REST offset means in MODE Z. Files below MIN_COMPRESSED_SIZE also stay
+in stream mode because switching MODE costs two round trips.
+"""
+import ftplib
+import logging
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sftp_transfer import pipelined_read
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_CHOICES = [('auto', 'Auto (probed monthly)'), ('on', 'On'), ('off', 'Off')]
+MIN_COMPRESSED_SIZE = 64 * 1024  # smaller FTP files are sent in stream mode
+COMPRESSION_LEVEL = 6  # zlib level for MODE Z uploads; 6 is what servers use by default
+
+PROBE_MIN_SIZE = 256 * 1024  # sample files for the probe are between these sizes
+PROBE_MAX_SIZE = 16 * 1024 * 1024
+PROBE_MARGIN = 1.1  # compression must be at least 10% faster to be switched on
+PROBE_MAX_AGE = timedelta(days=30)  # 'auto' sites are probed again after this long
+PROBE_RETRY_AGE = timedelta(days=1)  # ... or this long after a failed probe
+PROBE_FAILED = 'Probe failed:'  # how compression_probe starts after a failed probe
+
+
+def compression_setting(site):
+    """Whether transfers for site are compressed, from its setting and its last probe"""
+    if site.compression == 'on':
+        return True
+    if site.compression == 'auto':
+        return bool(site.compression_enabled)
+    return False
+
+
+def needs_probe(site):
+    """Whether site is set to 'auto' and its last probe is missing or stale"""
+    if site.protocol not in ('ftp', 'sftp') or site.compression != 'auto':
+        return False
+    if site.compression_probed_at is None:
+        return True
+    failed = (site.compression_probe or '').startswith(PROBE_FAILED)
+    return datetime.utcnow() - site.compression_probed_at >= (PROBE_RETRY_AGE if failed else PROBE_MAX_AGE)
+
+
+def retrieve_compressed(ftp, command, callback, blocksize=8192):
+    """retrbinary in MODE Z: callback receives the inflated data"""
+    decompressor = zlib.decompressobj()
+    ftp.voidcmd('TYPE I')
+    with _mode_z(ftp):
+        with ftp.transfercmd(command) as connection:
+            while True:
+                data = connection.recv(blocksize)
+                if not data:
+                    break
+                data = decompressor.decompress(data)
+                if data:
+                    callback(data)
+            data = decompressor.flush()
+            if data:
+                callback(data)
+        return ftp.voidresp()
+
+
+def store_compressed(ftp, command, source, blocksize=8192):
+    """storbinary in MODE Z: data read from source is deflated on the way"""
+    compressor = zlib.compressobj(COMPRESSION_LEVEL)
+    ftp.voidcmd('TYPE I')
+    with _mode_z(ftp):
+        with ftp.transfercmd(command) as connection:
+            while True:
+                data = source.read(blocksize)
+                if not data:
+                    break
+                data = compressor.compress(data)
+                if data:
+                    connection.sendall(data)
+            connection.sendall(compressor.flush())
+        return ftp.voidresp()
+
+
+@contextmanager
+def _mode_z(ftp):
+    """Switch an FTP session to MODE Z for one transfer and back to stream mode after it"""
+    ftp.voidcmd('MODE Z')
+    try:
+        yield
+    except BaseException:
+        try:
+            ftp.voidcmd('MODE S')
+        except ftplib.all_errors as e:
+            # The session is broken and goes away with the transfer's own error
+            logger.debug(f"Cannot switch back to stream mode: {str(e)}")
+        raise
+    ftp.voidcmd('MODE S')
+
+
+def _format_rate(rate):
+    return f"{rate / (1024 * 1024):.1f} MB/s"
+
+
+def probe_compression(client, remote_path):
+    """Time reading a sample file raw and compressed on fresh sessions of client's site
+
+    Returns {'success', 'enabled', 'summary', 'raw_rate', 'compressed_rate'};
+    rates are in bytes per second. success is False if the probe could not
+    run, e.g. when there is no sample file of a suitable size.
+    """
+    if client.protocol not in ('ftp', 'sftp'):
+        return {'success': False, 'error': f'{client.protocol.upper()} has no wire compression'}
+    try:
+        sample = client.find_sample_file(remote_path, PROBE_MIN_SIZE, PROBE_MAX_SIZE)
+        if sample is None:
+            return {'success': False,
+                    'error': f'No file between {PROBE_MIN_SIZE // 1024} KB and {PROBE_MAX_SIZE // (1024 * 1024)} MB '
+                             f'in {remote_path} to probe with'}
+        sample_path, sample_size = sample
+
+        session = client._open_session(compress=True)
+        try:
+            if not _session_compresses(client, session):
+                return {'success': True, 'enabled': False, 'raw_rate': None, 'compressed_rate': None,
+                        'summary': f"{client.host} does not support {'MODE Z' if client.protocol == 'ftp' else 'compression'}"}
+            # Compressed first, so a server cache warmed by the first read can only favour raw transfers
+            compressed_rate = _read_rate(client, session, sample_path, compressed=True)
+        finally:
+            session.close()
+        session = client._open_session(compress=False)
+        try:
+            raw_rate = _read_rate(client, session, sample_path, compressed=False)
+        finally:
+            session.close()
+
+        enabled = compressed_rate >= raw_rate * PROBE_MARGIN
+        summary = (f"{sample_path.rsplit('/', 1)[-1]} ({sample_size} bytes): compressed {_format_rate(compressed_rate)}, "
+                   f"raw {_format_rate(raw_rate)} - compression {'on' if enabled else 'off'}")
+        logger.info(f"Compression probe for {client.host}: {summary}")
+        return {'success': True, 'enabled': enabled, 'summary': summary,
+                'raw_rate': raw_rate, 'compressed_rate': compressed_rate}
+    except Exception as e:
+        logger.error(f"Compression probe for {client.host} failed: {str(e)}")
+        return {'success': False, 'error': str(e)}
+
+
+def _session_compresses(client, session):
+    """Whether a session opened with compress=True really transfers compressed data"""
+    if client.protocol == 'ftp':
+        return client._mode_z_supported(session.connection)
+    # paramiko falls back to 'none' when the server offers no zlib method
+    return session.transport.remote_compression not in (None, 'none')
+
+
+def _read_rate(client, session, remote_path, compressed):
+    """Bytes per second reading remote_path on session, discarding the data"""
+    received = [0]
+
+    def count(data):
+        received[0] += len(data)
+
+    started = time.monotonic()
+    if client.protocol == 'ftp':
+        if compressed:
+            retrieve_compressed(session.connection, f'RETR {remote_path}', count, client.block_size)
+        else:
+            session.connection.retrbinary(f'RETR {remote_path}', count, client.block_size)
+    else:
+        # SFTP sessions were opened with or without transport compression
+        pipelined_read(session.connection, remote_path, count, client.block_size, client.prefetch_window)
+    return received[0] / max(time.monotonic() - started, 1e-6)
+
+
+def record_probe(site, result):
+    """Store a probe result on site (the caller commits)"""
+    site.compression_probed_at = datetime.utcnow()
+    if result['success']:
+        site.compression_enabled = result['enabled']
+        site.compression_probe = result['summary']
+    else:
+        site.compression_enabled = False
+        site.compression_probe = f"{PROBE_FAILED} {result['error']}"
@@ -0,0 +1,87 @@
+"""
+Shared fixtures for the behaviour tests: local FTP servers (pyftpdlib) with
+their own temporary root, so transfers run without any outside server.
+"""
+import logging
+import threading
+
+import pytest
+
+from connection_pool import connection_pool
+
+
+class FTPServer:
+    """A pyftpdlib server in a thread; user 'user', password 'secret', logged in to home"""
+
+    def __init__(self, root, home='/'):
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler
+        from pyftpdlib.ioloop import IOLoop
+        from pyftpdlib.servers import ThreadedFTPServer
+
+        logging.getLogger('pyftpdlib').setLevel(logging.WARNING)
+        self.root = str(root)
+        self.logins = 0
+        self.commands = []
+        server = self
+
+        class Handler(FTPHandler):
+            def on_login(self, username):
+                server.logins += 1
+                self.fs.cwd = home
+
+            def pre_process_command(self, line, cmd, arg):
+                server.commands.append(cmd)
+                return super().pre_process_command(line, cmd, arg)
+
+        authorizer = DummyAuthorizer()
+        authorizer.add_user('user', 'secret', self.root, perm='elradfmwMT')
+        Handler.authorizer = authorizer
+        Handler.permit_foreign_addresses = True
+        self._server = ThreadedFTPServer(('127.0.0.1', 0), Handler, ioloop=IOLoop())
+        self.port = self._server.address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'timeout': 0.1}, daemon=True)
+        self._thread.start()
+
+    def client(self, **kwargs):
+        from ftp_client import FTPClient
+        client = FTPClient('ftp', '127.0.0.1', self.port, 'user', 'secret', **kwargs)
+        if kwargs.get('max_connections'):
+            # what create_site_client does from the Site row
+            connection_pool.set_limit(client.pool_key, kwargs['max_connections'])
+        return client
+
+    def close(self):
+        self._server.close_all()
+        self._thread.join(5)
+
+
+@pytest.fixture(autouse=True)
+def upload_state_dir(tmp_path, monkeypatch):
+    """Upload records of the tests go to their temporary directory, not into the checkout"""
+    import resumable
+    path = tmp_path / 'transfer_state'
+    monkeypatch.setattr(resumable, 'UPLOAD_STATE_DIR', str(path))
+    return path
+
+
+@pytest.fixture
+def make_ftp_server(tmp_path_factory):
+    """Start local FTP servers on demand; pooled sessions to them are closed afterwards"""
+    pytest.importorskip('pyftpdlib')
+    servers = []
+
+    def make(**kwargs):
+        server = FTPServer(tmp_path_factory.mktemp('ftp'), **kwargs)
+        servers.append(server)
+        return server
+
+    yield make
+    connection_pool.close_all()
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def ftp_server(make_ftp_server):
+    return make_ftp_server()
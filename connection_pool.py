@@ -0,0 +1,279 @@
+"""
+Process-wide pool of authenticated FTP/SFTP sessions.
+
+Sessions are keyed by site (protocol, host, port and credentials) so that
+every FTPClient, FTPBrowser and scheduled job talking to the same server
+leases an already logged-in session instead of paying for a new login or
+SSH handshake on every call.
+"""
+import hashlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PER_SITE = 4
+DEFAULT_IDLE_TIMEOUT = 120  # seconds an unused session is kept open
+DEFAULT_HEALTH_CHECK_INTERVAL = 15  # seconds idle before a lease re-checks the session
+DEFAULT_LEASE_TIMEOUT = 120  # seconds to wait for a free slot
+
+
+def make_pool_key(protocol, host, port, username, password):
+    """Build the pool key for a site; the password only contributes a fingerprint"""
+    fingerprint = hashlib.sha256((password or '').encode('utf-8')).hexdigest()[:16]
+    return (protocol.lower(), host, int(port or 0), username or '', fingerprint)
+
+
+def describe_pool_key(key):
+    """Human readable pool key without the credential fingerprint"""
+    protocol, host, port, username, _ = key
+    return f"{protocol}://{username}@{host}:{port}"
+
+
+class PooledSession:
+    """An authenticated FTP or SFTP session owned by the pool"""
+
+    def __init__(self, key, connection, transport=None, home=None):
+        self.key = key
+        self.protocol = key[0]
+        self.connection = connection
+        self.transport = transport
+        self.home = home
+        self.dirty = False  # set when the working directory was changed
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.leases = 0
+        self.generation = 0  # the site's pool generation when the session was opened, see close_site()
+
+    def idle_for(self):
+        return time.monotonic() - self.last_used
+
+    def is_alive(self):
+        """Health check: NOOP for FTP, stat of the working directory for SFTP"""
+        try:
+            if self.protocol == 'ftp':
+                self.connection.voidcmd('NOOP')
+            elif self.protocol == 'sftp':
+                if not self.transport or not self.transport.is_active():
+                    return False
+                self.connection.stat('.')
+            return True
+        except Exception as e:
+            logger.debug(f"Pooled session to {describe_pool_key(self.key)} failed health check: {str(e)}")
+            return False
+
+    def reset(self):
+        """Return the session to the state a fresh login would have"""
+        if self.protocol == 'ftp':
+            self.connection.set_pasv(True)
+            if self.dirty and self.home:
+                self.connection.cwd(self.home)
+        elif self.protocol == 'sftp':
+            # paramiko tracks the working directory client-side
+            self.connection.chdir(None)
+        self.dirty = False
+
+    def close(self):
+        try:
+            if self.protocol == 'ftp':
+                try:
+                    self.connection.quit()
+                except Exception:
+                    self.connection.close()
+            elif self.protocol == 'sftp':
+                self.connection.close()
+                if self.transport:
+                    self.transport.close()
+        except Exception as e:
+            logger.debug(f"Error closing pooled session: {str(e)}")
+
+
+class ConnectionPool:
+    """Leases authenticated sessions per site with health checks and idle eviction"""
+
+    def __init__(self, max_per_site=DEFAULT_MAX_PER_SITE, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL, lease_timeout=DEFAULT_LEASE_TIMEOUT):
+        self.max_per_site = max_per_site
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.lease_timeout = lease_timeout
+        self._cond = threading.Condition()
+        self._idle = {}    # key -> list of idle PooledSession, most recently used last
+        self._leased = {}  # key -> number of sessions currently leased (or being opened)
+        self._limits = {}  # key -> per-site override of max_per_site
+        self._generations = {}  # key -> bumped by close_site(); older sessions are closed on release
+
+    def set_limit(self, key, max_size):
+        """Override the maximum number of sessions for one site"""
+        with self._cond:
+            if max_size:
+                self._limits[key] = max(1, int(max_size))
+            else:
+                self._limits.pop(key, None)
+            self._cond.notify_all()
+
+    def _limit(self, key):
+        return self._limits.get(key, self.max_per_site)
+
+    def limit(self, key):
+        """Most sessions key may hold at once"""
+        with self._cond:
+            return self._limit(key)
+
+    def acquire(self, key, factory, timeout=None):
+        """Lease a session for key, opening one with factory() if none is idle"""
+        timeout = self.lease_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        expired = []
+
+        while True:
+            session = None
+            with self._cond:
+                generation = self._generations.get(key, 0)
+                while True:
+                    expired.extend(self._pop_expired(key))
+                    idle = self._idle.get(key)
+                    if idle:
+                        session = idle.pop()
+                        self._leased[key] = self._leased.get(key, 0) + 1
+                        break
+                    if self._leased.get(key, 0) < self._limit(key):
+                        # Reserve the slot before opening outside the lock
+                        self._leased[key] = self._leased.get(key, 0) + 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"No free connection to {describe_pool_key(key)} "
+                                           f"after {timeout}s (limit {self._limit(key)})")
+                    self._cond.wait(remaining)
+
+            for stale in expired:
+                stale.close()
+            expired = []
+
+            if session is not None:
+                if session.idle_for() < self.health_check_interval or session.is_alive():
+                    session.leases += 1
+                    return session
+                # Dead session: drop it and open a replacement in the same slot
+                session.close()
+
+            try:
+                session = factory()
+            except Exception:
+                with self._cond:
+                    self._leased[key] -= 1
+                    self._cond.notify()
+                raise
+            session.leases += 1
+            session.generation = generation
+            logger.debug(f"Opened pooled session to {describe_pool_key(key)}")
+            return session
+
+    def release(self, session, discard=False):
+        """Return a leased session; broken or discarded sessions are closed"""
+        if not discard:
+            try:
+                session.reset()
+            except Exception as e:
+                logger.debug(f"Discarding session that could not be reset: {str(e)}")
+                discard = True
+
+        with self._cond:
+            self._leased[session.key] = max(0, self._leased.get(session.key, 0) - 1)
+            if session.generation != self._generations.get(session.key, 0):
+                # The site was edited or deleted while the session was out
+                discard = True
+            if not discard:
+                session.last_used = time.monotonic()
+                self._idle.setdefault(session.key, []).append(session)
+            self._cond.notify()
+
+        if discard:
+            session.close()
+
+    def reserve(self, key):
+        """Take a free connection slot for a session the pool does not hold (see transfer_tuning)
+
+        Returns False if the site's limit is reached. An idle pooled session
+        is closed when needed to make room, so the limit still counts both
+        kinds of session. Give the slot back with unreserve().
+        """
+        surplus = None
+        with self._cond:
+            leased = self._leased.get(key, 0)
+            if leased >= self._limit(key):
+                return False
+            self._leased[key] = leased + 1
+            idle = self._idle.get(key)
+            if idle and leased + 1 + len(idle) > self._limit(key):
+                # Least recently used first
+                surplus = idle.pop(0)
+        if surplus is not None:
+            surplus.close()
+        return True
+
+    def unreserve(self, key):
+        """Give back a slot taken with reserve()"""
+        with self._cond:
+            self._leased[key] = max(0, self._leased.get(key, 0) - 1)
+            self._cond.notify()
+
+    def _pop_expired(self, key):
+        """Remove idle sessions past the idle timeout (caller holds the lock)"""
+        idle = self._idle.get(key)
+        if not idle:
+            return []
+        keep = [s for s in idle if s.idle_for() < self.idle_timeout]
+        expired = [s for s in idle if s.idle_for() >= self.idle_timeout]
+        self._idle[key] = keep
+        return expired
+
+    def evict_idle(self):
+        """Close every idle session past the idle timeout"""
+        expired = []
+        with self._cond:
+            for key in list(self._idle):
+                expired.extend(self._pop_expired(key))
+        for session in expired:
+            session.close()
+        if expired:
+            logger.debug(f"Evicted {len(expired)} idle pooled sessions")
+        return len(expired)
+
+    def close_site(self, key):
+        """Close all sessions for one site, e.g. after its settings changed
+
+        Idle sessions are closed now, leased ones when they are released.
+        """
+        with self._cond:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            sessions = self._idle.pop(key, [])
+        for session in sessions:
+            session.close()
+
+    def close_all(self):
+        """Close all idle sessions (leased sessions are closed on release)"""
+        with self._cond:
+            sessions = [s for idle in self._idle.values() for s in idle]
+            self._idle = {}
+        for session in sessions:
+            session.close()
+
+    def stats(self):
+        """Snapshot of pool usage per site"""
+        with self._cond:
+            keys = set(self._idle) | set(self._leased)
+            return {
+                describe_pool_key(key): {
+                    'idle': len(self._idle.get(key, [])),
+                    'leased': self._leased.get(key, 0),
+                    'limit': self._limit(key)
+                }
+                for key in keys
+            }
+
+
+# Shared by every client in the process
+connection_pool = ConnectionPool()
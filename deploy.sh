@@ -583,6 +583,126 @@ try:
             else:
                 print('No jobs with None folder names found')
                 
+            # Migration 11: Add max_connections to sites table for parallel downloads
+            cursor.execute(\\\"SELECT column_name FROM information_schema.columns WHERE table_name = 'sites' AND column_name = 'max_connections'\\\")
+            
+            if not cursor.fetchone():
+                print('Adding max_connections column to sites table...')
+                cursor.execute('ALTER TABLE sites ADD COLUMN max_connections INTEGER DEFAULT 4;')
+                print('Max connections column added to sites table - download jobs fan out over this many sessions per site')
+            else:
+                print('Max connections column already exists in sites table')
+                
+            # Migration 12: Add SFTP pipelining settings to sites table
+            cursor.execute(\\\"SELECT column_name FROM information_schema.columns WHERE table_name = 'sites' AND column_name = 'block_size'\\\")
+            
+            if not cursor.fetchone():
+                print('Adding block_size and prefetch_window columns to sites table...')
+                cursor.execute('ALTER TABLE sites ADD COLUMN block_size INTEGER DEFAULT 32768;')
+                cursor.execute('ALTER TABLE sites ADD COLUMN prefetch_window INTEGER DEFAULT 64;')
+                print('SFTP pipelining columns added to sites table - configurable request size and read-ahead window')
+            else:
+                print('SFTP pipelining columns already exist in sites table')
+                
+            # Migration 13: Add segment_threshold_mb to sites table for segmented large-file downloads
+            cursor.execute(\\\"SELECT column_name FROM information_schema.columns WHERE table_name = 'sites' AND column_name = 'segment_threshold_mb'\\\")
+            
+            if not cursor.fetchone():
+                print('Adding segment_threshold_mb column to sites table...')
+                cursor.execute('ALTER TABLE sites ADD COLUMN segment_threshold_mb INTEGER DEFAULT 100;')
+                print('Segment threshold column added to sites table - large files download as parallel byte ranges')
+            else:
+                print('Segment threshold column already exists in sites table')
+                
+            # Migration 14: Add upload_transfer_mode to jobs table for streaming relay uploads
+            cursor.execute(\\\"SELECT column_name FROM information_schema.columns WHERE table_name = 'jobs' AND column_name = 'upload_transfer_mode'\\\")
+            
+            if not cursor.fetchone():
+                print('Adding upload_transfer_mode column to jobs table...')
+                cursor.execute(\\\"ALTER TABLE jobs ADD COLUMN upload_transfer_mode VARCHAR(20) DEFAULT 'relay';\\\")
+                print('Upload transfer mode column added to jobs table - upload jobs stream source to target')
+            else:
+                print('Upload transfer mode column already exists in jobs table')
+            
+            # Migration 15: Add incremental_sync to jobs table (the sync_manifest_entries table is created by db.create_all)
+            cursor.execute(\\\"SELECT column_name FROM information_schema.columns WHERE table_name = 'jobs' AND column_name = 'incremental_sync'\\\")
+            
+            if not cursor.fetchone():
+                print('Adding incremental_sync column to jobs table...')
+                cursor.execute(\\\"ALTER TABLE jobs ADD COLUMN incremental_sync BOOLEAN DEFAULT FALSE;\\\")
+                print('Incremental sync column added to jobs table - jobs can skip unchanged files')
+            else:
+                print('Incremental sync column already exists in jobs table')
+            
+            # Migration 16: Add checksum settings to sites and per-file checksums to job_logs
+            cursor.execute(\\\"SELECT column_name FROM information_schema.columns WHERE table_name = 'sites' AND column_name = 'checksum_algorithm'\\\")
+            
+            if not cursor.fetchone():
+                print('Adding checksum_algorithm and verify_uploads columns to sites table...')
+                cursor.execute(\\\"ALTER TABLE sites ADD COLUMN checksum_algorithm VARCHAR(10) DEFAULT 'sha256';\\\")
+                cursor.execute('ALTER TABLE sites ADD COLUMN verify_uploads BOOLEAN DEFAULT FALSE;')
+                print('Checksum columns added to sites table - transfers compute checksums as the data streams')
+            else:
+                print('Checksum columns already exist in sites table')
+            
+            cursor.execute(\\\"SELECT column_name FROM information_schema.columns WHERE table_name = 'job_logs' AND column_name = 'checksums'\\\")
+            
+            if not cursor.fetchone():
+                print('Adding checksums column to job_logs table...')
+                cursor.execute('ALTER TABLE job_logs ADD COLUMN checksums TEXT;')
+                print('Checksums column added to job_logs table - every run keeps the checksums of its files')
+            else:
+                print('Checksums column already exists in job_logs table')
+            
+            # Migration 17: Add wire compression settings and probe results to sites
+            cursor.execute(\\\"SELECT column_name FROM information_schema.columns WHERE table_name = 'sites' AND column_name = 'compression'\\\")
+            
+            if not cursor.fetchone():
+                print('Adding compression columns to sites table...')
+                # Existing sites stay uncompressed, so no job starts probing after the upgrade; new sites get 'auto'
+                cursor.execute(\\\"ALTER TABLE sites ADD COLUMN compression VARCHAR(10) DEFAULT 'off';\\\")
+                cursor.execute(\\\"ALTER TABLE sites ALTER COLUMN compression SET DEFAULT 'auto';\\\")
+                cursor.execute('ALTER TABLE sites ADD COLUMN compression_enabled BOOLEAN;')
+                cursor.execute('ALTER TABLE sites ADD COLUMN compression_probe VARCHAR(255);')
+                cursor.execute('ALTER TABLE sites ADD COLUMN compression_probed_at TIMESTAMP;')
+                print('Compression columns added to sites table - existing sites are set to off, new sites probe for MODE Z / SSH compression')
+            else:
+                print('Compression columns already exist in sites table')
+            
+            # Migration 18: Add block size auto-tuning to sites
+            cursor.execute(\\\"SELECT column_name FROM information_schema.columns WHERE table_name = 'sites' AND column_name = 'auto_tune'\\\")
+            
+            if not cursor.fetchone():
+                print('Adding auto-tuning columns to sites table...')
+                cursor.execute('ALTER TABLE sites ADD COLUMN auto_tune BOOLEAN DEFAULT FALSE;')
+                cursor.execute('ALTER TABLE sites ADD COLUMN tuning_summary VARCHAR(255);')
+                cursor.execute('ALTER TABLE sites ADD COLUMN tuned_at TIMESTAMP;')
+                print('Auto-tuning columns added to sites table - block sizes can be measured per site')
+            else:
+                print('Auto-tuning columns already exist in sites table')
+                
+            # Migration 19: Add bandwidth limits to sites and jobs
+            for table in ('sites', 'jobs'):
+                cursor.execute(f\\\"SELECT column_name FROM information_schema.columns WHERE table_name = '{table}' AND column_name = 'bandwidth_limit_mbps'\\\")
+                
+                if not cursor.fetchone():
+                    print(f'Adding bandwidth limit columns to {table} table...')
+                    cursor.execute(f'ALTER TABLE {table} ADD COLUMN bandwidth_limit_mbps REAL;')
+                    cursor.execute(f'ALTER TABLE {table} ADD COLUMN bandwidth_schedule TEXT;')
+                    print(f'Bandwidth limit columns added to {table} table - transfers can be capped by time of day')
+                else:
+                    print(f'Bandwidth limit columns already exist in {table} table')
+                
+            # Migration 20: Add tuned socket buffer size to sites
+            cursor.execute(\\\"SELECT column_name FROM information_schema.columns WHERE table_name = 'sites' AND column_name = 'socket_buffer'\\\")
+            
+            if not cursor.fetchone():
+                print('Adding socket_buffer column to sites table...')
+                cursor.execute('ALTER TABLE sites ADD COLUMN socket_buffer INTEGER;')
+                print('Socket buffer column added to sites table - auto-tuning can size FTP/SFTP socket buffers')
+            else:
+                print('Socket buffer column already exists in sites table')
+            
             conn.commit()
             cursor.close()
             conn.close()
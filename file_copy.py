@@ -0,0 +1,176 @@
+"""
+Zero-copy file copies for NFS mounts and network drives.
+
+copy_file() moves the data between the two files inside the kernel where it
+can, trying in turn:
+
+1. reflink (FICLONE): the copy shares the source's blocks and no data moves,
+   on filesystems such as Btrfs and XFS within one filesystem
+2. copy_file_range(): in-kernel copy, which NFS 4.2 and SMB3 offload to the
+   server when both files are on the same share
+3. sendfile(): in-kernel copy for kernels and filesystem pairs without
+   copy_file_range (cross-filesystem copy_file_range is refused by most
+   kernels)
+4. a read/write loop through one reused buffer
+
+A method that reports itself unsupported for a pair of filesystems is not
+tried again for that pair. Whatever it copied before failing is kept and the
+next method continues at the same offset. Every method meters and paces
+each step with the bandwidth throttle. Each call releases the GIL, so the
+transfer engine's workers copy in parallel from one mount.
+
+Checksums (a checksums.StreamHasher with algorithms, which sites have by
+default) do not force the loop: after a kernel copy the destination is read
+back and hashed. Those reads come from the page cache the copy just filled,
+so they cost far less than pulling the data through Python from the share,
+and the checksum is the one of what was actually written. Only the loop
+hashes as it copies.
+"""
+import errno
+import logging
+import os
+import shutil
+import threading
+
+from local_writes import reserve_space
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 1024 * 1024  # bytes per read in the loop, and per kernel call while throttled
+KERNEL_COPY_STEP = 64 * 1024 * 1024  # bytes per copy_file_range/sendfile call otherwise
+FICLONE = 0x40049409  # _IOW(0x94, 9, int)
+
+METHODS = ('reflink', 'copy_file_range', 'sendfile', 'read/write')
+
+# What a filesystem answers for a call it does not implement (EINVAL, EXDEV for a cross-filesystem pair, ...)
+_UNSUPPORTED_ERRNOS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.ENOTSOCK, errno.EPERM,
+                       errno.EOPNOTSUPP, getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP)}
+
+_unsupported = set()  # (method, source st_dev, destination st_dev) known to fail
+_unsupported_lock = threading.Lock()
+
+
+class _Unsupported(Exception):
+    """A kernel copy method failed as not supported after copying offset bytes"""
+
+    def __init__(self, offset, error=None):
+        super().__init__(str(error) if error else 'no data copied')
+        self.offset = offset
+
+
+def copy_file(source_path, dest_path, hasher=None, throttle=None, methods=METHODS):
+    """Copy a file with its metadata; returns the method that copied the data
+
+    With a hasher the data is hashed as well (read back from dest_path
+    after a kernel copy); a throttle (bandwidth.Throttle) paces and meters it. dest_path gets the source's
+    size reserved up front (see local_writes.reserve_space). methods limits
+    the methods tried, e.g. for benchmarks.
+    """
+    with open(source_path, 'rb') as source_file, open(dest_path, 'wb') as dest_file:
+        method, offset = _copy_data(source_file, dest_file, throttle, methods)
+        if method == 'read/write':
+            if hasher and offset:
+                # A kernel method copied the start before it failed
+                hasher.update_from_file(dest_path, offset)
+            _copy_loop(source_file, dest_file, offset, hasher, throttle)
+    if hasher and method != 'read/write':
+        hasher.update_from_file(dest_path)
+    shutil.copystat(source_path, dest_path)
+    return method
+
+
+def _copy_data(source_file, dest_file, throttle, methods):
+    """Copy with the first kernel method that works; (method, offset) - 'read/write' if the loop has to go on at offset"""
+    source_stat = os.fstat(source_file.fileno())
+    devices = (source_stat.st_dev, os.fstat(dest_file.fileno()).st_dev)
+    offset = 0
+    if 'reflink' in methods and _supported('reflink', devices) and _reflink(source_file, dest_file, devices):
+        return 'reflink', source_stat.st_size
+    reserve_space(dest_file, source_stat.st_size)
+    for method in ('copy_file_range', 'sendfile'):
+        if method not in methods or not _supported(method, devices):
+            continue
+        try:
+            return method, _kernel_copy(method, source_file.fileno(), dest_file.fileno(), offset,
+                                        source_stat.st_size, throttle)
+        except _Unsupported as e:
+            offset = e.offset
+            _mark_unsupported(method, devices, e)
+    return 'read/write', offset
+
+
+def _supported(method, devices):
+    if method == 'reflink' and fcntl is None:
+        return False
+    if method == 'copy_file_range' and not hasattr(os, 'copy_file_range'):
+        return False
+    if method == 'sendfile' and not hasattr(os, 'sendfile'):
+        return False
+    return (method,) + devices not in _unsupported
+
+
+def _mark_unsupported(method, devices, error):
+    with _unsupported_lock:
+        _unsupported.add((method,) + devices)
+    logger.debug(f"{method} not supported from device {devices[0]} to {devices[1]} ({str(error)}), falling back")
+
+
+def _reflink(source_file, dest_file, devices):
+    """Clone the source's blocks into the empty destination; False if the filesystems cannot"""
+    try:
+        fcntl.ioctl(dest_file.fileno(), FICLONE, source_file.fileno())
+        return True
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED_ERRNOS:
+            raise
+        _mark_unsupported('reflink', devices, e)
+        return False
+
+
+def _kernel_copy(method, source_fd, dest_fd, offset, size, throttle):
+    """Copy from offset to the end of the source with copy_file_range or sendfile; raises _Unsupported"""
+    step = COPY_CHUNK_SIZE if throttle and throttle.limited else KERNEL_COPY_STEP
+    if method == 'sendfile':
+        # sendfile writes at the destination's file position
+        os.lseek(dest_fd, offset, os.SEEK_SET)
+    while True:
+        try:
+            if method == 'copy_file_range':
+                copied = os.copy_file_range(source_fd, dest_fd, step, offset, offset)
+            else:
+                copied = os.sendfile(dest_fd, source_fd, offset, step)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+            raise _Unsupported(offset, e)
+        if not copied:
+            if offset == 0 and size:
+                # Some filesystems (procfs-like and FUSE ones) report end of file instead of failing
+                raise _Unsupported(offset)
+            return offset
+        offset += copied
+        if throttle:
+            throttle.consume(copied)
+
+
+def _copy_loop(source_file, dest_file, offset, hasher, throttle):
+    source_file.seek(offset)
+    dest_file.seek(offset)
+    size = os.fstat(source_file.fileno()).st_size
+    # A file that grows during the copy is still read to the end, in smaller steps
+    buffer = bytearray(max(1, min(COPY_CHUNK_SIZE, size - offset)))
+    view = memoryview(buffer)
+    while True:
+        length = source_file.readinto(buffer)
+        if not length:
+            break
+        if throttle:
+            throttle.consume(length)
+        if hasher:
+            hasher.update(view[:length])
+        dest_file.write(view[:length])
@@ -6,13 +6,32 @@ import stat
 import math
 from datetime import datetime
 from ftp_client import FTPClient
+from ftp_list_parser import parse_list
+from listing_cache import listing_cache
 
 
 class FTPBrowser(FTPClient):
     """Extended FTP client with file browser capabilities"""
     
-    def browse_directory(self, remote_path='.'):
-        """Browse directory with detailed file information for web interface"""
+    def browse_directory(self, remote_path='.', refresh=False):
+        """Browse directory with detailed file information for web interface
+        
+        Listings come from the shared listing cache while they are fresh;
+        refresh=True always lists the server again.
+        """
+        if not refresh:
+            cached = listing_cache.get(self.pool_key, remote_path)
+            if cached is not None:
+                return cached
+        
+        result = self._browse_directory(remote_path)
+        if result['success']:
+            result['listed_at'] = datetime.now()
+            listing_cache.put(self.pool_key, remote_path, result, result['current_path'], self.home)
+        return result
+    
+    def _browse_directory(self, remote_path):
+        """List remote_path on the server in the browser's format"""
         try:
             if not self.connect():
                 return {'success': False, 'error': 'Connection failed'}
@@ -32,46 +51,30 @@ class FTPBrowser(FTPClient):
                     lines = []
                     self.connection.retrlines(f'LIST {remote_path}', lines.append)
                     
-                    for line in lines:
-                        parts = line.split(None, 8)
-                        if len(parts) >= 9:
-                            permissions = parts[0]
-                            is_dir = permissions.startswith('d')
-                            size = 0 if is_dir else int(parts[4])
-                            name = parts[8]
-                            
-                            # Skip current and parent directory entries
-                            if name in ['.', '..']:
-                                continue
-                            
-                            # Parse date
-                            try:
-                                date_str = f"{parts[5]} {parts[6]} {parts[7]}"
-                                if ':' in parts[7]:  # Recent files show time
-                                    date_str = f"{parts[5]} {parts[6]} {datetime.now().year} {parts[7]}"
-                                    modified = datetime.strptime(date_str, "%b %d %Y %H:%M")
-                                else:  # Older files show year
-                                    modified = datetime.strptime(date_str, "%b %d %Y")
-                            except:
-                                modified = None
-                            
-                            # Construct proper path
-                            if current_path == '/' or current_path == '.':
-                                full_path = f'/{name}'
-                            else:
-                                full_path = f"{current_path.rstrip('/')}/{name}"
-                            
-                            items.append({
-                                'name': name,
-                                'is_directory': is_dir,
-                                'size': size,
-                                'size_formatted': self._format_size(size),
-                                'permissions': permissions,
-                                'modified': modified.isoformat() if modified else '',
-                                'modified_formatted': modified.strftime('%Y-%m-%d %H:%M') if modified else '',
-                                'path': full_path,
-                                'type': 'directory' if is_dir else 'file'
-                            })
+                    for entry in parse_list(lines, self.pool_key):
+                        name = entry.name
+                        is_dir = entry.type == 'directory'
+                        size = 0 if is_dir else entry.size
+                        permissions = entry.permissions
+                        modified = entry.mtime
+                        
+                        # Construct proper path
+                        if current_path == '/' or current_path == '.':
+                            full_path = f'/{name}'
+                        else:
+                            full_path = f"{current_path.rstrip('/')}/{name}"
+                        
+                        items.append({
+                            'name': name,
+                            'is_directory': is_dir,
+                            'size': size,
+                            'size_formatted': self._format_size(size),
+                            'permissions': permissions,
+                            'modified': modified.isoformat() if modified else '',
+                            'modified_formatted': modified.strftime('%Y-%m-%d %H:%M') if modified else '',
+                            'path': full_path,
+                            'type': 'directory' if is_dir else 'file'
+                        })
                 except Exception as e:
                     # Fallback to basic listing
                     try:
@@ -94,21 +97,9 @@ class FTPBrowser(FTPClient):
                         return {'success': False, 'error': f'Failed to list directory: {str(inner_e)}'}
             
             elif self.protocol == 'nfs':
-                # NFS browsing using the NFS client
-                from nfs_client import NFSClient
-                
-                # Create NFS client with the same parameters
-                nfs_client = NFSClient(
-                    self.host,
-                    getattr(self, 'nfs_export_path', '/'),
-                    getattr(self, 'nfs_version', '4'),
-                    getattr(self, 'nfs_mount_options', ''),
-                    getattr(self, 'nfs_auth_method', 'sys')
-                )
-                
-                try:
-                    # Mount the NFS share
-                    if not nfs_client.mount():
+                # NFS browsing through the site's shared mount
+                with self.nfs_mount() as nfs_client:
+                    if nfs_client is None:
                         return {'success': False, 'error': 'Failed to mount NFS share'}
                     
                     # List files using NFS client
@@ -118,7 +109,7 @@ class FTPBrowser(FTPClient):
                         for file_info in result['files']:
                             # Convert NFS file info to browser format
                             name = file_info['name']
-                            is_dir = file_info['type'] == 'dir'
+                            is_dir = file_info['type'] == 'directory'
                             size = file_info['size']
                             
                             # Parse modification time
@@ -148,10 +139,6 @@ class FTPBrowser(FTPClient):
                     else:
                         return {'success': False, 'error': result.get('error', 'Failed to list NFS directory')}
                         
-                finally:
-                    # Always unmount when done
-                    nfs_client.unmount()
-                        
             elif self.protocol == 'sftp':
                 # Get current directory if using relative path
                 if remote_path == '.':
@@ -224,7 +211,7 @@ class FTPBrowser(FTPClient):
             }
             
         except Exception as e:
-            self.disconnect()
+            self.disconnect(discard=self._session_broken(e))
             return {'success': False, 'error': str(e)}
     
     def _format_size(self, size_bytes):
@@ -242,27 +229,13 @@ class FTPBrowser(FTPClient):
         """Get a preview of text file content"""
         try:
             if self.protocol == 'nfs':
-                # NFS file preview
-                from nfs_client import NFSClient
-                
-                nfs_client = NFSClient(
-                    self.host,
-                    getattr(self, 'nfs_export_path', '/'),
-                    getattr(self, 'nfs_version', '4'),
-                    getattr(self, 'nfs_mount_options', ''),
-                    getattr(self, 'nfs_auth_method', 'sys')
-                )
-                
-                try:
-                    # Mount the NFS share
-                    if not nfs_client.mount():
+                # NFS file preview through the site's shared mount
+                with self.nfs_mount() as nfs_client:
+                    if nfs_client is None:
                         return {'success': False, 'error': 'Failed to mount NFS share for preview'}
                     
                     # Convert remote path to local mount path
-                    if remote_path.startswith('/'):
-                        remote_path = remote_path[1:]
-                    
-                    full_path = os.path.join(nfs_client.mount_point, remote_path) if remote_path else nfs_client.mount_point
+                    full_path = nfs_client._mount_path(remote_path)
                     
                     if not os.path.exists(full_path):
                         return {'success': False, 'error': f'File does not exist: {remote_path}'}
@@ -299,11 +272,6 @@ class FTPBrowser(FTPClient):
                             'content': f'Binary file ({file_size} bytes). Cannot display content.',
                             'is_text': False
                         }
-                        
-                except Exception as e:
-                    return {'success': False, 'error': str(e)}
-                finally:
-                    nfs_client.unmount()
             
             # Handle FTP/SFTP protocols
             if not self.connect():
@@ -321,7 +289,7 @@ class FTPBrowser(FTPClient):
                 try:
                     self.connection.retrbinary(f'RETR {remote_path}', store_chunk)
                 except Exception as e:
-                    self.disconnect()
+                    self.disconnect(discard=self._session_broken(e))
                     return {'success': False, 'error': f'Failed to retrieve file: {str(e)}'}
                     
             elif self.protocol == 'sftp':
@@ -330,7 +298,7 @@ class FTPBrowser(FTPClient):
                         chunk = remote_file.read(max_size)
                         content.write(chunk)
                 except Exception as e:
-                    self.disconnect()
+                    self.disconnect(discard=self._session_broken(e))
                     return {'success': False, 'error': f'Failed to retrieve file: {str(e)}'}
             
             self.disconnect()
@@ -356,5 +324,5 @@ class FTPBrowser(FTPClient):
                 return {'success': True, 'content': '[Binary file - cannot preview as text]', 'is_text': False}
                 
         except Exception as e:
-            self.disconnect()
+            self.disconnect(discard=self._session_broken(e))
             return {'success': False, 'error': str(e)}
\ No newline at end of file
@@ -5,13 +5,60 @@ import logging
 import subprocess
 import tempfile
 import shutil
+import socket
 from datetime import datetime
 from pathlib import Path
 import stat
-from nfs_client import NFSClient
+import time
+from contextlib import contextmanager
+from nfs_mounts import nfs_mounts, make_mount_key
+from connection_pool import connection_pool, make_pool_key, describe_pool_key, PooledSession
+from transfer_engine import download_parallel, download_streaming, upload_parallel, make_task
+from tree_scanner import scan_tree
+from listing_cache import listing_cache
+from sftp_transfer import (pipelined_get, pipelined_put, pipelined_read, pipelined_write, normalize_block_size,
+                           DEFAULT_BLOCK_SIZE, DEFAULT_PREFETCH_WINDOW)
+from segmented_download import download_segmented, DEFAULT_SEGMENT_THRESHOLD_MB
+from resumable import PartialDownload, PartialUpload
+from local_writes import LocalWrites, open_part
+from ftp_list_parser import parse_list, entry_from_mlsd, to_record
+from checksums import (StreamHasher, HashingReader, normalize_algorithm, check_sidecars, sidecars_for,
+                       DEFAULT_ALGORITHM)
+from compression import retrieve_compressed, store_compressed, MIN_COMPRESSED_SIZE
+from bandwidth import bandwidth_manager
+from transfer_tuning import apply_socket_buffer
 
 logger = logging.getLogger(__name__)
 
+# FEAT lines of each FTP server, by pool key
+_ftp_features = {}
+# Algorithms each server hashes files with for us, by pool key: algorithm -> how to ask
+_server_hash_support = {}
+_FTP_HASH_NAMES = {'sha256': 'SHA-256', 'md5': 'MD5'}  # names in FEAT/OPTS HASH
+_FTP_HASH_COMMANDS = {'XSHA256': 'sha256', 'XMD5': 'md5'}
+
+class _ChunkReader:
+    """File-like view of an iterable of byte strings, for storbinary"""
+    
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.transferred = 0
+    
+    def read(self, size=-1):
+        data = next(self._chunks, b'')
+        self.transferred += len(data)
+        return data
+
+class _BufferedFTP(ftplib.FTP):
+    """ftplib.FTP that sets the kernel buffers of each data connection it opens"""
+    
+    socket_buffer = None  # SO_RCVBUF/SO_SNDBUF bytes; None keeps the kernel's autotuning
+    
+    def ntransfercmd(self, cmd, rest=None):
+        connection, size = super().ntransfercmd(cmd, rest)
+        apply_socket_buffer(connection, self.socket_buffer)
+        return connection, size
+
 class FTPClient:
     """Unified FTP/SFTP/NFS client"""
     
@@ -23,65 +70,221 @@ class FTPClient:
         self.password = password
         self.connection = None
         self.transport = None
+        self._session = None  # PooledSession leased from the connection pool
+        self.home = None  # login directory of the site's sessions, known once connected
+        self._batch_depth = 0  # >0 while batch() holds the session across calls
+        self.pool_key = make_pool_key(self.protocol, host, port, username, password)
+        self.max_retries = kwargs.get('max_retries', 2)  # reconnects per file on session loss
+        self.max_connections = int(kwargs.get('max_connections') or 1)  # parallel sessions per download
+        self.block_size = int(kwargs.get('block_size') or DEFAULT_BLOCK_SIZE)  # FTP read/write size, SFTP request size
+        self.prefetch_window = int(kwargs.get('prefetch_window') or DEFAULT_PREFETCH_WINDOW)  # SFTP reads in flight
+        self.socket_buffer = kwargs.get('socket_buffer')  # FTP data / SSH socket buffers in bytes; None = kernel default
+        segment_threshold_mb = kwargs.get('segment_threshold_mb')
+        if segment_threshold_mb is None:
+            segment_threshold_mb = DEFAULT_SEGMENT_THRESHOLD_MB
+        self.segment_threshold = int(segment_threshold_mb) * 1024 * 1024  # 0 disables segmented downloads
+        self.checksum_algorithm = normalize_algorithm(kwargs.get('checksum_algorithm', DEFAULT_ALGORITHM))  # None = off
+        self.verify_uploads = bool(kwargs.get('verify_uploads'))  # compare uploads with the server's own hash
+        self.compression = bool(kwargs.get('compression'))  # MODE Z / SSH compression, see compression.py
+        # bandwidth.TransferThrottle every transfer callback draws from; without one only the global limits apply
+        self.throttle = kwargs.get('throttle') or bandwidth_manager.throttle()
+        self.sync_manifest = kwargs.get('sync_manifest')  # SyncManifest of an incremental job: unchanged files are skipped
+        # local_writes.LocalWrites with the fsync policy for downloads; clones share it so one flush covers them all
+        if kwargs.get('local_writes') is None:
+            kwargs['local_writes'] = LocalWrites()
+        self.local_writes = kwargs['local_writes']
+        self._client_kwargs = kwargs
+        self._mlsd_supported = True  # cleared when the FTP server rejects MLSD
         
         # NFS-specific attributes
         self.nfs_export_path = kwargs.get('nfs_export_path', '/')
         self.nfs_version = kwargs.get('nfs_version', '4')
         self.nfs_mount_options = kwargs.get('nfs_mount_options', '')
         self.nfs_auth_method = kwargs.get('nfs_auth_method', 'sys')
-        self.nfs_client = None
+        self.nfs_mount_key = make_mount_key(host, self.nfs_export_path, self.nfs_version, self.nfs_mount_options,
+                                            self.nfs_auth_method)
+        self.nfs_client = None  # the shared mount while connect() holds a reference to it
         
-    def connect(self):
-        """Establish connection"""
+    def session_limit(self):
+        """Most sessions this site may have open at once, counting every client of the site"""
+        return connection_pool.limit(self.pool_key)
+    
+    def clone(self):
+        """New client for the same site, sharing the connection pool but not the leased session"""
+        return FTPClient(self.protocol, self.host, self.port, self.username, self.password, **self._client_kwargs)
+    
+    def connect(self, lease_timeout=None):
+        """Lease an authenticated session from the connection pool
+        
+        lease_timeout limits how long to wait for a free slot when the site's
+        connection limit is reached (0 means only take a free slot).
+        """
         try:
-            if self.protocol == 'ftp':
-                self.connection = ftplib.FTP()
-                # Set timeout for FTP connections (increased for better reliability)
-                self.connection.connect(self.host, self.port, timeout=30)
-                self.connection.login(self.username, self.password)
-                # Set passive mode for better firewall compatibility
-                self.connection.set_pasv(True)
-            elif self.protocol == 'sftp':
-                transport = paramiko.Transport((self.host, self.port))
-                # Set timeout for SFTP connections (increased for better reliability)
-                transport.set_keepalive(30)
-                transport.connect(username=self.username, password=self.password, timeout=30)
-                self.connection = paramiko.SFTPClient.from_transport(transport)
-                self.transport = transport  # Keep reference for cleanup
+            if self.protocol in ('ftp', 'sftp'):
+                if self._session is not None:
+                    return True
+                self._session = connection_pool.acquire(self.pool_key, self._open_session, timeout=lease_timeout)
+                self.connection = self._session.connection
+                self.transport = self._session.transport
+                self.home = self._session.home
             elif self.protocol == 'nfs':
-                self.nfs_client = NFSClient(
-                    host=self.host,
-                    export_path=self.nfs_export_path,
-                    nfs_version=self.nfs_version,
-                    mount_options=self.nfs_mount_options,
-                    auth_method=self.nfs_auth_method
-                )
-                return self.nfs_client.mount()
+                if self.nfs_client is None:
+                    self.nfs_client = nfs_mounts.acquire(self.nfs_mount_key)
+                return self.nfs_client is not None
             else:
                 raise ValueError(f"Unsupported protocol: {self.protocol}")
             
             return True
+        except TimeoutError as e:
+            if lease_timeout == 0:
+                logger.debug(f"No free session: {str(e)}")
+            else:
+                logger.error(f"Connection failed: {str(e)}")
+            return False
         except Exception as e:
             logger.error(f"Connection failed: {str(e)}")
             return False
     
-    def disconnect(self):
-        """Close connection"""
+    def _open_session(self, compress=None):
+        """Open a new authenticated session for the connection pool
+        
+        compress overrides the site's compression setting; for SFTP it is
+        negotiated with the session, FTP switches MODE per transfer instead.
+        """
+        if self.protocol == 'ftp':
+            connection = _BufferedFTP()
+            connection.socket_buffer = self.socket_buffer
+            # Set timeout for FTP connections (increased for better reliability)
+            connection.connect(self.host, self.port, timeout=30)
+            connection.login(self.username, self.password)
+            # Set passive mode for better firewall compatibility
+            connection.set_pasv(True)
+            return PooledSession(self.pool_key, connection, home=connection.pwd())
+        
+        # Set timeout for SFTP connections (increased for better reliability)
+        sock = socket.create_connection((self.host, self.port), timeout=30)
+        apply_socket_buffer(sock, self.socket_buffer)
+        transport = paramiko.Transport(sock)
+        transport.banner_timeout = 30
+        transport.auth_timeout = 30
+        transport.set_keepalive(30)
+        transport.use_compression(self.compression if compress is None else compress)
+        try:
+            transport.connect(username=self.username, password=self.password)
+            connection = paramiko.SFTPClient.from_transport(transport)
+        except Exception:
+            transport.close()
+            raise
+        return PooledSession(self.pool_key, connection, transport=transport, home=connection.normalize('.'))
+    
+    def disconnect(self, discard=False):
+        """Return the leased session to the pool (or close it if discard is set)"""
         try:
-            if self.connection:
-                if self.protocol == 'ftp':
-                    self.connection.quit()
-                elif self.protocol == 'sftp':
-                    self.connection.close()
-                    if hasattr(self, 'transport') and self.transport:
-                        self.transport.close()
+            if self._batch_depth and not discard:
+                # batch() keeps the session until the whole operation is done
+                return
+            if self._session is not None:
+                session = self._session
+                self._session = None
+                self.connection = None
+                self.transport = None
+                connection_pool.release(session, discard=discard)
             elif self.protocol == 'nfs' and self.nfs_client:
-                self.nfs_client.unmount()
+                # The mount stays with the mount manager until it has been idle for a while
                 self.nfs_client = None
+                nfs_mounts.release(self.nfs_mount_key)
             self.connection = None
         except Exception as e:
             logger.error(f"Error disconnecting: {str(e)}")
     
+    def release_session(self):
+        """Return the leased session to the pool even inside batch(); the next connect() leases one again
+        
+        Used before the asyncio transfer core leases the site's sessions for
+        its own workers.
+        """
+        if self._session is not None:
+            session = self._session
+            self._session = None
+            self.connection = None
+            self.transport = None
+            connection_pool.release(session)
+    
+    def _session_broken(self, error):
+        """Whether an error left the leased session unusable"""
+        if self.protocol == 'ftp':
+            # Permanent replies (550 etc.) leave the control connection in sync
+            return not isinstance(error, ftplib.error_perm)
+        if self.protocol == 'sftp':
+            return not (self.transport and self.transport.is_active())
+        return False
+    
+    def _is_connection_error(self, error):
+        """Whether an error means the session dropped, so a reconnect and retry is worthwhile"""
+        if isinstance(error, (EOFError, ConnectionError, TimeoutError)):
+            return True
+        if self.protocol == 'ftp':
+            return isinstance(error, (ftplib.error_temp, ftplib.error_reply, ftplib.error_proto))
+        if self.protocol == 'sftp':
+            return not (self.transport and self.transport.is_active())
+        return False
+    
+    def _with_reconnect(self, operation, *args):
+        """Run operation on the leased session, reconnecting and retrying it if the session drops"""
+        for attempt in range(self.max_retries + 1):
+            if not self.connect():
+                raise ConnectionError('Connection failed')
+            try:
+                return operation(*args)
+            except Exception as e:
+                retry = self._is_connection_error(e) and attempt < self.max_retries
+                if self._session_broken(e):
+                    self.disconnect(discard=True)
+                if not retry:
+                    raise
+                logger.warning(f"Session to {self.host} lost ({str(e) or type(e).__name__}), reconnecting "
+                               f"(retry {attempt + 1}/{self.max_retries})")
+                time.sleep(attempt + 1)
+    
+    @contextmanager
+    def batch(self):
+        """Hold one pooled session for a whole listing-plus-transfer operation
+        
+        Inside the block connect() and disconnect() keep reusing the same session;
+        it is only replaced when it actually fails.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and (self._session is not None or self.nfs_client is not None):
+                self.disconnect()
+    
+    @contextmanager
+    def nfs_mount(self):
+        """The site's shared NFS mount (an NFSClient) for one operation, None if it cannot be mounted
+        
+        Uses the mount connect() holds, otherwise takes a reference from the
+        mount manager for the block, so parallel workers sharing this client
+        can each use it.
+        """
+        if self.nfs_client is not None:
+            yield self.nfs_client
+            return
+        with nfs_mounts.use(self.nfs_mount_key) as nfs_client:
+            yield nfs_client
+    
+    def _cwd(self, remote_path):
+        """Change the FTP working directory of the leased session"""
+        self.connection.cwd(remote_path)
+        if self._session is not None:
+            self._session.dirty = True
+    
+    def _invalidate_listing(self, remote_path):
+        """Drop cached browser listings made stale by our write to remote_path"""
+        listing_cache.invalidate(self.pool_key, remote_path, self.home)
+    
     def test_connection(self):
         """Test connection to server"""
         try:
@@ -97,61 +300,12 @@ class FTPClient:
         """List files in remote directory"""
         try:
             if self.protocol == 'nfs':
-                if not self.nfs_client:
-                    return {'success': False, 'error': 'NFS client not initialized'}
-                return self.nfs_client.list_files(remote_path)
-            
-            if not self.connect():
-                return {'success': False, 'error': 'Connection failed'}
-            
-            files = []
-            
-            if self.protocol == 'ftp':
-                try:
-                    self.connection.cwd(remote_path)
-                    file_list = self.connection.nlst()
-                    
-                    for filename in file_list:
-                        try:
-                            # Get file details with timeout protection
-                            self.connection.voidcmd('NOOP')  # Keep connection alive
-                            file_info = list(self.connection.mlsd(filename))
-                            for name, facts in file_info:
-                                if name == filename:
-                                    files.append({
-                                        'name': name,
-                                        'size': int(facts.get('size', 0)),
-                                        'modify': facts.get('modify', ''),
-                                        'type': 'directory' if facts.get('type') == 'dir' else 'file'
-                                    })
-                                    break
-                        except:
-                            # Fallback for servers that don't support MLSD
-                            files.append({
-                                'name': filename,
-                                'size': 0,
-                                'modify': '',
-                                'type': 'file'
-                            })
-                            
-                except Exception as e:
-                    return {'success': False, 'error': str(e)}
-                    
-            elif self.protocol == 'sftp':
-                try:
-                    file_list = self.connection.listdir_attr(remote_path)
-                    
-                    for file_attr in file_list:
-                        files.append({
-                            'name': file_attr.filename,
-                            'size': file_attr.st_size or 0,
-                            'modify': datetime.fromtimestamp(file_attr.st_mtime).isoformat() if file_attr.st_mtime else '',
-                            'type': 'directory' if stat.S_ISDIR(file_attr.st_mode) else 'file'
-                        })
-                        
-                except Exception as e:
-                    return {'success': False, 'error': str(e)}
+                with self.nfs_mount() as nfs_client:
+                    if nfs_client is None:
+                        return {'success': False, 'error': 'Failed to mount NFS share'}
+                    return nfs_client.list_files(remote_path)
             
+            files = self._with_reconnect(self._list_entries, remote_path)
             self.disconnect()
             return {'success': True, 'files': files}
             
@@ -159,99 +313,465 @@ class FTPClient:
             self.disconnect()
             return {'success': False, 'error': str(e)}
     
-    def download_file(self, remote_path, local_path):
-        """Download a single file"""
+    def find_sample_file(self, remote_path, min_size, max_size):
+        """(path, size) of the largest file in remote_path between min_size and max_size bytes, for probes
+        
+        Returns None if there is no such file; raises if remote_path cannot be listed.
+        """
+        listing = self.list_files(remote_path)
+        if not listing['success']:
+            raise IOError(listing['error'])
+        samples = [f for f in listing['files'] if f['type'] == 'file' and min_size <= (f['size'] or 0) <= max_size]
+        if not samples:
+            return None
+        sample = max(samples, key=lambda f: f['size'])
+        return f"{remote_path.rstrip('/')}/{sample['name']}", sample['size']
+    
+    def _list_entries(self, remote_path):
+        """List remote_path on the leased session"""
+        files = []
+        
+        if self.protocol == 'ftp':
+            # One MLSD (or LIST) for the whole directory instead of MLSD per file
+            if self._mlsd_supported:
+                try:
+                    for name, facts in self.connection.mlsd(remote_path):
+                        entry = entry_from_mlsd(name, facts)
+                        if entry:
+                            files.append(to_record(entry))
+                    return files
+                except ftplib.error_perm as e:
+                    if not str(e).startswith(('500', '502', '504')):
+                        raise
+                    # Server does not know MLSD; remember and use LIST
+                    self._mlsd_supported = False
+                    files = []
+            
+            lines = []
+            self.connection.retrlines(f'LIST {remote_path}', lines.append)
+            files = [to_record(entry) for entry in parse_list(lines, self.pool_key)]
+                    
+        elif self.protocol == 'sftp':
+            file_list = self.connection.listdir_attr(remote_path)
+            
+            for file_attr in file_list:
+                files.append({
+                    'name': file_attr.filename,
+                    'size': file_attr.st_size or 0,
+                    'modify': datetime.fromtimestamp(file_attr.st_mtime).isoformat() if file_attr.st_mtime else '',
+                    'type': 'directory' if stat.S_ISDIR(file_attr.st_mode) else 'file'
+                })
+        
+        return files
+    
+    def download_file(self, remote_path, local_path, remote_size=None, sidecars=None):
+        """Download a single file, resuming on a fresh session if the current one drops
+        
+        The file is written to '<local_path>.part' and continued from there by a
+        retry or a later run as long as the remote size and modification time
+        are unchanged. Files of at least segment_threshold bytes are fetched as
+        parallel byte ranges; remote_size (from a listing) saves asking the
+        server for it. The result carries the file's checksum, and sidecars
+        ({algorithm: remote checksum file}, see checksums.sidecars_for) are
+        compared with it.
+        
+        Outside a batch() the file is also synced as the fsync policy says;
+        inside one that is left to the caller's local_writes.flush().
+        """
         try:
-            if self.protocol == 'nfs':
-                if not self.nfs_client:
-                    return {'success': False, 'error': 'NFS client not initialized'}
-                return self.nfs_client.download_file(remote_path, local_path)
+            return self._download_file(remote_path, local_path, remote_size, sidecars)
+        finally:
+            if self._batch_depth == 0:
+                self.local_writes.flush()
+    
+    def _download_file(self, remote_path, local_path, remote_size, sidecars):
+        try:
+            hasher = StreamHasher([self.checksum_algorithm, *(sidecars or ())])
             
-            if not self.connect():
-                return {'success': False, 'error': 'Connection failed'}
+            if self.protocol == 'nfs':
+                with self.nfs_mount() as nfs_client:
+                    if nfs_client is None:
+                        return {'success': False, 'error': 'Failed to mount NFS share'}
+                    result = nfs_client.download_file(remote_path, local_path, hasher, self.throttle.download,
+                                                      self.local_writes)
+                    if result['success']:
+                        result = self._checked_download(result, remote_path, local_path, hasher, sidecars)
+                    return result
             
             # Create local directory if it doesn't exist
             local_dir = os.path.dirname(local_path)
             if local_dir:
                 os.makedirs(local_dir, exist_ok=True)
             
-            if self.protocol == 'ftp':
-                try:
-                    with open(local_path, 'wb') as local_file:
-                        self.connection.retrbinary(f'RETR {remote_path}', local_file.write)
-                except Exception as e:
-                    self.disconnect()
-                    # Try to provide more specific error information
-                    if "550" in str(e):
-                        return {'success': False, 'error': f'File not found or access denied: {remote_path}'}
-                    elif "426" in str(e):
-                        return {'success': False, 'error': f'Connection closed during transfer: {remote_path}'}
-                    else:
-                        return {'success': False, 'error': f'Failed to download {remote_path}: {str(e)}'}
-                        
-            elif self.protocol == 'sftp':
-                try:
-                    self.connection.get(remote_path, local_path)
-                except Exception as e:
-                    self.disconnect()
+            partial = None
+            try:
+                remote_size, remote_mtime = self._with_reconnect(self._remote_stat, remote_path, remote_size)
+                # Byte ranges are sent uncompressed, so MODE Z files come as one compressed stream instead
+                segmented = bool(self.segment_threshold and self.max_connections > 1
+                                 and remote_size and remote_size >= self.segment_threshold
+                                 and not self._with_reconnect(self._use_mode_z, remote_size))
+                partial = PartialDownload(local_path, remote_path, remote_size, remote_mtime, segmented)
+                if partial.resumed:
+                    logger.info(f"Resuming download of {remote_path}")
+                
+                if segmented:
+                    download_segmented(self, remote_path, partial, self.max_connections)
+                    # Ranges arrive out of order, so a segmented file is hashed once it is complete
+                    hasher.update_from_file(partial.path)
+                else:
+                    self._with_reconnect(self._retrieve_file, remote_path, partial, hasher)
+                partial.complete(self.local_writes)
+            except Exception as e:
+                self.disconnect()
+                if partial is not None and not partial.has_progress():
+                    partial.discard()
+                # Try to provide more specific error information
+                if self.protocol == 'ftp' and "550" in str(e):
+                    return {'success': False, 'error': f'File not found or access denied: {remote_path}'}
+                elif self.protocol == 'ftp' and "426" in str(e):
+                    return {'success': False, 'error': f'Connection closed during transfer: {remote_path}'}
+                else:
                     return {'success': False, 'error': f'Failed to download {remote_path}: {str(e)}'}
             
-            self.disconnect()
-            
             # Check if file was actually downloaded
             if not os.path.exists(local_path):
+                self.disconnect()
                 return {'success': False, 'error': f'Download failed - file not created locally'}
             
             # Get file size
             file_size = os.path.getsize(local_path)
             
-            return {
-                'success': True,
-                'bytes_transferred': file_size
-            }
+            result = self._checked_download({'success': True, 'bytes_transferred': file_size},
+                                            remote_path, local_path, hasher, sidecars)
+            self.disconnect()
+            return result
             
         except Exception as e:
-            self.disconnect()
+            self.disconnect(discard=self._session_broken(e))
             return {'success': False, 'error': str(e)}
     
-    def upload_file(self, local_path, remote_path):
-        """Upload a single file"""
+    def _checked_download(self, result, remote_path, local_path, hasher, sidecars):
+        """Add the checksum to a download result and compare it with the file's sidecars
+        
+        A file that does not match its sidecar is removed and the download fails;
+        a sidecar that cannot be read or parsed only leaves the file unverified.
+        """
+        contents = {}
+        for algorithm, sidecar_path in (sidecars or {}).items():
+            try:
+                contents[algorithm] = (sidecar_path, self._read_small_file(sidecar_path))
+            except Exception as e:
+                logger.warning(f"Cannot read checksum file {sidecar_path}: {str(e)}")
+        return check_sidecars(result, local_path, hasher, contents)
+    
+    def _read_small_file(self, remote_path):
+        """Contents of a small remote file such as a checksum sidecar"""
+        if self.protocol == 'nfs':
+            with self.nfs_mount() as nfs_client:
+                if nfs_client is None:
+                    raise IOError('Failed to mount NFS share')
+                with open(nfs_client._mount_path(remote_path), 'rb') as remote_file:
+                    return remote_file.read()
+        chunks = []
+        self._with_reconnect(self._read_stream, remote_path, chunks.append)
+        return b''.join(chunks)
+    
+    def _retrieve_file(self, remote_path, partial, hasher):
+        """Transfer remote_path into the part file on the leased session, continuing after what it holds"""
+        offset = partial.offset()
+        # A continued transfer only streams the rest, so the bytes already in the part are hashed first
+        hasher.reset()
+        if offset:
+            hasher.update_from_file(partial.path, offset)
+        if self.protocol == 'ftp':
+            try:
+                with open_part(partial.path, offset, partial.remote_size) as local_file:
+                    write = self.throttle.download.wrap(hasher.wrap(local_file.write))
+                    if not offset and self._use_mode_z(partial.remote_size):
+                        retrieve_compressed(self.connection, f'RETR {remote_path}', write, self.block_size)
+                    else:
+                        self.connection.retrbinary(f'RETR {remote_path}', write, self.block_size, rest=offset or None)
+            except ftplib.error_perm:
+                if not offset:
+                    raise
+                # Server refused REST; start the file over
+                logger.info(f"Server refused to resume {remote_path}, downloading from the start")
+                hasher.reset()
+                with open_part(partial.path, 0, partial.remote_size) as local_file:
+                    write = self.throttle.download.wrap(hasher.wrap(local_file.write))
+                    self.connection.retrbinary(f'RETR {remote_path}', write, self.block_size)
+        elif self.protocol == 'sftp':
+            pipelined_get(self.connection, remote_path, partial.path, self.block_size, self.prefetch_window, offset,
+                          hasher, self.throttle.download, partial.remote_size)
+    
+    def _remote_stat(self, remote_path, known_size=None):
+        """(size, modification time) of remote_path on the leased session; None where the server will not say"""
+        if self.protocol == 'ftp':
+            size = known_size or self._remote_size(remote_path) or None
+            try:
+                modified = self.connection.sendcmd(f'MDTM {remote_path}').split()[-1]
+            except ftplib.error_perm:
+                modified = None
+            return size, modified
+        attributes = self.connection.stat(remote_path)
+        return attributes.st_size, attributes.st_mtime
+    
+    def _remote_size(self, remote_path):
+        """Size of remote_path on the leased session, 0 if the server will not say"""
+        if self.protocol == 'ftp':
+            try:
+                self.connection.voidcmd('TYPE I')
+                return self.connection.size(remote_path) or 0
+            except ftplib.error_perm:
+                return 0
+        try:
+            return self.connection.stat(remote_path).st_size or 0
+        except FileNotFoundError:
+            return 0
+    
+    def _fetch_range(self, remote_path, local_path, offset, length):
+        """Write length bytes of remote_path starting at offset into the same place of local_path"""
+        with open(local_path, 'r+b') as local_file:
+            local_file.seek(offset)
+            
+            if self.protocol == 'ftp':
+                self.connection.voidcmd('TYPE I')
+                data_conn = self.connection.transfercmd(f'RETR {remote_path}', rest=offset)
+                remaining = length
+                try:
+                    while remaining > 0:
+                        data = data_conn.recv(min(self.block_size, remaining))
+                        if not data:
+                            break
+                        self.throttle.download.consume(len(data))
+                        local_file.write(data)
+                        remaining -= len(data)
+                finally:
+                    data_conn.close()
+                try:
+                    self.connection.voidresp()
+                except ftplib.error_temp:
+                    # Closing the data connection before the end of the file aborts the RETR (426)
+                    pass
+                if remaining:
+                    raise EOFError(f"Range at {offset} ended {remaining} bytes early")
+            
+            elif self.protocol == 'sftp':
+                with self.connection.open(remote_path, 'rb') as remote_file:
+                    block_size = normalize_block_size(self.block_size)
+                    remote_file.MAX_REQUEST_SIZE = block_size
+                    chunks = [(position, min(block_size, offset + length - position))
+                              for position in range(offset, offset + length, block_size)]
+                    for data in remote_file.readv(chunks, self.prefetch_window):
+                        self.throttle.download.consume(len(data))
+                        local_file.write(data)
+    
+    def upload_file(self, local_path, remote_path, create_dirs=True):
+        """Upload a single file (create_dirs=False when the remote directory is known to exist)"""
         try:
             if self.protocol == 'nfs':
-                if not self.nfs_client:
-                    return {'success': False, 'error': 'NFS client not initialized'}
-                return self.nfs_client.upload_file(local_path, remote_path)
+                hasher = StreamHasher([self.checksum_algorithm])
+                with self.nfs_mount() as nfs_client:
+                    if nfs_client is None:
+                        return {'success': False, 'error': 'Failed to mount NFS share'}
+                    result = nfs_client.upload_file(local_path, remote_path, hasher, self.throttle.upload)
+                self._invalidate_listing(remote_path)
+                if result['success']:
+                    result['checksum'] = hasher.checksum(self.checksum_algorithm)
+                    result['verified'] = False
+                return result
             
             if not self.connect():
                 return {'success': False, 'error': 'Connection failed'}
             
             # Create remote directory recursively if needed
             remote_dir = os.path.dirname(remote_path)
-            if remote_dir and remote_dir != '.':
+            if create_dirs and remote_dir and remote_dir != '.':
                 self._create_remote_directory(remote_dir)
             
-            if self.protocol == 'ftp':
-                with open(local_path, 'rb') as local_file:
-                    self.connection.storbinary(f'STOR {remote_path}', local_file)
-            elif self.protocol == 'sftp':
-                self.connection.put(local_path, remote_path)
+            server_algorithm = self._server_hash_algorithm() if self.verify_uploads else None
+            hasher = StreamHasher([self.checksum_algorithm, server_algorithm])
+            self._with_reconnect(self._store_file, local_path, remote_path, hasher)
+            verified = self._verify_upload(remote_path, hasher, server_algorithm)
             
             self.disconnect()
             
+            if verified is False:
+                return {'success': False, 'error': f'Checksum mismatch: the server\'s {server_algorithm} of {remote_path} '
+                                                   f'differs from the local file'}
+            
             # Get file size
             file_size = os.path.getsize(local_path)
             
             return {
                 'success': True,
-                'bytes_transferred': file_size
+                'bytes_transferred': file_size,
+                'checksum': hasher.checksum(hasher.algorithms[0]) if hasher else None,
+                'verified': bool(verified)
             }
             
         except Exception as e:
-            self.disconnect()
+            self.disconnect(discard=self._session_broken(e))
             return {'success': False, 'error': str(e)}
     
-    def _create_remote_directory(self, remote_path):
-        """Create remote directory recursively"""
+    def _store_file(self, local_path, remote_path, hasher):
+        """Upload local_path on the leased session, continuing an interrupted upload of the same file"""
+        partial = PartialUpload(describe_pool_key(self.pool_key), local_path, remote_path)
+        offset = 0
+        hasher.reset()
+        if partial.resumable():
+            remote_size = self._remote_size(remote_path)
+            if remote_size == partial.local_size:
+                partial.complete()
+                hasher.update_from_file(local_path)
+                return
+            if remote_size < partial.local_size:
+                offset = remote_size
+                if offset:
+                    logger.info(f"Resuming upload of {remote_path} at {offset} bytes")
+        # Only the rest is sent, so the bytes the server already has are hashed first
+        if offset:
+            hasher.update_from_file(local_path, offset)
+        partial.begin()
+        
+        try:
+            if self.protocol == 'ftp':
+                with open(local_path, 'rb') as local_file:
+                    local_file.seek(offset)
+                    source = self.throttle.upload.reader(HashingReader(local_file, hasher) if hasher else local_file)
+                    if not offset and self._use_mode_z(partial.local_size):
+                        store_compressed(self.connection, f'STOR {remote_path}', source, self.block_size)
+                    else:
+                        self.connection.storbinary(f'STOR {remote_path}', source, self.block_size, rest=offset or None)
+            elif self.protocol == 'sftp':
+                pipelined_put(self.connection, local_path, remote_path, self.block_size, offset, hasher,
+                              self.throttle.upload)
+        finally:
+            # Even a failed upload may have left a partial file behind
+            self._invalidate_listing(remote_path)
+        
+        partial.complete()
+    
+    def _server_hash_algorithms(self):
+        """Algorithms the server hashes files with, probed on the leased session once per site
+        
+        FTP servers announce HASH, XSHA256 or XMD5 in FEAT; SFTP servers are
+        assumed to offer check-file until the first attempt shows otherwise.
+        """
+        supported = _server_hash_support.get(self.pool_key)
+        if supported is None:
+            supported = {}
+            if self.protocol == 'ftp':
+                for feature in self._server_features():
+                    if feature.startswith('HASH '):
+                        names = {name.rstrip('*') for name in feature[5:].split(';')}
+                        supported.update((algorithm, 'HASH') for algorithm, name in _FTP_HASH_NAMES.items()
+                                         if name in names)
+                    elif feature in _FTP_HASH_COMMANDS:
+                        supported.setdefault(_FTP_HASH_COMMANDS[feature], feature)
+            elif self.protocol == 'sftp':
+                supported = {'sha256': 'check-file', 'md5': 'check-file'}
+            _server_hash_support[self.pool_key] = supported
+        return supported
+    
+    def _server_features(self, connection=None):
+        """FEAT lines of the FTP server (upper case), asked once per site on the leased session or connection"""
+        features = _ftp_features.get(self.pool_key)
+        if features is None:
+            try:
+                lines = (connection or self.connection).sendcmd('FEAT').splitlines()[1:-1]
+            except ftplib.all_errors:
+                lines = []
+            features = [line.strip().upper() for line in lines]
+            _ftp_features[self.pool_key] = features
+        return features
+    
+    def _mode_z_supported(self, connection=None):
+        return any(feature.split(' ', 1)[0] == 'MODE' and 'Z' in feature.split()[1:]
+                   for feature in self._server_features(connection))
+    
+    def _use_mode_z(self, size):
+        """Whether an FTP transfer of size bytes from byte 0 goes in MODE Z (see compression.py)"""
+        return bool(self.compression and self.protocol == 'ftp' and size and size >= MIN_COMPRESSED_SIZE
+                    and self._mode_z_supported())
+    
+    def _server_hash_algorithm(self):
+        """Algorithm to check uploads with: ours if the server can hash with it, else any it can, else None"""
+        supported = self._server_hash_algorithms()
+        if self.checksum_algorithm in supported:
+            return self.checksum_algorithm
+        return next(iter(supported), None)
+    
+    def _server_checksum(self, remote_path, algorithm):
+        """Hex digest of remote_path computed by the server, or None if it cannot provide one"""
+        method = _server_hash_support.get(self.pool_key, {}).get(algorithm)
+        if not method:
+            return None
+        try:
+            if method == 'HASH':
+                self.connection.sendcmd(f'OPTS HASH {_FTP_HASH_NAMES[algorithm]}')
+                # 213 SHA-256 0-<size> <digest> <path>
+                return self.connection.sendcmd(f'HASH {remote_path}').split()[3].lower()
+            if method == 'check-file':
+                with self.connection.open(remote_path, 'rb') as remote_file:
+                    return remote_file.check(algorithm).hex()
+            return self.connection.sendcmd(f'{method} {remote_path}').split()[1].lower()
+        except Exception as e:
+            if self._is_connection_error(e):
+                if self._session_broken(e):
+                    self.disconnect(discard=True)
+                logger.warning(f"Cannot get the server's checksum of {remote_path}: {str(e)}")
+                return None
+            # Announced but not working (or SFTP without check-file): stop asking this server
+            logger.info(f"{self.host} cannot hash {remote_path} with {algorithm}: {str(e)}")
+            _server_hash_support[self.pool_key] = {name: how for name, how in _server_hash_support[self.pool_key].items()
+                                                   if name != algorithm}
+            return None
+    
+    def _verify_upload(self, remote_path, hasher, algorithm):
+        """Compare an upload with the server's own hash of it: True, False, or None if the server cannot tell"""
+        if not algorithm:
+            return None
+        remote_digest = self._server_checksum(remote_path, algorithm)
+        if remote_digest is None:
+            return None
+        return remote_digest == hasher.hexdigest(algorithm)
+    
+    def _read_stream(self, remote_path, callback, size=None):
+        """Pass the contents of remote_path to callback chunk by chunk on the leased session
+        
+        size (from a listing) lets a large file come over FTP in MODE Z.
+        """
+        callback = self.throttle.download.wrap(callback)
+        if self.protocol == 'ftp':
+            if self._use_mode_z(size):
+                retrieve_compressed(self.connection, f'RETR {remote_path}', callback, self.block_size)
+            else:
+                self.connection.retrbinary(f'RETR {remote_path}', callback, self.block_size)
+        elif self.protocol == 'sftp':
+            pipelined_read(self.connection, remote_path, callback, self.block_size, self.prefetch_window)
+    
+    def _write_stream(self, remote_path, chunks, size=None):
+        """Write the byte strings from chunks to remote_path on the leased session (size as in _read_stream)"""
+        chunks = self.throttle.upload.iterate(chunks)
+        try:
+            if self.protocol == 'ftp':
+                reader = _ChunkReader(chunks)
+                if self._use_mode_z(size):
+                    store_compressed(self.connection, f'STOR {remote_path}', reader, self.block_size)
+                else:
+                    self.connection.storbinary(f'STOR {remote_path}', reader, self.block_size)
+                return reader.transferred
+            return pipelined_write(self.connection, remote_path, chunks, self.block_size)
+        finally:
+            self._invalidate_listing(remote_path)
+    
+    def _create_remote_directory(self, remote_path, created=None):
+        """Create remote directory recursively
+        
+        created is an optional set of directories already handled, so a batch
+        of uploads only sends MKD/mkdir once per directory.
+        """
         try:
             if self.protocol == 'ftp':
                 # Split path and create directories one by one
@@ -262,14 +782,19 @@ class FTPClient:
                     if not part:
                         continue
                     current_path = f"{current_path}/{part}" if current_path else part
+                    if created is not None:
+                        if current_path in created:
+                            continue
+                        created.add(current_path)
                     
                     try:
                         self.connection.mkd(current_path)
+                        self._invalidate_listing(current_path)
                     except Exception:
                         # Directory might already exist, check if we can change to it
                         try:
-                            self.connection.cwd(current_path)
-                            self.connection.cwd('/')  # Go back to root
+                            self._cwd(current_path)
+                            self._cwd(self.home or '/')  # Go back to the login directory
                         except:
                             # If we can't change to it, it probably doesn't exist and creation failed
                             pass
@@ -283,9 +808,14 @@ class FTPClient:
                     if not part:
                         continue
                     current_path = f"{current_path}/{part}" if current_path else part
+                    if created is not None:
+                        if current_path in created:
+                            continue
+                        created.add(current_path)
                     
                     try:
                         self.connection.mkdir(current_path)
+                        self._invalidate_listing(current_path)
                     except Exception:
                         # Directory might already exist
                         pass
@@ -294,270 +824,216 @@ class FTPClient:
             # Ignore directory creation errors - upload might still work
             pass
     
+    def upload_many(self, tasks):
+        """Upload a planned list of files over up to max_connections parallel sessions
+        
+        The remote directories are created once up front on this client's
+        session instead of before every file.
+        """
+        with self.batch():
+            self._create_parent_directories(task['remote_path'] for task in tasks)
+            return upload_parallel(self, tasks, self.max_connections)
+    
+    def _create_parent_directories(self, remote_paths):
+        """Create the remote directories of remote_paths, each only once"""
+        if self.protocol not in ('ftp', 'sftp'):
+            # NFS uploads create their directories themselves
+            return
+        remote_dirs = sorted({os.path.dirname(remote_path) for remote_path in remote_paths} - {'', '.'})
+        if remote_dirs and self.connect():
+            created = set()
+            for remote_dir in remote_dirs:
+                self._create_remote_directory(remote_dir, created)
+    
+    def download_many(self, tasks):
+        """Download a planned list of files over up to max_connections parallel sessions"""
+        if self.sync_manifest is not None:
+            tasks = list(self.sync_manifest.pending(tasks))
+        return download_parallel(self, tasks, self.max_connections)
+    
     def download_files(self, remote_path, local_path):
-        """Download all files from remote directory"""
+        """Download all files from remote directory in parallel"""
+        with self.batch():
+            plan = self.plan_files(remote_path, local_path)
+            if not plan['success']:
+                return plan
+            return self.download_many(plan['tasks'])
+    
+    def plan_files(self, remote_path, local_path):
+        """List the files download_files would fetch, as transfer tasks"""
         try:
             files_list = self.list_files(remote_path)
             if not files_list['success']:
                 return files_list
             
-            files_processed = 0
-            bytes_transferred = 0
-            log_messages = []
-            
+            tasks = []
+            names = {file_info['name'] for file_info in files_list['files']}
             for file_info in files_list['files']:
                 if file_info['type'] == 'file':
                     remote_file_path = os.path.join(remote_path, file_info['name']).replace('\\', '/')
                     local_file_path = os.path.join(local_path, file_info['name'])
-                    
-                    result = self.download_file(remote_file_path, local_file_path)
-                    
-                    if result['success']:
-                        files_processed += 1
-                        bytes_transferred += result['bytes_transferred']
-                        log_messages.append(f"Downloaded: {file_info['name']}")
-                    else:
-                        log_messages.append(f"Failed to download: {file_info['name']} - {result['error']}")
+                    tasks.append(make_task(remote_file_path, local_file_path, file_info['name'],
+                                           size=file_info.get('size'), modify=file_info.get('modify'),
+                                           sidecars=sidecars_for(remote_file_path, names)))
             
-            return {
-                'success': True,
-                'files_processed': files_processed,
-                'bytes_transferred': bytes_transferred,
-                'log': log_messages
-            }
+            return {'success': True, 'tasks': tasks, 'log': []}
             
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def download_folder(self, remote_path, local_path):
-        """Download entire folder structure recursively"""
+    def scan_tree(self, remote_path, max_depth=None, max_workers=None):
+        """Yield the directories under remote_path breadth first (see tree_scanner.scan_tree)
+        
+        The listings run over up to max_workers sessions (default max_connections).
+        """
+        return scan_tree(self, remote_path, max_workers or self.max_connections, max_depth)
+    
+    def _download_tree(self, remote_path, plan_directory, max_depth=None):
+        """Scan remote_path and download the tasks plan_directory returns for each scanned directory
+        
+        With more than one connection allowed, half of them scan on clones of
+        this client while the other half already download what has been found;
+        the scan's share joins the downloads once the tree is listed. With a
+        single connection the tree is scanned first and then downloaded.
+        """
+        streaming = self.protocol in ('ftp', 'sftp') and self.max_connections > 1
+        scan_workers = max(1, self.max_connections // 2) if streaming else self.max_connections
+        scan = scan_tree(self.clone() if streaming else self, remote_path, scan_workers, max_depth)
         try:
-            files_processed = 0
-            bytes_transferred = 0
-            log_messages = []
-            
-            def download_recursive(remote_dir, local_dir):
-                """Recursively download all files and folders"""
-                nonlocal files_processed, bytes_transferred
-                
-                files_list = self.list_files(remote_dir)
-                if not files_list['success']:
-                    return files_list
-                
-                # Create local directory
-                os.makedirs(local_dir, exist_ok=True)
+            tasks = (task for directory in scan for task in plan_directory(directory))
+            if streaming:
+                if self.sync_manifest is not None:
+                    tasks = self.sync_manifest.pending(tasks)
+                return download_streaming(self, tasks, self.max_connections, self.max_connections - scan_workers)
+            return self.download_many(list(tasks))
+        finally:
+            scan.close()
+    
+    def download_folder(self, remote_path, local_path):
+        """Download entire folder structure recursively, transferring files while the tree is scanned"""
+        with self.batch():
+            try:
+                log_messages = []
                 
-                for file_info in files_list['files']:
-                    if file_info['type'] == 'file':
-                        # Download file
-                        remote_file_path = os.path.join(remote_dir, file_info['name']).replace('\\', '/')
-                        local_file_path = os.path.join(local_dir, file_info['name'])
-                        
-                        result = self.download_file(remote_file_path, local_file_path)
-                        
-                        if result['success']:
-                            files_processed += 1
-                            bytes_transferred += result['bytes_transferred']
-                            log_messages.append(f"Downloaded: {os.path.relpath(local_file_path, local_path)}")
-                        else:
-                            log_messages.append(f"Failed to download: {file_info['name']} - {result['error']}")
+                def plan_directory(directory):
+                    """Create the local folder of a scanned directory and queue its files"""
+                    if directory.error:
+                        if directory.depth == 0:
+                            raise Exception(directory.error)
+                        log_messages.append(f"Error listing directory {directory.relative_path}: {directory.error}")
+                        return []
                     
-                    elif file_info['type'] == 'directory':
-                        # Recursively download subdirectory
-                        subdir_remote = os.path.join(remote_dir, file_info['name']).replace('\\', '/')
-                        subdir_local = os.path.join(local_dir, file_info['name'])
-                        
-                        log_messages.append(f"Entering directory: {os.path.relpath(subdir_local, local_path)}")
-                        download_recursive(subdir_remote, subdir_local)
+                    local_dir = os.path.join(local_path, directory.relative_path)
+                    os.makedirs(local_dir, exist_ok=True)
+                    if directory.depth:
+                        log_messages.append(f"Entering directory: {directory.relative_path}")
+                    
+                    tasks = []
+                    names = {file_info['name'] for file_info in directory.files}
+                    for file_info in directory.files:
+                        remote_file_path = f"{directory.path.rstrip('/')}/{file_info['name']}"
+                        local_file_path = os.path.join(local_dir, file_info['name'])
+                        tasks.append(make_task(remote_file_path, local_file_path,
+                                               os.path.relpath(local_file_path, local_path),
+                                               size=file_info.get('size'), modify=file_info.get('modify'),
+                                               sidecars=sidecars_for(remote_file_path, names)))
+                    return tasks
                 
-                return {'success': True}
-            
-            # Start recursive download
-            result = download_recursive(remote_path, local_path)
-            
-            if result['success']:
-                return {
-                    'success': True,
-                    'files_processed': files_processed,
-                    'bytes_transferred': bytes_transferred,
-                    'log': log_messages
-                }
-            else:
+                result = self._download_tree(remote_path, plan_directory)
+                result['log'] = log_messages + result['log']
                 return result
-                
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+                    
+            except Exception as e:
+                return {'success': False, 'error': str(e)}
     
     def download_all_files(self, remote_path, local_path):
-        """Download all files and folders with retry logic"""
+        """Download all files and folders in parallel, skipping files a previous run already fetched"""
         try:
-            import ftplib
-            import time
+            # Create local directory
+            os.makedirs(local_path, exist_ok=True)
             
-            files_processed = 0
-            bytes_transferred = 0
             log_messages = []
+            with self.batch():
+                result = self._download_tree(remote_path, self._all_files_planner(local_path, log_messages),
+                                             max_depth=1)
             
-            # Create local directory
-            os.makedirs(local_path, exist_ok=True)
+            result['log'] = log_messages + result['log']
+            return result
             
-            # Multiple attempts with fresh connections
-            for attempt in range(3):
-                try:
-                    log_messages.append(f"Connection attempt {attempt + 1}")
-                    
-                    ftp = ftplib.FTP()
-                    ftp.connect(self.host, self.port, timeout=60)
-                    ftp.login(self.username, self.password)
-                    ftp.set_pasv(True)
-                    
-                    # Get directory listing
-                    ftp.cwd(remote_path)
-                    lines = []
-                    ftp.retrlines('LIST', lines.append)
-                    
-                    files_to_download = []
-                    folders_to_process = []
-                    
-                    for line in lines:
-                        parts = line.split()
-                        if len(parts) >= 9:
-                            permissions = parts[0]
-                            filename = ' '.join(parts[8:])
-                            
-                            if filename not in ['.', '..']:
-                                if permissions.startswith('d'):
-                                    folders_to_process.append(filename)
-                                else:
-                                    files_to_download.append(filename)
-                    
-                    log_messages.append(f"Found {len(files_to_download)} files, {len(folders_to_process)} folders")
-                    
-                    # Download files in batches of 10
-                    batch_size = 10
-                    for i in range(0, len(files_to_download), batch_size):
-                        batch = files_to_download[i:i+batch_size]
-                        
-                        for filename in batch:
-                            local_file_path = os.path.join(local_path, filename)
-                            
-                            # Skip if already downloaded
-                            if os.path.exists(local_file_path) and os.path.getsize(local_file_path) > 0:
-                                continue
-                            
-                            try:
-                                with open(local_file_path, 'wb') as local_file:
-                                    ftp.retrbinary(f'RETR {filename}', local_file.write)
-                                
-                                file_size = os.path.getsize(local_file_path)
-                                if file_size > 0:
-                                    files_processed += 1
-                                    bytes_transferred += file_size
-                                    log_messages.append(f"Downloaded: {filename} ({file_size} bytes)")
-                                else:
-                                    if os.path.exists(local_file_path):
-                                        os.remove(local_file_path)
-                                    log_messages.append(f"Failed: {filename} (0 bytes)")
-                                
-                            except Exception as e:
-                                log_messages.append(f"Error downloading {filename}: {str(e)}")
-                                if os.path.exists(local_file_path):
-                                    os.remove(local_file_path)
-                                continue
-                            
-                            # Small delay between files
-                            time.sleep(0.1)
-                        
-                        # Re-establish connection every batch to prevent timeouts
-                        if i + batch_size < len(files_to_download):
-                            try:
-                                ftp.quit()
-                                ftp = ftplib.FTP()
-                                ftp.connect(self.host, self.port, timeout=60)
-                                ftp.login(self.username, self.password)
-                                ftp.set_pasv(True)
-                                ftp.cwd(remote_path)
-                            except:
-                                log_messages.append(f"Connection refresh failed at batch {i//batch_size + 1}")
-                                break
-                    
-                    # Download from subdirectories
-                    for folder_name in folders_to_process:
-                        try:
-                            ftp.cwd(f"{remote_path}/{folder_name}")
-                            folder_lines = []
-                            ftp.retrlines('LIST', folder_lines.append)
-                            
-                            for line in folder_lines:
-                                parts = line.split()
-                                if len(parts) >= 9:
-                                    permissions = parts[0]
-                                    filename = ' '.join(parts[8:])
-                                    
-                                    if filename not in ['.', '..'] and not permissions.startswith('d'):
-                                        local_file_path = os.path.join(local_path, filename)
-                                        
-                                        # Skip if already downloaded
-                                        if os.path.exists(local_file_path) and os.path.getsize(local_file_path) > 0:
-                                            continue
-                                        
-                                        try:
-                                            with open(local_file_path, 'wb') as local_file:
-                                                ftp.retrbinary(f'RETR {filename}', local_file.write)
-                                            
-                                            file_size = os.path.getsize(local_file_path)
-                                            if file_size > 0:
-                                                files_processed += 1
-                                                bytes_transferred += file_size
-                                                log_messages.append(f"Downloaded from {folder_name}: {filename} ({file_size} bytes)")
-                                            else:
-                                                if os.path.exists(local_file_path):
-                                                    os.remove(local_file_path)
-                                        
-                                        except Exception as e:
-                                            log_messages.append(f"Error downloading {folder_name}/{filename}: {str(e)}")
-                                            if os.path.exists(local_file_path):
-                                                os.remove(local_file_path)
-                            
-                            ftp.cwd(remote_path)
-                            
-                        except Exception as e:
-                            log_messages.append(f"Error processing folder {folder_name}: {str(e)}")
-                    
-                    ftp.quit()
-                    break  # Success - exit retry loop
-                    
-                except Exception as e:
-                    log_messages.append(f"Attempt {attempt + 1} failed: {str(e)}")
-                    try:
-                        ftp.quit()
-                    except:
-                        pass
-                    
-                    if attempt < 2:
-                        time.sleep(2)  # Wait before retry
-                    continue
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    def plan_all_files(self, remote_path, local_path):
+        """List the files download_all_files would fetch, flattened into local_path"""
+        try:
+            log_messages = []
+            plan_directory = self._all_files_planner(local_path, log_messages)
             
-            return {
-                'success': True,
-                'files_processed': files_processed,
-                'bytes_transferred': bytes_transferred,
-                'log': log_messages
-            }
+            with self.batch():
+                tasks = [task for directory in self.scan_tree(remote_path, max_depth=1)
+                         for task in plan_directory(directory)]
+            
+            return {'success': True, 'tasks': tasks, 'log': log_messages}
             
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
+    def _all_files_planner(self, local_path, log_messages):
+        """plan_directory for download_all_files: the top folder and its direct subfolders, saved flat"""
+        planned_names = set()
+        
+        def plan_directory(directory):
+            if directory.error:
+                if directory.depth == 0:
+                    raise Exception(directory.error)
+                log_messages.append(f"Error processing folder {directory.relative_path}: {directory.error}")
+                return []
+            
+            if directory.depth == 0:
+                log_messages.append(f"Found {len(directory.files)} files, {len(directory.folders)} folders")
+                label = ''
+            else:
+                # Files from subdirectories are saved flat in local_path
+                label = f" from {directory.relative_path}"
+            
+            tasks = []
+            names = {file_info['name'] for file_info in directory.files}
+            for file_info in directory.files:
+                filename = file_info['name']
+                # A name already queued from another folder is skipped as before
+                if filename in planned_names:
+                    continue
+                planned_names.add(filename)
+                remote_file_path = f"{directory.path.rstrip('/')}/{filename}"
+                # An incremental job's manifest decides instead whether a file changed
+                tasks.append(make_task(remote_file_path, os.path.join(local_path, filename),
+                                       filename, note=label, skip_existing=self.sync_manifest is None,
+                                       require_content=True, size=file_info.get('size'),
+                                       modify=file_info.get('modify'), sidecars=sidecars_for(remote_file_path, names)))
+            return tasks
+        
+        return plan_directory
+    
     def download_files_by_date_range(self, remote_path, local_path, date_from, date_to):
-        """Download files within date range"""
+        """Download files within date range in parallel"""
+        with self.batch():
+            plan = self.plan_files_by_date_range(remote_path, local_path, date_from, date_to)
+            if not plan['success']:
+                return plan
+            result = self.download_many(plan['tasks'])
+            result['log'] = plan['log'] + result['log']
+            return result
+    
+    def plan_files_by_date_range(self, remote_path, local_path, date_from, date_to):
+        """List the files download_files_by_date_range would fetch, as transfer tasks"""
         try:
             files_list = self.list_files(remote_path)
             if not files_list['success']:
                 return files_list
             
-            files_processed = 0
-            bytes_transferred = 0
+            tasks = []
             log_messages = []
+            names = {file_info['name'] for file_info in files_list['files']}
             
             for file_info in files_list['files']:
                 if file_info['type'] == 'file' and file_info['modify']:
@@ -577,26 +1053,16 @@ class FTPClient:
                         if date_from <= file_date <= date_to:
                             remote_file_path = os.path.join(remote_path, file_info['name']).replace('\\', '/')
                             local_file_path = os.path.join(local_path, file_info['name'])
-                            
-                            result = self.download_file(remote_file_path, local_file_path)
-                            
-                            if result['success']:
-                                files_processed += 1
-                                bytes_transferred += result['bytes_transferred']
-                                log_messages.append(f"Downloaded: {file_info['name']} (modified: {file_date})")
-                            else:
-                                log_messages.append(f"Failed to download: {file_info['name']} - {result['error']}")
+                            tasks.append(make_task(remote_file_path, local_file_path, file_info['name'],
+                                                   note=f" (modified: {file_date})", size=file_info.get('size'),
+                                                   modify=file_info['modify'],
+                                                   sidecars=sidecars_for(remote_file_path, names)))
                         
                     except Exception as e:
                         log_messages.append(f"Error processing file {file_info['name']}: {str(e)}")
                         continue
             
-            return {
-                'success': True,
-                'files_processed': files_processed,
-                'bytes_transferred': bytes_transferred,
-                'log': log_messages
-            }
+            return {'success': True, 'tasks': tasks, 'log': log_messages}
             
         except Exception as e:
             return {'success': False, 'error': str(e)}
@@ -604,11 +1070,8 @@ class FTPClient:
     def download_files_enhanced(self, remote_path, local_path, job=None):
         """Enhanced download with advanced options from job configuration"""
         log_messages = []
-        files_processed = 0
-        bytes_transferred = 0
         
         try:
-            import ftplib
             from datetime import datetime
             
             # Use enhanced options if job is provided (moved from site-level to job-level)
@@ -618,26 +1081,8 @@ class FTPClient:
             use_date_folders = job.use_date_folders if job else False
             date_folder_format = job.date_folder_format if job else 'YYYY-MM-DD'
             
-            # Connect to FTP server with improved connection handling
-            ftp = ftplib.FTP()
-            ftp.connect(self.host, self.port, timeout=30)
-            ftp.login(self.username, self.password)
-            
-            # Try passive mode first, fallback to active if needed
-            try:
-                ftp.set_pasv(True)
-                # Test passive mode with a quick command
-                ftp.pwd()
-                log_messages.append("Using passive FTP mode")
-            except Exception as e:
-                log_messages.append(f"Passive mode failed ({e}), trying active mode")
-                try:
-                    ftp.set_pasv(False)
-                    ftp.pwd()
-                    log_messages.append("Using active FTP mode")
-                except Exception as e2:
-                    log_messages.append(f"Both FTP modes failed: passive={e}, active={e2}")
-                    raise Exception(f"FTP connection failed in both modes: {e2}")
+            # Local names handed out in this run, so parallel workers never share a file
+            reserved_paths = set()
             
             def get_unique_filename(file_path):
                 """Generate unique filename if duplicate renaming is enabled"""
@@ -649,11 +1094,12 @@ class FTPClient:
                 name, ext = os.path.splitext(base_name)
                 
                 counter = 1
-                while os.path.exists(file_path):
+                while os.path.exists(file_path) or file_path in reserved_paths:
                     new_name = f"{name}_{counter}{ext}"
                     file_path = os.path.join(base_path, new_name)
                     counter += 1
                 
+                reserved_paths.add(file_path)
                 return file_path
             
             def get_date_folder_path(base_path):
@@ -675,77 +1121,6 @@ class FTPClient:
                 
                 return os.path.join(base_path, date_folder)
             
-            def download_recursive(remote_dir, local_base_dir, current_relative_path=""):
-                """Recursively download files from directory with proper folder structure"""
-                nonlocal files_processed, bytes_transferred
-                
-                try:
-                    # Change to remote directory
-                    ftp.cwd(remote_dir)
-                    lines = []
-                    ftp.retrlines('LIST', lines.append)
-                    
-                    for line in lines:
-                        parts = line.split()
-                        if len(parts) >= 9:
-                            permissions = parts[0]
-                            filename = ' '.join(parts[8:])
-                            
-                            if filename not in ['.', '..']:
-                                if permissions.startswith('d'):
-                                    # Directory - recurse into it
-                                    if preserve_folder_structure:
-                                        # Build the new relative path for folder structure
-                                        new_relative_path = os.path.join(current_relative_path, filename) if current_relative_path else filename
-                                    else:
-                                        # Flattened - keep empty relative path
-                                        new_relative_path = ""
-                                    
-                                    # Recursive call
-                                    download_recursive(f"{remote_dir}/{filename}", local_base_dir, new_relative_path)
-                                    
-                                    # Always return to current directory after recursion
-                                    ftp.cwd(remote_dir)
-                                
-                                else:
-                                    # File - download it to appropriate location
-                                    if preserve_folder_structure and current_relative_path:
-                                        # Create folder structure and download to it
-                                        target_local_dir = os.path.join(local_base_dir, current_relative_path)
-                                    else:
-                                        # Download to base directory (flattened)
-                                        target_local_dir = local_base_dir
-                                    
-                                    # Apply date folder if enabled
-                                    target_local_dir = get_date_folder_path(target_local_dir)
-                                    os.makedirs(target_local_dir, exist_ok=True)
-                                    
-                                    local_file_path = os.path.join(target_local_dir, filename)
-                                    local_file_path = get_unique_filename(local_file_path)
-                                    
-                                    try:
-                                        with open(local_file_path, 'wb') as local_file:
-                                            ftp.retrbinary(f'RETR {filename}', local_file.write)
-                                        
-                                        file_size = os.path.getsize(local_file_path)
-                                        if file_size > 0:
-                                            files_processed += 1
-                                            bytes_transferred += file_size
-                                            folder_info = f" in {current_relative_path}/" if current_relative_path else ""
-                                            log_messages.append(f"Downloaded: {filename}{folder_info} ({file_size} bytes)")
-                                        else:
-                                            log_messages.append(f"Failed: {filename} (0 bytes)")
-                                            if os.path.exists(local_file_path):
-                                                os.remove(local_file_path)
-                                        
-                                    except Exception as e:
-                                        log_messages.append(f"Failed to download {filename}: {str(e)}")
-                                        if os.path.exists(local_file_path):
-                                            os.remove(local_file_path)
-                
-                except Exception as e:
-                    log_messages.append(f"Error processing directory {remote_dir}: {str(e)}")
-            
             # Job group folder organization is handled in scheduler.py
             # Don't apply it again here to avoid duplication
             
@@ -756,200 +1131,52 @@ class FTPClient:
             final_local_path = get_date_folder_path(local_path)
             os.makedirs(final_local_path, exist_ok=True)
             
-            try:
-                # Get complete directory listing
-                ftp.cwd(remote_path)
-                lines = []
-                ftp.retrlines('LIST', lines.append)
-                
-                files_found = []
-                directories_found = []
-                
-                for line in lines:
-                    parts = line.split()
-                    if len(parts) >= 9:
-                        permissions = parts[0]
-                        filename = ' '.join(parts[8:])
-                        
-                        if filename not in ['.', '..']:
-                            if permissions.startswith('d'):
-                                directories_found.append(filename)
-                            else:
-                                files_found.append(filename)
+            def plan_directory(directory):
+                """Queue the files of a scanned directory with their local targets"""
+                if directory.error:
+                    if directory.depth == 0:
+                        log_messages.append(f"Error during download process: {directory.error}")
+                    else:
+                        log_messages.append(f"Error processing directory {directory.path}: {directory.error}")
+                    return []
                 
-                log_messages.append(f"Found {len(files_found)} files and {len(directories_found)} directories")
+                current_relative_path = directory.relative_path if preserve_folder_structure else ""
+                if current_relative_path:
+                    # Create folder structure and download to it
+                    target_local_dir = os.path.join(final_local_path, current_relative_path)
+                else:
+                    # Download to base directory (flattened)
+                    target_local_dir = final_local_path
+                os.makedirs(target_local_dir, exist_ok=True)
                 
-                # Download all files from root directory
-                for filename in files_found:
-                    local_file_path = os.path.join(final_local_path, filename)
-                    local_file_path = get_unique_filename(local_file_path)
-                    
-                    try:
-                        with open(local_file_path, 'wb') as local_file:
-                            ftp.retrbinary(f'RETR {filename}', local_file.write)
-                        
-                        file_size = os.path.getsize(local_file_path)
-                        if file_size > 0:
-                            files_processed += 1
-                            bytes_transferred += file_size
-                            log_messages.append(f"Downloaded: {filename} ({file_size} bytes)")
-                        else:
-                            log_messages.append(f"Failed: {filename} (0 bytes)")
-                            if os.path.exists(local_file_path):
-                                os.remove(local_file_path)
-                    
-                    except Exception as e:
-                        log_messages.append(f"Error downloading {filename}: {str(e)}")
-                        if os.path.exists(local_file_path):
-                            os.remove(local_file_path)
+                tasks = []
+                folder_info = f" in {current_relative_path}/" if current_relative_path else ""
+                names = {file_info['name'] for file_info in directory.files}
+                for file_info in directory.files:
+                    filename = file_info['name']
+                    remote_file_path = f"{directory.path.rstrip('/')}/{filename}"
+                    local_file_path = get_unique_filename(os.path.join(target_local_dir, filename))
+                    tasks.append(make_task(remote_file_path, local_file_path,
+                                           f"{filename}{folder_info}", require_content=True,
+                                           size=file_info.get('size'), modify=file_info.get('modify'),
+                                           sidecars=sidecars_for(remote_file_path, names)))
                 
-                # Download files from subdirectories if recursive is enabled
-                if enable_recursive:
-                    for dir_name in directories_found:
-                        try:
+                if directory.depth == 0:
+                    log_messages.append(f"Found {len(directory.files)} files and {len(directory.folders)} directories")
+                    if enable_recursive:
+                        for dir_name in directory.folders:
                             log_messages.append(f"Processing directory: {dir_name}")
-                            
-                            if preserve_folder_structure:
-                                # Create subdirectory in local path and download to it
-                                download_recursive(f"{remote_path}/{dir_name}", final_local_path, dir_name)
-                            else:
-                                # Flatten structure - download all files to main directory
-                                download_recursive(f"{remote_path}/{dir_name}", final_local_path, "")
-                            
-                        except Exception as e:
-                            log_messages.append(f"Error processing directory {dir_name}: {str(e)}")
-                            continue
-                
-                log_messages.append(f"Download complete: {files_processed} files, {bytes_transferred} bytes")
-                
-            except Exception as e:
-                log_messages.append(f"Error during download process: {str(e)}")
-            
-            try:
-                ftp.quit()
-            except:
-                pass
-            
-            return {
-                'success': True,
-                'files_processed': files_processed,
-                'bytes_transferred': bytes_transferred,
-                'log': log_messages
-            }
+                return tasks
             
-            def get_unique_filename(file_path):
-                """Generate unique filename if duplicate renaming is enabled"""
-                if not enable_duplicate_renaming:
-                    return file_path
-                
-                # Check if file already exists on disk
-                if not os.path.exists(file_path):
-                    processed_files.add(file_path)
-                    return file_path
-                
-                # Generate numbered variants
-                directory = os.path.dirname(file_path)
-                filename = os.path.basename(file_path)
-                base_name, ext = os.path.splitext(filename)
-                counter = 1
-                
-                while True:
-                    new_filename = f"{base_name}_{counter}{ext}"
-                    new_path = os.path.join(directory, new_filename)
-                    
-                    if not os.path.exists(new_path) and new_path not in processed_files:
-                        processed_files.add(new_path)
-                        return new_path
-                    counter += 1
-            
-            def get_date_folder_path(base_path):
-                """Generate date-based folder path if enabled"""
-                if not use_date_folders:
-                    return base_path
-                
-                from datetime import datetime
-                today = datetime.now()
-                
-                # Convert format string to Python strftime
-                format_map = {
-                    'YYYY': '%Y',
-                    'MM': '%m', 
-                    'DD': '%d',
-                    'YY': '%y'
-                }
-                
-                python_format = date_folder_format
-                for old, new in format_map.items():
-                    python_format = python_format.replace(old, new)
-                
-                date_folder = today.strftime(python_format)
-                return os.path.join(base_path, date_folder)
-            
-            def download_from_directory(remote_dir, local_dir, is_recursive=False):
-                """Recursively download files from directory"""
-                files_list = self.list_files(remote_dir)
-                if not files_list['success']:
-                    return files_list
-                
-                nonlocal files_processed, bytes_transferred
-                
-                for file_info in files_list['files']:
-                    if file_info['type'] == 'file':
-                        # Handle file downloads
-                        remote_file_path = os.path.join(remote_dir, file_info['name']).replace('\\', '/')
-                        
-                        # Apply date folder if enabled (only at the root level to avoid nested date folders)
-                        if remote_dir == remote_path:  # Only apply date folders at root level
-                            target_local_dir = get_date_folder_path(local_dir)
-                        else:
-                            target_local_dir = local_dir
-                        
-                        # Create target directory
-                        os.makedirs(target_local_dir, exist_ok=True)
-                        
-                        # Handle duplicates
-                        local_file_path = os.path.join(target_local_dir, file_info['name'])
-                        local_file_path = get_unique_filename(local_file_path)
-                        
-                        try:
-                            result = self.download_file(remote_file_path, local_file_path)
-                            
-                            if result['success']:
-                                files_processed += 1
-                                bytes_transferred += result['bytes_transferred']
-                                log_messages.append(f"Downloaded: {file_info['name']} -> {os.path.relpath(local_file_path, local_path)}")
-                            else:
-                                log_messages.append(f"Failed to download: {file_info['name']} - {result['error']}")
-                        except Exception as e:
-                            log_messages.append(f"Error downloading {file_info['name']}: {str(e)}")
-                    
-                    elif file_info['type'] == 'directory' and is_recursive:
-                        # Recursively download from subdirectories (preserve structure)
-                        subdir_remote = os.path.join(remote_dir, file_info['name']).replace('\\', '/')
-                        
-                        # Preserve original folder structure
-                        subdir_local = os.path.join(local_dir, file_info['name'])
-                        os.makedirs(subdir_local, exist_ok=True)
-                        
-                        log_messages.append(f"Entering directory: {file_info['name']}")
-                        subdir_result = download_from_directory(subdir_remote, subdir_local, True)
-                        if not subdir_result['success']:
-                            log_messages.append(f"Warning: Failed to download directory {file_info['name']}: {subdir_result.get('error', 'Unknown error')}")
-                
-                return {'success': True}
-            
-            # Start the download process with proper recursive flag
-            result = download_from_directory(remote_path, local_path, enable_recursive)
+            with self.batch():
+                # Subdirectories are only scanned if recursive is enabled
+                result = self._download_tree(remote_path, plan_directory, max_depth=None if enable_recursive else 0)
             
-            if result['success']:
-                return {
-                    'success': True,
-                    'files_processed': files_processed,
-                    'bytes_transferred': bytes_transferred,
-                    'log': log_messages
-                }
-            else:
-                return result
+            log_messages.extend(result['log'])
+            log_messages.append(f"Download complete: {result['files_processed']} files, {result['bytes_transferred']} bytes")
+            result['log'] = log_messages
+            return result
                 
         except Exception as e:
+            self.disconnect(discard=True)
             return {'success': False, 'error': str(e)}
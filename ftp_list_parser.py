@@ -0,0 +1,241 @@
+"""
+FTP directory listing parser.
+
+Turns LIST output (Unix ls -l style and MS-DOS/IIS style) and MLSD facts into
+ListEntry tuples with name, type, size, modification time and permissions.
+Well-formed lines are split on whitespace; the compiled patterns only run
+for lines that do not split cleanly (device files, listings without a group
+column). The dialect a site answered with is cached per site key, so later
+listings try that dialect first and only fall back to detection for lines it
+does not match. Dates are kept as listed and only parsed when an entry's
+mtime or modify is read, with a cache for the dates a listing repeats.
+"""
+import functools
+import re
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+_MONTHS = {month: index for index, month in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], 1)}
+_MONTHS.update({month.title(): index for month, index in list(_MONTHS.items())})
+_UNIX_TYPES = frozenset('-dlbcpsDn?')
+_new = tuple.__new__  # builds a ListEntry without namedtuple's keyword handling
+
+
+class ListEntry(namedtuple('ListEntry', ['name', 'type', 'size', 'stamp', 'permissions'])):
+    """One listed entry; type is 'file', 'directory' or 'link'
+
+    stamp is the date as listed - 'Jan 5 10:01' or 'Jan 5 2025' for Unix
+    lines, '01-16-26 02:30PM' for MS-DOS lines, the modify fact for MLSD - and
+    is only turned into a datetime when mtime or modify is read.
+    """
+    __slots__ = ()
+
+    @property
+    def mtime(self):
+        """Modification time as a datetime, None if the listing had none or it does not parse"""
+        return _stamp_times(self.stamp, int(time.time() // 86400))[0] if self.stamp else None
+
+    @property
+    def modify(self):
+        """Modification time as YYYYMMDDHHMMSS, '' if unknown"""
+        return _stamp_times(self.stamp, int(time.time() // 86400))[1] if self.stamp else ''
+
+
+# Fallbacks for the lines the split() fast paths below do not take
+# -rw-r--r--   1 owner group   1234 Jan  5 10:01 name
+# Link count, owner and group are optional; device files show "major, minor"
+_UNIX_LINE = re.compile(
+    r'(?P<permissions>[-dlbcpsDn?][-rwxsStTlL]{9})[+@.]?\s+'
+    r'(?:\d+\s+)?(?:\S+\s+)?(?:\S+\s+)?'
+    r'(?:\d+,\s*)?(?P<size>\d+)\s+'
+    r'(?P<month>[A-Za-z]{3})\s+(?P<day>\d{1,2})\s+'
+    r'(?P<time>\d{1,2}:\d{2}|\d{4})\s(?P<name>.+)')
+
+# 01-16-26  02:30PM       <DIR>          name
+# 01-16-2026  14:30             1234 name
+_DOS_LINE = re.compile(
+    r'(?P<date>\d{2}-\d{2}-(?:\d{4}|\d{2}))\s+'
+    r'(?P<time>\d{1,2}:\d{2}\s*(?:[AaPp][Mm])?)\s+'
+    r'(?:(?P<dir><DIR>)|(?P<size>\d+))\s+(?P<name>.+)')
+
+_dialects = {}  # site key -> dialect name that last parsed its listings
+_dialects_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=4096)
+def _stamp_times(stamp, epoch_day):
+    """(datetime, YYYYMMDDHHMMSS) for a ListEntry stamp, (None, '') if it does not parse
+
+    Listings repeat the same few dates, so each is parsed once; epoch_day is
+    part of the key because recent Unix entries take their year from today.
+    """
+    try:
+        if stamp[0].isalpha():
+            mtime = _unix_time(*stamp.split(), epoch_day)
+        elif stamp[2] == '-':
+            mtime = _dos_time(*stamp.split(None, 1))
+        else:
+            mtime = datetime(int(stamp[0:4]), int(stamp[4:6]), int(stamp[6:8]),
+                             int(stamp[8:10]), int(stamp[10:12]), int(stamp[12:14]))
+    except (ValueError, IndexError, TypeError):
+        return None, ''
+    if mtime is None:
+        return None, ''
+    # %-formatting: strftime costs twice as much as parsing the date did
+    return mtime, '%04d%02d%02d%02d%02d%02d' % (mtime.year, mtime.month, mtime.day,
+                                                mtime.hour, mtime.minute, mtime.second)
+
+
+@functools.lru_cache(maxsize=1)
+def _this_year(epoch_day):
+    """The current year and the latest time a recent Unix entry can have in it
+
+    Both come from epoch_day, the same (UTC) day the parse cache is keyed on,
+    so the year never lags or leads the cache key around midnight.
+    """
+    today = date(1970, 1, 1) + timedelta(days=epoch_day)
+    return today.year, datetime.combine(today + timedelta(days=2), datetime.min.time())
+
+
+def _unix_time(month, day, year_or_time, epoch_day):
+    month_number = _MONTHS.get(month) or _MONTHS.get(month.lower())
+    if not month_number:
+        return None
+    if ':' in year_or_time:
+        # Recent files show the time instead of the year; a date after tomorrow is last year's
+        year, cutoff = _this_year(epoch_day)
+        hour, minute = year_or_time.split(':')
+        mtime = datetime(year, month_number, int(day), int(hour), int(minute))
+        if mtime >= cutoff:
+            mtime = mtime.replace(year=year - 1)
+        return mtime
+    return datetime(int(year_or_time), month_number, int(day))
+
+
+def _dos_time(listed_date, listed_time):
+    month, day, year = listed_date.split('-')
+    year = int(year)
+    if year < 100:
+        year += 2000 if year < 70 else 1900
+    ampm = listed_time[-2:].lower()
+    hour, minute = listed_time.rstrip('AaPpMm ').split(':')
+    hour = int(hour)
+    if ampm in ('am', 'pm'):
+        hour = hour % 12 + (12 if ampm == 'pm' else 0)
+    return datetime(year, int(month), int(day), hour, int(minute))
+
+
+def _parse_unix(line):
+    # Common case: permissions, links, owner, group, size, month, day, time and name
+    fields = line.split(None, 7)
+    if len(fields) == 8:
+        permissions, _, _, _, size, month, day, rest = fields
+        year_or_time, _, name = rest.partition(' ')
+        if not (name and size.isdigit() and month in _MONTHS and day.isdigit()
+                and permissions[0] in _UNIX_TYPES and 10 <= len(permissions) <= 11):
+            fields = None
+    else:
+        fields = None
+    if fields is None:
+        match = _UNIX_LINE.match(line)
+        if match is None:
+            return None
+        permissions, size, month, day, year_or_time, name = match.groups()
+
+    kind = permissions[0]
+    if kind == 'd':
+        entry_type = 'directory'
+    elif kind == 'l':
+        entry_type = 'link'
+        name = name.split(' -> ', 1)[0]
+    else:
+        entry_type = 'file'
+    return _new(ListEntry, (name, entry_type, int(size), f'{month} {day} {year_or_time}', permissions))
+
+
+def _parse_dos(line):
+    fields = line.split(None, 3)
+    if len(fields) == 4 and len(fields[0]) in (8, 10) and fields[0][2] == '-' and ':' in fields[1] \
+            and (fields[2] == '<DIR>' or fields[2].isdigit()):
+        listed_date, listed_time, size, name = fields
+        is_dir = size == '<DIR>'
+    else:
+        match = _DOS_LINE.match(line)
+        if match is None:
+            return None
+        listed_date, listed_time, is_dir, size, name = match.groups()
+
+    if is_dir:
+        return _new(ListEntry, (name, 'directory', 0, f'{listed_date} {listed_time}', 'd---------'))
+    return _new(ListEntry, (name, 'file', int(size), f'{listed_date} {listed_time}', '----------'))
+
+
+_PARSERS = {
+    'unix': _parse_unix,
+    'dos': _parse_dos,
+}
+
+
+def parse_list(lines, site_key=None):
+    """Parse LIST output into ListEntry tuples, skipping '.', '..' and 'total' lines
+
+    With site_key the dialect that matched is remembered for that site's next
+    listing, so detection only runs for lines the usual dialect rejects.
+    """
+    with _dialects_lock:
+        dialect = _dialects.get(site_key)
+    parser = _PARSERS.get(dialect)
+    entries = []
+
+    for line in lines:
+        entry = parser(line) if parser else None
+        if entry is None:
+            if not line or line.startswith('total'):
+                continue
+            for name, candidate in _PARSERS.items():
+                if candidate is not parser:
+                    entry = candidate(line)
+                    if entry is not None:
+                        dialect, parser = name, candidate
+                        break
+            if entry is None:
+                continue
+        if entry.name not in ('.', '..'):
+            entries.append(entry)
+
+    if site_key is not None and dialect:
+        with _dialects_lock:
+            _dialects[site_key] = dialect
+    return entries
+
+
+def entry_from_mlsd(name, facts):
+    """Build a ListEntry from one (name, facts) pair of ftplib's mlsd(); None for cdir/pdir"""
+    fact_type = facts.get('type', 'file').lower()
+    if fact_type in ('cdir', 'pdir') or name in ('.', '..'):
+        return None
+    if fact_type == 'dir':
+        entry_type = 'directory'
+    elif 'link' in fact_type:
+        # OS.unix=symlink / OS.unix=slink:target
+        entry_type = 'link'
+    else:
+        entry_type = 'file'
+
+    size = facts.get('size') or facts.get('sizd') or 0
+    modify = facts.get('modify')
+    permissions = facts.get('unix.mode') or facts.get('perm') or ''
+    return ListEntry(name, entry_type, int(size), modify or '', permissions)
+
+
+def to_record(entry):
+    """The {'name', 'size', 'modify', 'type'} record FTPClient.list_files returns"""
+    return {
+        'name': entry.name,
+        'size': entry.size,
+        'modify': entry.modify,
+        'type': 'directory' if entry.type == 'directory' else 'file'
+    }
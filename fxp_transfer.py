@@ -0,0 +1,274 @@
+"""
+FXP (server-to-server) transfers between two FTP sites.
+
+The source server is put in passive mode and the target server is told to
+connect to it with PORT; RETR on the source and STOR on the target are then
+sent together, so the data flows directly between the two servers and only the
+control replies pass through this host. Many servers refuse PORT to an address
+other than the client's ("foreign address"), so probe_fxp() checks each pair
+of sites once and caches the answer; when FXP is not allowed the upload job
+falls back to relay or staging.
+"""
+import ftplib
+import logging
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from checksums import format_checksum
+
+logger = logging.getLogger(__name__)
+
+FXP_PROBE_TTL = 3600  # seconds a probe result is trusted
+FXP_TRANSFER_TIMEOUT = 6 * 3600  # longest wait for the end-of-transfer replies
+
+_probe_cache = {}  # (source pool key, target pool key) -> (supported, checked at)
+_probe_lock = threading.Lock()
+
+
+def can_fxp(source, target):
+    """Whether FXP is worth probing for these two clients"""
+    return source.protocol == 'ftp' and target.protocol == 'ftp'
+
+
+def make_fxp_task(source_path, target_path, name, size=None, require_content=False):
+    """Describe one file to copy directly from the source server to the target server"""
+    return {
+        'source_path': source_path,
+        'target_path': target_path,
+        'name': name,
+        'size': size,
+        'require_content': require_content
+    }
+
+
+def _port_argument(host, port):
+    return ','.join(host.split('.') + [str(port >> 8), str(port & 0xff)])
+
+
+def _set_fxp_result(key, supported):
+    with _probe_lock:
+        _probe_cache[key] = (supported, time.monotonic())
+
+
+def probe_fxp(source, target):
+    """Whether the target accepts a PORT to the source's passive address (cached per site pair)"""
+    key = (source.pool_key, target.pool_key)
+    with _probe_lock:
+        cached = _probe_cache.get(key)
+    if cached and time.monotonic() - cached[1] < FXP_PROBE_TTL:
+        return cached[0]
+    if source.pool_key == target.pool_key and source.session_limit() < 2:
+        # The target session would wait for the source session's slot
+        return False
+
+    supported = False
+    with source.batch(), target.batch():
+        sent = False
+        try:
+            if source.connect() and target.connect() and source.connection.af == socket.AF_INET:
+                sent = True
+                host, port = source.connection.makepasv()
+                target.connection.sendcmd(f'PORT {_port_argument(host, port)}')
+                supported = True
+        except ftplib.error_perm as e:
+            logger.info(f"FXP from {source.host} to {target.host} not allowed: {str(e)}")
+        except Exception as e:
+            logger.debug(f"FXP probe from {source.host} to {target.host} failed: {str(e)}")
+        finally:
+            if sent:
+                # The source is left listening for a data connection and the target
+                # has a PORT set, so neither session goes back to the pool
+                source.disconnect(discard=True)
+                target.disconnect(discard=True)
+
+    _set_fxp_result(key, supported)
+    return supported
+
+
+class StoreFailed(Exception):
+    """An FXP copy failed after the target accepted STOR, so it may have left a partial file"""
+
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
+
+
+def fxp_file(source, target, source_path, target_path):
+    """Copy one file server to server on the leased sessions; returns the bytes on the target
+
+    A failure once the target has accepted STOR is raised as StoreFailed;
+    anything earlier left the target path as it was.
+    """
+    source_ftp = source.connection
+    target_ftp = target.connection
+    source_ftp.voidcmd('TYPE I')
+    target_ftp.voidcmd('TYPE I')
+
+    host, port = source_ftp.makepasv()
+    target_ftp.sendcmd(f'PORT {_port_argument(host, port)}')
+
+    # Some servers only answer RETR in passive mode once the data connection
+    # is open, so both commands go out before either reply is read
+    source_ftp.putcmd(f'RETR {source_path}')
+    target_ftp.putcmd(f'STOR {target_path}')
+    stored = False
+    try:
+        source_ftp.sock.settimeout(FXP_TRANSFER_TIMEOUT)
+        target_ftp.sock.settimeout(FXP_TRANSFER_TIMEOUT)
+        source_ftp.getresp()
+        target_ftp.getresp()
+        stored = True
+        source_ftp.voidresp()
+        target_ftp.voidresp()
+    except Exception as e:
+        if stored:
+            raise StoreFailed(e) from e
+        raise
+    finally:
+        for ftp in (source_ftp, target_ftp):
+            if ftp.sock:
+                ftp.sock.settimeout(ftp.timeout)
+        target._invalidate_listing(target_path)
+
+    return target._remote_size(target_path)
+
+
+def _is_data_connection_error(error):
+    """425/426 or a timeout: the servers could not reach each other"""
+    if isinstance(error, StoreFailed):
+        error = error.error
+    return isinstance(error, (socket.timeout, TimeoutError)) or str(error)[:3] in ('425', '426')
+
+
+def _compare_server_checksums(source, target, task):
+    """(checksum, verified) of a copy from both servers' own hashes; no data passes through us to hash
+
+    A mismatch raises, so the copy is removed and reported as failed.
+    """
+    target_algorithms = target._server_hash_algorithms()
+    source_algorithms = source._server_hash_algorithms()
+    for algorithm in dict.fromkeys([target.checksum_algorithm, *target_algorithms]):
+        if algorithm not in target_algorithms or algorithm not in source_algorithms:
+            continue
+        source_digest = source._server_checksum(task['source_path'], algorithm)
+        target_digest = target._server_checksum(task['target_path'], algorithm) if source_digest else None
+        if source_digest and target_digest:
+            if source_digest != target_digest:
+                raise IOError(f"Checksum mismatch: {algorithm} {target_digest} on the target, {source_digest} on the source")
+            return format_checksum(algorithm, target_digest), True
+    return None, False
+
+
+def _fxp_task(source, target, task):
+    """Copy one task, removing what a failed transfer wrote to the target
+
+    A target file is only removed once this task wrote to it; a failure
+    before STOR was accepted leaves an existing file alone.
+    """
+    stored = False
+    try:
+        if not (source.connect() and target.connect()):
+            raise ConnectionError('Connection failed')
+        transferred = fxp_file(source, target, task['source_path'], task['target_path'])
+        stored = True
+        # A listing without sizes reports 0, so only a positive size is checked
+        if task['size'] and transferred != task['size']:
+            raise IOError(f"Size mismatch: target has {transferred} of {task['size']} bytes")
+        if task['require_content'] and transferred == 0:
+            target.connection.delete(task['target_path'])
+            target._invalidate_listing(task['target_path'])
+            return {'success': False, 'error': 'empty file (0 bytes)'}
+        checksum, verified = _compare_server_checksums(source, target, task) if target.verify_uploads else (None, False)
+        return {'success': True, 'bytes_transferred': transferred, 'checksum': checksum, 'verified': verified}
+    except Exception as e:
+        # Either side may still be waiting for the other; fresh sessions are simpler than ABOR
+        source.disconnect(discard=True)
+        target.disconnect(discard=True)
+        if not (stored or isinstance(e, StoreFailed)):
+            return {'success': False, 'error': str(e), 'data_connection': _is_data_connection_error(e)}
+        try:
+            if target.connect():
+                target.connection.delete(task['target_path'])
+                target._invalidate_listing(task['target_path'])
+        except Exception:
+            pass
+        return {'success': False, 'error': str(e), 'data_connection': _is_data_connection_error(e)}
+
+
+def fxp_parallel(source, target, tasks, max_workers=1):
+    """Copy tasks server to server over up to max_workers pairs of control sessions
+
+    Returns None when the very first transfers fail because the servers cannot
+    open a data connection to each other, or when both clients are on a site
+    that allows only one session, so the caller can fall back to moving the
+    data itself; otherwise the files_processed / bytes_transferred / log result
+    of relay_parallel().
+    """
+    results = [None] * len(tasks)
+    workers = max(1, min(int(max_workers or 1), len(tasks)))
+    if source.pool_key == target.pool_key:
+        # Every pair holds two sessions from the same site's connection limit
+        if source.session_limit() < 2:
+            return None
+        workers = min(workers, source.session_limit() // 2)
+    state = {'succeeded': False, 'blocked': False}
+
+    if tasks:
+        pending = queue.Queue()
+        for index in range(len(tasks)):
+            pending.put(index)
+
+        def run_pair(pair):
+            pair_source, pair_target = pair
+            with pair_source.batch(), pair_target.batch():
+                if not (pair_source.connect() and pair_target.connect()):
+                    return
+                while not state['blocked']:
+                    try:
+                        index = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    result = _fxp_task(pair_source, pair_target, tasks[index])
+                    results[index] = result
+                    if result['success']:
+                        state['succeeded'] = True
+                    elif result.get('data_connection') and not state['succeeded']:
+                        state['blocked'] = True
+
+        pairs = [(source, target)] + [(source.clone(), target.clone()) for _ in range(workers - 1)]
+        logger.debug(f"FXP of {len(tasks)} files from {source.host} to {target.host} over {workers} connections")
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fxp') as executor:
+            list(executor.map(run_pair, pairs))
+
+    if state['blocked'] and not state['succeeded']:
+        logger.info(f"FXP from {source.host} to {target.host} cannot open data connections, falling back")
+        _set_fxp_result((source.pool_key, target.pool_key), False)
+        return None
+
+    files_processed = 0
+    bytes_transferred = 0
+    log_messages = []
+    completed = []
+
+    for task, result in zip(tasks, results):
+        if result is None:
+            result = {'success': False, 'error': 'Connection failed'}
+        if result['success']:
+            files_processed += 1
+            bytes_transferred += result['bytes_transferred']
+            completed.append(dict(task, checksum=result.get('checksum')))
+            log_messages.append(f"Uploaded: {task['name']}{' (checksum verified)' if result.get('verified') else ''}")
+        else:
+            log_messages.append(f"Failed to upload: {task['name']} - {result['error']}")
+
+    return {
+        'success': True,
+        'files_processed': files_processed,
+        'bytes_transferred': bytes_transferred,
+        'log': log_messages,
+        'connections': workers,
+        'completed': completed
+    }
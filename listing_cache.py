@@ -0,0 +1,135 @@
+"""
+Process-wide cache of remote directory listings for the file browser.
+
+Every click in the browser used to log in, list and disconnect, which is slow
+on large CDR trees and adds load to production servers. Listings are cached
+per site (the connection pool key) and path for a short TTL, the least
+recently used entries are evicted beyond max_entries, and the browser can ask
+for a fresh listing. Uploads, relays and FXP copies made by this process drop
+the listings they make stale, so the browser shows our own writes right away;
+changes made by anyone else show up once the TTL runs out.
+
+Paths are compared as absolute paths: relative ones are resolved against the
+login directory of the site's sessions (PooledSession.home), which clients
+pass along when they store or invalidate and the cache remembers per site for
+lookups made before connecting. Sites whose login directory is not known yet,
+and NFS shares, resolve against '/'.
+"""
+import logging
+import posixpath
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 60  # seconds a listing is served from the cache
+DEFAULT_MAX_ENTRIES = 512
+
+
+def _normalize(path, home=None):
+    """Cache form of a remote path: absolute, with relative paths resolved against home"""
+    path = (path or '.').replace('\\', '/')
+    if not path.startswith('/'):
+        path = posixpath.join(home or '/', path)
+    return posixpath.normpath(path)
+
+
+def _parent(path):
+    return posixpath.dirname(path) if path != '/' else None
+
+
+class ListingCache:
+    """TTL- and size-bounded LRU cache of directory listings keyed by (site key, path)"""
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (site key, path) -> (listing, stored at, listed path), oldest first
+        self._sites = {}  # site key -> set of its cache keys, so writes only look at that site
+        self._homes = {}  # site key -> login directory of its sessions
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, site_key, path):
+        """The cached listing of path, or None if there is none or it expired"""
+        with self._lock:
+            key = (site_key, _normalize(path, self._homes.get(site_key)))
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] >= self.ttl:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, site_key, path, listing, listed_path=None, home=None):
+        """Cache listing for path; listed_path is the directory it shows, home the session's login directory"""
+        with self._lock:
+            if home:
+                self._homes[site_key] = home
+            home = self._homes.get(site_key)
+            key = (site_key, _normalize(path, home))
+            self._entries[key] = (listing, time.monotonic(), _normalize(listed_path or path, home))
+            self._entries.move_to_end(key)
+            self._sites.setdefault(site_key, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, site_key, remote_path, home=None):
+        """Drop the listings a write to remote_path changes: its directory and anything below it"""
+        with self._lock:
+            if home:
+                self._homes[site_key] = home
+            path = _normalize(remote_path, self._homes.get(site_key))
+            parent = _parent(path)
+            prefix = path.rstrip('/') + '/'
+            keys = self._sites.get(site_key)
+            if not keys:
+                return
+            stale = [key for key in keys
+                     if self._entries[key][2] in (path, parent) or self._entries[key][2].startswith(prefix)]
+            for key in stale:
+                self._remove(key)
+        if stale:
+            logger.debug(f"Dropped {len(stale)} cached listings after a write to {remote_path}")
+
+    def invalidate_site(self, site_key):
+        """Drop every cached listing of one site"""
+        with self._lock:
+            for key in list(self._sites.get(site_key, ())):
+                self._remove(key)
+            self._homes.pop(site_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sites.clear()
+            self._homes.clear()
+
+    def _remove(self, key):
+        """Remove one entry (caller holds the lock)"""
+        self._entries.pop(key, None)
+        keys = self._sites.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._sites[key[0]]
+
+    def stats(self):
+        """Snapshot of cache usage"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+# Shared by the browser and every client in the process
+listing_cache = ListingCache()
@@ -0,0 +1,152 @@
+"""
+How downloads are written to local disks and network drives.
+
+A download never writes to its final path. It goes to '<name>.part' in the
+target directory (see resumable.py) and is renamed into place once complete,
+so readers such as local folder upload jobs never see half a file. The part
+is a named file rather than an O_TMPFILE: it has to outlive a failed run to
+be resumed, and O_TMPFILE is not supported on NFS or CIFS drives, where a
+rename within the directory is still atomic.
+
+When the final size is known, the part's space is reserved up front with
+fallocate(FALLOC_FL_KEEP_SIZE). Large files are then laid out in one piece
+instead of growing block by block, and a full disk fails the download at the
+start rather than halfway. KEEP_SIZE leaves the file's size at what was
+written, which is what a resumed download continues from (posix_fallocate
+would extend it). Where the call is not available - not Linux, or a
+filesystem without fallocate - the file simply grows as it is written.
+
+The fsync policy (a global setting) decides when data is forced to disk:
+
+- 'file': each file is synced before its rename and its directory after it,
+  so a file that is in place survives a crash
+- 'batch': files are renamed straight away and synced, with their
+  directories, once the batch of downloads they belong to has finished (a
+  single download outside a batch right after its rename)
+- 'none': left to the operating system's writeback
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = [('file', 'Every file (safest)'), ('batch', 'Once per batch of downloads'),
+                  ('none', 'Never (fastest, left to the operating system)')]
+DEFAULT_FSYNC_POLICY = 'batch'
+
+FALLOC_FL_KEEP_SIZE = 0x01
+
+
+def _load_fallocate():
+    """libc's fallocate(fd, mode, offset, len), None where there is none"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError:
+        return None
+    function = getattr(libc, 'fallocate64', None) or getattr(libc, 'fallocate', None)
+    if function is not None:
+        function.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+        function.restype = ctypes.c_int
+    return function
+
+
+_fallocate = _load_fallocate()
+
+
+def normalize_fsync_policy(value):
+    """One of the FSYNC_POLICIES keys; the default for an empty or unknown value"""
+    value = (value or '').strip().lower()
+    return value if value in dict(FSYNC_POLICIES) else DEFAULT_FSYNC_POLICY
+
+
+def reserve_space(local_file, size):
+    """Reserve size bytes on disk for local_file without changing its size; False if that is not possible"""
+    if not size or _fallocate is None:
+        return False
+    if _fallocate(local_file.fileno(), FALLOC_FL_KEEP_SIZE, 0, size) == 0:
+        return True
+    # EOPNOTSUPP on filesystems without fallocate, ENOSPC is left for the writes to report
+    logger.debug(f"Cannot reserve {size} bytes for {local_file.name}: {os.strerror(ctypes.get_errno())}")
+    return False
+
+
+def open_part(path, offset=0, size=None):
+    """Open a part file for writing, appending after offset bytes, with size bytes reserved if known"""
+    local_file = open(path, 'ab' if offset else 'wb')
+    if size and size > offset:
+        reserve_space(local_file, size)
+    return local_file
+
+
+def _fsync_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_directory(path):
+    """Sync a directory, so renames in it are on disk; not every filesystem allows it"""
+    try:
+        fd = os.open(path or '.', os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+    except OSError as e:
+        logger.debug(f"Cannot open directory {path} to sync it: {str(e)}")
+        return
+    try:
+        os.fsync(fd)
+    except OSError as e:
+        # CIFS and some FUSE filesystems refuse fsync on directories
+        logger.debug(f"Cannot sync directory {path}: {str(e)}")
+    finally:
+        os.close(fd)
+
+
+class LocalWrites:
+    """A client's fsync policy, with the files a 'batch' policy still has to sync
+
+    Clones of a client share it, so flush() after a parallel download syncs
+    what all of its workers wrote.
+    """
+
+    def __init__(self, fsync_policy=DEFAULT_FSYNC_POLICY):
+        self.fsync_policy = normalize_fsync_policy(fsync_policy)
+        self._lock = threading.Lock()
+        self._pending = []  # paths renamed into place but not synced yet ('batch')
+
+    def commit(self, temp_path, final_path):
+        """Move a finished temp file into place, syncing it as the policy says"""
+        if self.fsync_policy == 'file':
+            _fsync_file(temp_path)
+        os.replace(temp_path, final_path)
+        if self.fsync_policy == 'file':
+            _fsync_directory(os.path.dirname(final_path))
+        elif self.fsync_policy == 'batch':
+            with self._lock:
+                self._pending.append(final_path)
+
+    def flush(self):
+        """Sync the files committed since the last flush and their directories; returns how many were synced"""
+        with self._lock:
+            paths, self._pending = self._pending, []
+        synced = 0
+        directories = set()
+        for path in paths:
+            try:
+                _fsync_file(path)
+            except FileNotFoundError:
+                # Removed again since, e.g. an empty file a job does not keep
+                continue
+            except OSError as e:
+                logger.error(f"Cannot sync {path} to disk: {str(e)}")
+                continue
+            synced += 1
+            directories.add(os.path.dirname(path))
+        for directory in directories:
+            _fsync_directory(directory)
+        if synced:
+            logger.debug(f"Synced {synced} downloaded files in {len(directories)} directories")
+        return synced
@@ -22,6 +22,24 @@ class Site(db.Model):
     nfs_mount_options = db.Column(db.String(200), nullable=True)  # Custom mount options
     nfs_auth_method = db.Column(db.String(20), nullable=True, default='sys')  # sys, krb5, krb5i, krb5p
     
+    # Transfer settings
+    max_connections = db.Column(db.Integer, default=4)  # parallel sessions used by download jobs
+    block_size = db.Column(db.Integer, default=32768)  # bytes per FTP data read/write and SFTP request
+    prefetch_window = db.Column(db.Integer, default=64)  # SFTP read requests kept in flight
+    socket_buffer = db.Column(db.Integer, nullable=True)  # SO_RCVBUF/SO_SNDBUF bytes for FTP data and SFTP sockets; None = kernel default
+    segment_threshold_mb = db.Column(db.Integer, default=100)  # files this large download in parallel ranges, 0 = off
+    checksum_algorithm = db.Column(db.String(10), default='sha256')  # 'sha256', 'md5', 'xxh64' or 'none', computed during transfers
+    verify_uploads = db.Column(db.Boolean, default=False)  # compare uploads with a hash computed by the server
+    compression = db.Column(db.String(10), default='auto')  # 'auto', 'on' or 'off': FTP MODE Z / SSH compression
+    compression_enabled = db.Column(db.Boolean, nullable=True)  # outcome of the last compression probe
+    compression_probe = db.Column(db.String(255), nullable=True)  # what the last probe measured
+    compression_probed_at = db.Column(db.DateTime, nullable=True)  # None = 'auto' probes when the next transfer starts
+    auto_tune = db.Column(db.Boolean, default=False)  # measure and save the fastest block_size / prefetch_window
+    tuning_summary = db.Column(db.String(255), nullable=True)  # what the last tuning measured
+    tuned_at = db.Column(db.DateTime, nullable=True)  # None with auto_tune = tune before the next transfer
+    bandwidth_limit_mbps = db.Column(db.Float, nullable=True)  # cap on this site's transfers in Mbit/s, empty = unlimited
+    bandwidth_schedule = db.Column(Text, nullable=True)  # 'HH:MM-HH:MM <Mbit/s|unlimited>' lines overriding the cap
+    
 
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -63,6 +81,14 @@ class Job(db.Model):
     # Upload job options for automatic monthly folder uploads
     use_local_folders = db.Column(db.Boolean, default=False)  # Upload from existing local folders instead of downloading first
     upload_date_folder_format = db.Column(db.String(20), default='YYYY-MM')  # Date format for monthly upload folders
+    upload_transfer_mode = db.Column(db.String(20), default='relay')  # 'relay' streams source to target, 'staging' downloads to a temp folder first
+    
+    # Incremental sync: skip files whose size and modification time match the last transfer
+    incremental_sync = db.Column(db.Boolean, default=False)
+    
+    # Bandwidth cap on this job's transfers in Mbit/s (empty = unlimited) with optional time-of-day windows
+    bandwidth_limit_mbps = db.Column(db.Float, nullable=True)
+    bandwidth_schedule = db.Column(Text, nullable=True)
     
     # Job grouping for organized execution
     job_group_id = db.Column(db.Integer, db.ForeignKey('job_groups.id'), nullable=True)  # Optional group assignment
@@ -78,6 +104,7 @@ class Job(db.Model):
     target_site = db.relationship('Site', foreign_keys=[target_site_id], backref='upload_jobs')
     job_group = db.relationship('JobGroup', backref='jobs', lazy=True)
     logs = db.relationship('JobLog', backref='job', lazy=True, cascade='all, delete-orphan')
+    sync_manifest_entries = db.relationship('SyncManifestEntry', backref='job', lazy=True, cascade='all, delete-orphan')
 
 class JobGroup(db.Model):
     __tablename__ = 'job_groups'
@@ -121,6 +148,19 @@ class JobLog(db.Model):
     bytes_transferred = db.Column(db.BigInteger, default=0)
     error_message = db.Column(Text, nullable=True)
     log_content = db.Column(Text, nullable=True)
+    checksums = db.Column(Text, nullable=True)  # '<algorithm>:<digest>  <file>' per transferred file
+
+class SyncManifestEntry(db.Model):
+    __tablename__ = 'sync_manifest_entries'
+    __table_args__ = (db.UniqueConstraint('job_id', 'path', name='uq_sync_manifest_job_path'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'), nullable=False, index=True)
+    path = db.Column(db.String(1000), nullable=False)  # Source path: remote for downloads and relays, local for local folder uploads
+    size = db.Column(db.BigInteger, nullable=True)
+    modify = db.Column(db.String(40), nullable=True)  # Modification time as the listing reports it
+    checksum = db.Column(db.String(128), nullable=True)
+    transferred_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Settings(db.Model):
     __tablename__ = 'settings'
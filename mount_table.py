@@ -0,0 +1,178 @@
+"""
+In-memory view of the mount table.
+
+Checking whether a network drive is mounted used to start a `mountpoint -q`
+subprocess, and the file browser does that for every drive on every page
+load. The table here is parsed from /proc/self/mountinfo and only parsed
+again when the kernel reports a change: the file is kept open, and the
+kernel marks the descriptor with POLLPRI whenever anything is mounted or
+unmounted, so a lookup costs one poll() without a timeout. Where that is
+not available (no procfs, no poll) the table is re-read when it is older
+than REFRESH_INTERVAL, and without procfs at all lookups fall back to
+os.path.ismount().
+
+Entries are keyed by mount point and carry the kernel's mount id, which
+changes on every mount. The results of write-permission probes
+(probe_write) are cached per mount point for WRITE_PROBE_TTL seconds and
+against that id, so a remount - e.g. with other uid/gid options - is
+always probed afresh.
+"""
+import logging
+import os
+import threading
+import time
+
+try:
+    import select
+except ImportError:
+    select = None
+
+logger = logging.getLogger(__name__)
+
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+REFRESH_INTERVAL = 2.0  # seconds between re-reads when changes cannot be polled
+WRITE_PROBE_TTL = 300  # seconds a write-permission probe result is reused
+
+
+def _unescape(field):
+    """Mount points in mountinfo have space, tab, newline and backslash as octal escapes"""
+    if '\\' not in field:
+        return field
+    return field.encode().decode('unicode_escape').encode('latin-1').decode('utf-8', 'replace')
+
+
+def parse_mountinfo(text):
+    """{mount point: {'mount_id', 'fstype', 'source', 'options'}} from the text of a mountinfo file
+
+    Each line is 'id parent major:minor root mount_point options [optional
+    fields...] - fstype source super_options'; the last mount on a point wins.
+    """
+    mounts = {}
+    for line in text.splitlines():
+        fields = line.split()
+        try:
+            separator = fields.index('-', 6)
+        except ValueError:
+            continue
+        tail = fields[separator + 1:]
+        mount_point = _unescape(fields[4])
+        mounts[mount_point] = {
+            'mount_id': int(fields[0]),
+            'fstype': tail[0] if tail else '',
+            'source': _unescape(tail[1]) if len(tail) > 1 else '',
+            # Per-mount options, then the filesystem's own (rw appears in both)
+            'options': ','.join(dict.fromkeys(fields[5].split(',') + (tail[2].split(',') if len(tail) > 2 else [])))
+        }
+    return mounts
+
+
+def _normalize(path):
+    # Not realpath: it would stat every component, which hangs on a dead NFS server
+    return os.path.normpath(os.path.abspath(path)) if path else path
+
+
+class MountTable:
+    """The parsed mount table, refreshed when the kernel reports a change"""
+
+    def __init__(self, path=MOUNTINFO_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+        self._poller = None
+        self._mounts = None  # None until read; stays None without procfs
+        self._read_at = 0.0
+        self._write_probes = {}  # mount point -> (mount id, monotonic time, result)
+
+    def _open(self):
+        """Open the mountinfo file for polling (again after a fork, which shares the descriptor's state)"""
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd, self._poller, self._pid = None, None, os.getpid()
+        try:
+            self._fd = os.open(self.path, os.O_RDONLY)
+        except OSError as e:
+            logger.debug(f"Cannot open {self.path}, checking mount points with os.path.ismount: {str(e)}")
+            return
+        if select is not None and hasattr(select, 'poll'):
+            self._poller = select.poll()
+            self._poller.register(self._fd, select.POLLPRI | select.POLLERR)
+
+    def _changed(self):
+        if self._mounts is None or self._pid != os.getpid():
+            return True
+        if self._poller is not None:
+            # The kernel flags the descriptor once per change; poll() consumes the flag
+            return bool(self._poller.poll(0))
+        return time.monotonic() - self._read_at >= REFRESH_INTERVAL
+
+    def _read(self):
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        chunks = []
+        while True:
+            chunk = os.read(self._fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks).decode('utf-8', 'replace')
+
+    def _current(self):
+        """The mount table, re-read if it changed; None without procfs"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            if self._fd is None:
+                return None
+            if self._changed():
+                try:
+                    self._mounts = parse_mountinfo(self._read())
+                    self._read_at = time.monotonic()
+                except OSError as e:
+                    logger.warning(f"Cannot read {self.path}: {str(e)}")
+                    self._open()
+                    return self._mounts
+            return self._mounts
+
+    def invalidate(self):
+        """Re-read the table on the next lookup, e.g. right after a mount where changes are not polled"""
+        with self._lock:
+            self._read_at = 0.0
+            if self._poller is None:
+                self._mounts = None
+
+    def get(self, mount_point):
+        """The table entry for mount_point, None if nothing is mounted there"""
+        mounts = self._current()
+        if mounts is None:
+            return {'mount_id': None, 'fstype': '', 'source': '', 'options': ''} \
+                if mount_point and os.path.ismount(mount_point) else None
+        return mounts.get(_normalize(mount_point))
+
+    def is_mounted(self, mount_point):
+        return self.get(mount_point) is not None
+
+    def mounts(self):
+        """Snapshot of the whole table"""
+        return dict(self._current() or {})
+
+    def probe_write(self, mount_point, probe, ttl=WRITE_PROBE_TTL):
+        """probe()'s result for the current mount of mount_point, reused for ttl seconds
+
+        A remount (new mount id) or an unmount discards the cached result.
+        """
+        entry = self.get(mount_point)
+        mount_id = entry['mount_id'] if entry else None
+        key = _normalize(mount_point)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._write_probes.get(key)
+        if cached and cached[0] == mount_id and now - cached[1] < ttl:
+            return cached[2]
+        result = probe()
+        with self._lock:
+            self._write_probes[key] = (mount_id, now, result)
+        return result
+
+
+# Shared by every caller in the process
+mount_table = MountTable()
@@ -11,6 +11,8 @@ from datetime import datetime
 from models import NetworkDrive, db
 from crypto_utils import encrypt_password, decrypt_password
 from utils import log_system_message
+from capabilities import capabilities
+from mount_table import mount_table
 
 class NetworkDriveManager:
     """Manager for network drive operations on Ubuntu"""
@@ -123,6 +125,7 @@ class NetworkDriveManager:
             ], capture_output=True, text=True)
             
             if result.returncode == 0:
+                mount_table.invalidate()
                 drive.is_mounted = False
                 drive.last_mount_check = datetime.utcnow()
                 db.session.commit()
@@ -142,8 +145,7 @@ class NetworkDriveManager:
             log_system_message('info', f"Starting CIFS mount for drive {drive.name} to {drive.mount_point}", 'network_drives')
             
             # Check if mount.cifs is available
-            cifs_check = subprocess.run(['which', 'mount.cifs'], capture_output=True, text=True)
-            if cifs_check.returncode != 0:
+            if not capabilities.has_helper('mount.cifs'):
                 raise Exception("mount.cifs utility not found. Install cifs-utils package: sudo apt install cifs-utils")
             
             # Prepare credentials
@@ -194,6 +196,7 @@ class NetworkDriveManager:
                 creds_file = None
             
             if result.returncode == 0:
+                mount_table.invalidate()
                 drive.is_mounted = True
                 drive.last_mount_check = datetime.utcnow()
                 db.session.commit()
@@ -215,11 +218,8 @@ class NetworkDriveManager:
             log_system_message('info', f"Starting NFS mount for drive {drive.name} to {drive.mount_point}", 'network_drives')
             
             # Check if NFS utilities are available
-            nfs_check = subprocess.run(['which', 'mount.nfs'], capture_output=True, text=True)
-            if nfs_check.returncode != 0:
-                nfs_check = subprocess.run(['which', 'mount.nfs4'], capture_output=True, text=True)
-                if nfs_check.returncode != 0:
-                    raise Exception("NFS mount utilities not found. Install nfs-common package: sudo apt install nfs-common")
+            if not capabilities.has_helper('mount.nfs') and not capabilities.has_helper('mount.nfs4'):
+                raise Exception("NFS mount utilities not found. Install nfs-common package: sudo apt install nfs-common")
             
             # Mount command with proper permissions for current user
             current_user = pwd.getpwuid(os.getuid())
@@ -249,6 +249,7 @@ class NetworkDriveManager:
             result = subprocess.run(cmd, capture_output=True, text=True)
             
             if result.returncode == 0:
+                mount_table.invalidate()
                 drive.is_mounted = True
                 drive.last_mount_check = datetime.utcnow()
                 db.session.commit()
@@ -262,10 +263,9 @@ class NetworkDriveManager:
             raise e
     
     def is_mounted(self, mount_point):
-        """Check if a mount point is currently mounted"""
+        """Check if a mount point is currently mounted (from the cached mount table)"""
         try:
-            result = subprocess.run(['mountpoint', '-q', mount_point], capture_output=True)
-            return result.returncode == 0
+            return mount_table.is_mounted(mount_point)
         except Exception:
             return False
     
@@ -276,7 +276,8 @@ class NetworkDriveManager:
             if not drive:
                 return {'error': 'Drive not found'}
             
-            is_mounted = self.is_mounted(drive.mount_point)
+            entry = mount_table.get(drive.mount_point)
+            is_mounted = entry is not None
             
             # Update database status
             if drive.is_mounted != is_mounted:
@@ -289,6 +290,7 @@ class NetworkDriveManager:
                 'mount_point': drive.mount_point,
                 'server_path': drive.server_path,
                 'drive_type': drive.drive_type,
+                'filesystem': entry['fstype'] if entry else None,
                 'last_check': drive.last_mount_check
             }
             
@@ -388,8 +390,7 @@ class NetworkDriveManager:
         """Test CIFS connection"""
         try:
             # Check if mount.cifs is available
-            cifs_check = subprocess.run(['which', 'mount.cifs'], capture_output=True, text=True)
-            if cifs_check.returncode != 0:
+            if not capabilities.has_helper('mount.cifs'):
                 return {'success': False, 'message': 'mount.cifs utility not found. Install with: sudo apt install cifs-utils'}
             
             # Validate server path format
@@ -431,8 +432,7 @@ class NetworkDriveManager:
         """Test NFS connection"""
         try:
             # Check if NFS utilities are available
-            nfs_check = subprocess.run(['which', 'showmount'], capture_output=True, text=True)
-            if nfs_check.returncode != 0:
+            if not capabilities.has_helper('showmount'):
                 return {'success': False, 'message': 'NFS utilities not found. Install with: sudo apt install nfs-common'}
             
             # Validate server path format
@@ -502,26 +502,17 @@ class NetworkDriveManager:
     def _check_mount_capabilities(self):
         """Check if network mounting is available in this environment"""
         try:
-            # Check for required utilities
+            # Required utilities, sudo and container detection are probed once (see capabilities.py)
             required_utils = []
-            if not os.path.exists('/usr/bin/mount.cifs') and not os.path.exists('/sbin/mount.cifs'):
+            if not capabilities.has_helper('mount.cifs'):
                 required_utils.append('cifs-utils')
-            if not os.path.exists('/usr/bin/mount.nfs') and not os.path.exists('/sbin/mount.nfs'):
+            if not capabilities.has_helper('mount.nfs'):
                 required_utils.append('nfs-common')
-            
-            # Check if we can use sudo for mounting
-            try:
-                result = subprocess.run(['sudo', '-n', 'mount', '--help'], 
-                                      capture_output=True, text=True, timeout=5)
-                has_sudo = result.returncode == 0
-            except:
-                has_sudo = False
-            
-            # Check if we're in a container environment
-            in_container = os.path.exists('/.dockerenv') or os.path.exists('/run/.containerenv')
+            has_sudo = capabilities.sudo
+            in_container = capabilities.container
             
             if required_utils or not has_sudo or in_container:
-                log_system_message('info', f"Limited environment detected: Missing utilities: {required_utils}, Sudo access: {has_sudo}, Container: {in_container}", 'network_drives')
+                self.logger.debug(f"Limited environment detected: Missing utilities: {required_utils}, Sudo access: {has_sudo}, Container: {in_container}")
                 return False
             
             return True
@@ -627,18 +618,25 @@ Current environment limitations prevent actual network mounting.
             except Exception as e:
                 return {'success': False, 'error': f'Cannot read from {drive.mount_point}: {str(e)}'}
             
-            # Test write permissions by creating a test file
-            test_file = os.path.join(drive.mount_point, '.write_test')
-            try:
-                with open(test_file, 'w') as f:
-                    f.write('test')
-                os.remove(test_file)
-            except PermissionError:
-                return {'success': False, 'error': f'No write permission for {drive.mount_point}. Check mount options (uid/gid settings)'}
-            except Exception as e:
-                return {'success': False, 'error': f'Cannot write to {drive.mount_point}: {str(e)}'}
+            # Test write permissions by creating a test file (reused for a while per mount)
+            write_error = mount_table.probe_write(drive.mount_point, lambda: self._probe_write(drive.mount_point))
+            if write_error:
+                return {'success': False, 'error': write_error}
             
             return {'success': True, 'message': f'Drive {drive.name} has proper read/write permissions'}
             
         except Exception as e:
-            return {'success': False, 'error': f'Permission check failed: {str(e)}'}
\ No newline at end of file
+            return {'success': False, 'error': f'Permission check failed: {str(e)}'}
+    
+    def _probe_write(self, mount_point):
+        """Create and remove a test file; None if that works, else the error"""
+        test_file = os.path.join(mount_point, '.write_test')
+        try:
+            with open(test_file, 'w') as f:
+                f.write('test')
+            os.remove(test_file)
+            return None
+        except PermissionError:
+            return f'No write permission for {mount_point}. Check mount options (uid/gid settings)'
+        except Exception as e:
+            return f'Cannot write to {mount_point}: {str(e)}'
@@ -2,11 +2,47 @@ import os
 import logging
 import subprocess
 import tempfile
-import shutil
+from collections import deque
 from datetime import datetime
+from capabilities import capabilities
+from mount_table import mount_table
+from file_copy import copy_file
+from resumable import part_path
+from tree_scanner import ScannedDirectory
 
 logger = logging.getLogger(__name__)
 
+def _scan_directory(full_path):
+    """(list_files() records, subdirectory names) of a directory under the mount
+    
+    One scandir() reads the names and types; each entry is stat()ed once for
+    its size and time, which NFS usually answers from the attributes that
+    came with the directory listing (READDIRPLUS). Entries that are neither
+    files nor directories, and links that lead nowhere, are left out.
+    """
+    records = []
+    folders = []
+    with os.scandir(full_path) as entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+                if not is_dir and not entry.is_file():
+                    continue
+                stat_info = entry.stat()
+            except OSError as e:
+                logger.debug(f"Skipping {entry.path}: {str(e)}")
+                continue
+            records.append({
+                'name': entry.name,
+                'size': 0 if is_dir else stat_info.st_size,
+                'modify': datetime.fromtimestamp(stat_info.st_mtime).isoformat(),
+                'type': 'directory' if is_dir else 'file'
+            })
+            if is_dir:
+                folders.append(entry.name)
+    return records, folders
+
+
 class NFSClient:
     """NFS client for network file system operations"""
     
@@ -17,6 +53,7 @@ class NFSClient:
         self.mount_options = mount_options
         self.auth_method = auth_method
         self.mount_point = None
+        self.alternative_access = False  # mount_point is a local directory, nothing is mounted there
     
     def mount(self):
         """Mount NFS share"""
@@ -28,6 +65,7 @@ class NFSClient:
             
             # Create temporary mount point
             self.mount_point = tempfile.mkdtemp(prefix='nfs_mount_')
+            self.alternative_access = False
             
             # Build NFS mount command
             nfs_server = f"{self.host}:{self.export_path}"
@@ -39,13 +77,14 @@ class NFSClient:
             cmd.extend([nfs_server, self.mount_point])
             
             # Test NFS server accessibility first
-            try:
-                result = subprocess.run(['showmount', '-e', self.host], 
-                                      capture_output=True, text=True, timeout=15)
-                if result.returncode != 0:
-                    logger.warning(f"NFS server {self.host} may not be accessible: {result.stderr}")
-            except Exception as e:
-                logger.warning(f"Cannot test NFS server accessibility: {str(e)}")
+            if capabilities.has_helper('showmount'):
+                try:
+                    result = subprocess.run(['showmount', '-e', self.host], 
+                                          capture_output=True, text=True, timeout=15)
+                    if result.returncode != 0:
+                        logger.warning(f"NFS server {self.host} may not be accessible: {result.stderr}")
+                except Exception as e:
+                    logger.warning(f"Cannot test NFS server accessibility: {str(e)}")
             
             # Execute mount command
             logger.info(f"Executing NFS mount command: {' '.join(cmd)}")
@@ -54,6 +93,7 @@ class NFSClient:
             if result.returncode == 0:
                 logger.info(f"NFS mounted successfully at {self.mount_point}")
                 # Verify mount is actually working
+                mount_table.invalidate()
                 if self._verify_mount():
                     return True
                 else:
@@ -79,6 +119,11 @@ class NFSClient:
         if not self.mount_point or not os.path.exists(self.mount_point):
             return
         
+        if not capabilities.sudo:
+            # Nothing was mounted with sudo, e.g. the alternative access directory
+            self._cleanup_mount_point()
+            return
+        
         try:
             # Unmount the NFS share
             cmd = ['sudo', 'umount', self.mount_point]
@@ -137,40 +182,57 @@ class NFSClient:
         
         return ','.join(options)
     
+    def _mount_path(self, remote_path):
+        """Path of remote_path under the mount point"""
+        remote_path = remote_path.lstrip('/')
+        return os.path.join(self.mount_point, remote_path) if remote_path not in ('', '.') else self.mount_point
+    
     def list_files(self, remote_path='.'):
         """List files in NFS mount using filesystem operations"""
         try:
             if not self.mount_point:
                 return {'success': False, 'error': 'NFS not mounted'}
             
-            # Convert remote path to local mount path
-            if remote_path.startswith('/'):
-                remote_path = remote_path[1:]  # Remove leading slash
-            
-            full_path = os.path.join(self.mount_point, remote_path) if remote_path != '.' else self.mount_point
-            
+            full_path = self._mount_path(remote_path)
             if not os.path.exists(full_path):
-                return {'success': False, 'error': f'Path does not exist: {remote_path}'}
-            
-            files = []
-            for item in os.listdir(full_path):
-                item_path = os.path.join(full_path, item)
-                stat_info = os.stat(item_path)
-                
-                files.append({
-                    'name': item,
-                    'size': stat_info.st_size if os.path.isfile(item_path) else 0,
-                    'modify': datetime.fromtimestamp(stat_info.st_mtime).isoformat(),
-                    'type': 'file' if os.path.isfile(item_path) else 'directory'
-                })
+                return {'success': False, 'error': f'Path does not exist: {remote_path.lstrip("/")}'}
             
+            files, _ = _scan_directory(full_path)
             return {'success': True, 'files': files}
             
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def download_file(self, remote_path, local_path):
-        """Download file from NFS mount using filesystem copy"""
+    def walk(self, remote_path, max_depth=None):
+        """Yield a tree_scanner.ScannedDirectory for remote_path and every directory below it, breadth first
+        
+        The same output as tree_scanner.scan_tree(), from one scandir() per
+        directory instead of a list_files() call on a scan worker. max_depth
+        limits how far below remote_path the walk goes (0 lists remote_path only).
+        """
+        if not self.mount_point:
+            yield ScannedDirectory(remote_path, '', 0, [], [], 'NFS not mounted')
+            return
+        pending = deque([(remote_path, '', 0)])
+        while pending:
+            path, relative_path, depth = pending.popleft()
+            try:
+                records, folders = _scan_directory(self._mount_path(path))
+            except OSError as e:
+                yield ScannedDirectory(path, relative_path, depth, [], [], str(e))
+                continue
+            files = [record for record in records if record['type'] == 'file']
+            if max_depth is None or depth < max_depth:
+                pending.extend((f"{path.rstrip('/')}/{name}", f"{relative_path}/{name}" if relative_path else name,
+                                depth + 1) for name in folders)
+            yield ScannedDirectory(path, relative_path, depth, files, folders, None)
+    
+    def download_file(self, remote_path, local_path, hasher=None, throttle=None, local_writes=None):
+        """Download file from NFS mount using filesystem copy, hashing and throttling it on the way if given
+        
+        The copy is written to '<local_path>.part' and moved into place once
+        complete (through local_writes, a local_writes.LocalWrites, if given).
+        """
         try:
             if not self.mount_point:
                 return {'success': False, 'error': 'NFS not mounted'}
@@ -187,8 +249,18 @@ class NFSClient:
             # Ensure local directory exists
             os.makedirs(os.path.dirname(local_path), exist_ok=True)
             
-            # Copy file
-            shutil.copy2(source_path, local_path)
+            # Copy file next to its final path, so nothing sees it half written
+            temp_path = part_path(local_path)
+            try:
+                copy_file(source_path, temp_path, hasher, throttle)
+                if local_writes is not None:
+                    local_writes.commit(temp_path, local_path)
+                else:
+                    os.replace(temp_path, local_path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
             
             # Get file size for reporting
             file_size = os.path.getsize(local_path)
@@ -201,8 +273,8 @@ class NFSClient:
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def upload_file(self, local_path, remote_path):
-        """Upload file to NFS mount using filesystem copy"""
+    def upload_file(self, local_path, remote_path, hasher=None, throttle=None):
+        """Upload file to NFS mount using filesystem copy, hashing and throttling it on the way if given"""
         try:
             if not self.mount_point:
                 return {'success': False, 'error': 'NFS not mounted'}
@@ -220,7 +292,7 @@ class NFSClient:
             os.makedirs(os.path.dirname(dest_path), exist_ok=True)
             
             # Copy file
-            shutil.copy2(local_path, dest_path)
+            copy_file(local_path, dest_path, hasher, throttle)
             
             # Get file size for reporting
             file_size = os.path.getsize(local_path)
@@ -237,15 +309,16 @@ class NFSClient:
         """Test NFS connection by mounting and unmounting"""
         try:
             # First test if we can see the NFS exports
-            try:
-                result = subprocess.run(['showmount', '-e', self.host], 
-                                      capture_output=True, text=True, timeout=15)
-                if result.returncode == 0:
-                    logger.info(f"NFS exports available on {self.host}: {result.stdout}")
-                else:
-                    logger.warning(f"Cannot list NFS exports on {self.host}: {result.stderr}")
-            except Exception as e:
-                logger.warning(f"Cannot check NFS exports: {str(e)}")
+            if capabilities.has_helper('showmount'):
+                try:
+                    result = subprocess.run(['showmount', '-e', self.host], 
+                                          capture_output=True, text=True, timeout=15)
+                    if result.returncode == 0:
+                        logger.info(f"NFS exports available on {self.host}: {result.stdout}")
+                    else:
+                        logger.warning(f"Cannot list NFS exports on {self.host}: {result.stderr}")
+                except Exception as e:
+                    logger.warning(f"Cannot check NFS exports: {str(e)}")
             
             # Try to mount
             if self.mount():
@@ -257,41 +330,15 @@ class NFSClient:
             return {'success': False, 'error': str(e)}
     
     def _check_nfs_support(self):
-        """Check if NFS mounting is supported in current environment"""
-        try:
-            # Check if NFS client utilities are available
-            nfs_utils = ['mount.nfs', 'mount.nfs4', 'showmount']
-            for util in nfs_utils:
-                result = subprocess.run(['which', util], capture_output=True, text=True)
-                if result.returncode == 0:
-                    logger.debug(f"Found NFS utility: {util}")
-                else:
-                    logger.warning(f"Missing NFS utility: {util}")
-            
-            # Check if mount.nfs exists (minimum requirement)
-            result = subprocess.run(['which', 'mount.nfs'], capture_output=True, text=True)
-            if result.returncode != 0:
-                logger.error("mount.nfs not found - NFS client not installed")
-                return False
-            
-            # Test sudo access for mount operations
-            result = subprocess.run(['sudo', '-n', 'mount', '--help'], 
-                                 capture_output=True, text=True, timeout=5)
-            if result.returncode == 0:
-                logger.debug("Sudo access for mount operations confirmed")
-                return True
-            else:
-                logger.error("No sudo access for mount operations")
-                return False
-        except Exception as e:
-            logger.error(f"NFS support check failed: {str(e)}")
-            return False
+        """Check if NFS mounting is supported in current environment (probed once, see capabilities.py)"""
+        return capabilities.can_mount_nfs()
     
     def _setup_alternative_access(self):
         """Setup alternative NFS access using network file operations"""
         try:
             # Create a pseudo mount point for tracking
             self.mount_point = tempfile.mkdtemp(prefix='nfs_alt_')
+            self.alternative_access = True
             
             # In development environment, we'll simulate NFS access
             # In production, this would use proper NFS mounting
@@ -310,27 +357,29 @@ class NFSClient:
             return False
     
     def _verify_mount(self):
-        """Verify that the NFS mount is working properly"""
+        """Verify that the NFS mount is working properly
+        
+        A listable mount point is not enough: after the share went away it is
+        an empty local directory, so the share must be in the mount table.
+        Only the alternative access directory is verified by listing it.
+        """
         try:
             if not self.mount_point or not os.path.exists(self.mount_point):
                 return False
             
-            # Try to list the mount point
+            # Try to list the mount point (hangs or fails on a dead server)
             os.listdir(self.mount_point)
             
-            # Check if it's actually mounted (Linux specific)
-            try:
-                with open('/proc/mounts', 'r') as f:
-                    mounts = f.read()
-                    if self.mount_point in mounts:
-                        logger.debug(f"Mount verified in /proc/mounts: {self.mount_point}")
-                        return True
-            except:
-                pass
-            
-            # Fallback: if we can list the directory, consider it mounted
-            logger.debug(f"Mount verified by directory listing: {self.mount_point}")
-            return True
+            if self.alternative_access:
+                logger.debug(f"Alternative access verified by directory listing: {self.mount_point}")
+                return True
+            
+            if mount_table.is_mounted(self.mount_point):
+                logger.debug(f"Mount verified in the mount table: {self.mount_point}")
+                return True
+            
+            logger.error(f"NFS share is no longer mounted at {self.mount_point}")
+            return False
             
         except Exception as e:
             logger.error(f"Mount verification failed: {str(e)}")
@@ -360,17 +409,11 @@ class NFSClient:
                 
                 # Check if it appears in mount table
                 try:
-                    with open('/proc/mounts', 'r') as f:
-                        mounts = f.read()
-                        if self.mount_point in mounts:
-                            status['in_proc_mounts'] = True
-                            # Extract mount line
-                            for line in mounts.split('\n'):
-                                if self.mount_point in line:
-                                    status['mount_line'] = line.strip()
-                                    break
-                        else:
-                            status['in_proc_mounts'] = False
+                    entry = mount_table.get(self.mount_point)
+                    status['in_proc_mounts'] = entry is not None
+                    if entry is not None:
+                        # Same layout as a /proc/mounts line
+                        status['mount_line'] = f"{entry['source']} {self.mount_point} {entry['fstype']} {entry['options']}"
                 except Exception as e:
                     status['errors'].append(f"Mount check error: {str(e)}")
                     
@@ -0,0 +1,162 @@
+"""
+Process-wide manager of NFS mounts.
+
+Mounting an export means a showmount probe, `sudo mount` and a fresh mount
+point, so mounting for every listing, preview or job and unmounting right
+after cost seconds per operation. The manager keeps one mount per
+(host, export, version, options, auth method) and shares it:
+
+- acquire() returns the mounted NFSClient and counts a reference,
+  release() drops it; use() does both around a block
+- a mount nobody references is unmounted once it has been idle for
+  idle_timeout seconds (evict_idle() runs on the scheduler)
+- health is checked lazily: an unreferenced mount idle for
+  health_check_interval seconds is verified when it is next acquired, and
+  mounted again if it went away
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from nfs_client import NFSClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IDLE_TIMEOUT = 600  # seconds an unused mount is kept
+DEFAULT_HEALTH_CHECK_INTERVAL = 30  # seconds idle before an acquire re-checks the mount
+
+
+def make_mount_key(host, export_path='/', nfs_version='4', mount_options='', auth_method='sys'):
+    """Mount key for a site: the NFSClient arguments, with the defaults filled in"""
+    return (host, export_path or '/', str(nfs_version or '4'), mount_options or '', auth_method or 'sys')
+
+
+def describe_mount_key(key):
+    host, export_path, nfs_version, mount_options, auth_method = key
+    return f"{host}:{export_path} (nfs{nfs_version}, {mount_options or 'default options'}, {auth_method})"
+
+
+class NFSMount:
+    """One mounted export and how many operations are using it"""
+
+    def __init__(self, key, client):
+        self.key = key
+        self.client = client
+        self.refs = 0
+        self.mounted_at = time.monotonic()
+        self.last_used = self.mounted_at
+
+    def idle_for(self):
+        return time.monotonic() - self.last_used
+
+
+class NFSMountManager:
+    """Shares one mount per export between all clients, browsers and jobs"""
+
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT, health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL):
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._lock = threading.Lock()
+        self._mounts = {}  # key -> NFSMount
+        self._key_locks = {}  # key -> lock held while the export is mounted, checked or unmounted
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def acquire(self, key):
+        """The mounted NFSClient for key, mounting it if needed; None if it cannot be mounted"""
+        with self._key_lock(key):
+            with self._lock:
+                mount = self._mounts.get(key)
+                stale = (mount is not None and mount.refs == 0
+                         and mount.idle_for() >= self.health_check_interval)
+            if stale and not mount.client._verify_mount():
+                logger.warning(f"NFS mount of {describe_mount_key(key)} failed its health check, mounting again")
+                self._unmount(mount)
+                mount = None
+            if mount is None:
+                client = NFSClient(*key)
+                if not client.mount():
+                    logger.error(f"Cannot mount {describe_mount_key(key)}")
+                    return None
+                mount = NFSMount(key, client)
+                with self._lock:
+                    self._mounts[key] = mount
+                logger.info(f"Mounted {describe_mount_key(key)} at {client.mount_point}")
+            with self._lock:
+                mount.refs += 1
+                mount.last_used = time.monotonic()
+            return mount.client
+
+    def release(self, key):
+        """Drop a reference taken with acquire(); the mount stays until it has been idle long enough"""
+        with self._lock:
+            mount = self._mounts.get(key)
+            if mount is not None:
+                mount.refs = max(0, mount.refs - 1)
+                mount.last_used = time.monotonic()
+
+    @contextmanager
+    def use(self, key):
+        """The mounted NFSClient for key (or None) for the duration of a block"""
+        client = self.acquire(key)
+        try:
+            yield client
+        finally:
+            if client is not None:
+                self.release(key)
+
+    def _unmount(self, mount):
+        """Unmount and forget mount (caller holds its key lock)"""
+        with self._lock:
+            if self._mounts.get(mount.key) is mount:
+                del self._mounts[mount.key]
+        mount.client.unmount()
+
+    def evict_idle(self):
+        """Unmount every unreferenced mount idle for longer than the idle timeout"""
+        with self._lock:
+            candidates = [mount for mount in self._mounts.values()
+                          if mount.refs == 0 and mount.idle_for() >= self.idle_timeout]
+        evicted = 0
+        for mount in candidates:
+            key_lock = self._key_lock(mount.key)
+            # A mount being acquired right now is not idle
+            if not key_lock.acquire(blocking=False):
+                continue
+            try:
+                with self._lock:
+                    if mount.refs or mount.idle_for() < self.idle_timeout:
+                        continue
+                self._unmount(mount)
+                evicted += 1
+            finally:
+                key_lock.release()
+        if evicted:
+            logger.debug(f"Unmounted {evicted} idle NFS mounts")
+        return evicted
+
+    def close_all(self):
+        """Unmount everything, e.g. at exit"""
+        with self._lock:
+            mounts = list(self._mounts.values())
+        for mount in mounts:
+            with self._key_lock(mount.key):
+                self._unmount(mount)
+
+    def status(self):
+        """Snapshot of the mounts: export, mount point, references and ages in seconds"""
+        with self._lock:
+            return [{
+                'export': describe_mount_key(mount.key),
+                'mount_point': mount.client.mount_point,
+                'refs': mount.refs,
+                'idle_seconds': round(mount.idle_for(), 1),
+                'mounted_seconds': round(time.monotonic() - mount.mounted_at, 1)
+            } for mount in self._mounts.values()]
+
+
+# Shared by every client in the process
+nfs_mounts = NFSMountManager()
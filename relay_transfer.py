@@ -0,0 +1,190 @@
+"""
+Streaming relay between two sites.
+
+An upload job used to download the whole source tree into a temporary folder
+and only then upload it. The relay instead streams every file from a source
+session straight into a target session: a reader thread pushes chunks into a
+bounded queue and the writer sends them on as they arrive, so nothing touches
+the local disk, memory stays at RELAY_BUFFER_BYTES per session pair and the
+reader already fetches the next file while the writer finishes the current one.
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from checksums import StreamHasher
+
+logger = logging.getLogger(__name__)
+
+RELAY_BUFFER_BYTES = 8 * 1024 * 1024  # data in flight per source/target session pair
+RELAY_PROTOCOLS = ('ftp', 'sftp')
+
+
+class _Cancelled(Exception):
+    """Raised in the reader when the writer gave up on the file"""
+
+
+def can_relay(source, target):
+    """Whether files can be streamed between these two clients"""
+    return source.protocol in RELAY_PROTOCOLS and target.protocol in RELAY_PROTOCOLS
+
+
+def make_relay_task(source_path, target_path, name, require_content=False, size=None):
+    """Describe one file to copy from the source site to the target site
+
+    name is what the job log shows; require_content skips empty source files.
+    size (from the source listing) lets FTP sites compress large files.
+    """
+    return {
+        'source_path': source_path,
+        'target_path': target_path,
+        'name': name,
+        'require_content': require_content,
+        'size': size
+    }
+
+
+def _relay_pair(source, target, tasks, pending, results, max_chunks):
+    """Relay tasks from pending over one source session and one target session"""
+    with target.batch():
+        if not target.connect():
+            return
+        chunks = queue.Queue(maxsize=max_chunks)
+        cancelled = set()  # tasks the writer gave up on, so the reader stops sending them
+
+        def read_files():
+            try:
+                with source.batch():
+                    while True:
+                        if not source.connect():
+                            return
+                        try:
+                            index = pending.get_nowait()
+                        except queue.Empty:
+                            return
+
+                        def push(data, index=index):
+                            if index in cancelled:
+                                raise _Cancelled()
+                            chunks.put((index, data))
+
+                        try:
+                            source._read_stream(tasks[index]['source_path'], push, tasks[index]['size'])
+                            chunks.put((index, None))
+                        except Exception as e:
+                            if source._session_broken(e):
+                                source.disconnect(discard=True)
+                            chunks.put((index, e))
+            finally:
+                chunks.put((None, None))
+
+        reader = threading.Thread(target=read_files, name=f"{threading.current_thread().name}-read", daemon=True)
+        reader.start()
+
+        while True:
+            index, item = chunks.get()
+            if index is None:
+                break
+            results[index] = _write_file(target, tasks[index], index, item, chunks, cancelled)
+
+        reader.join()
+
+
+def _write_file(target, task, index, first, chunks, cancelled):
+    """Write one file whose first queued item is first; returns the task result"""
+    state = {'done': first is None or isinstance(first, Exception)}
+
+    if isinstance(first, Exception):
+        return {'success': False, 'error': str(first)}
+    if first is None and task['require_content']:
+        return {'success': False, 'error': 'empty file (0 bytes)'}
+
+    def file_chunks():
+        item = first
+        while item is not None:
+            if isinstance(item, Exception):
+                state['done'] = True
+                raise item
+            yield item
+            _, item = chunks.get()
+        state['done'] = True
+
+    try:
+        if not target.connect():
+            raise ConnectionError('Connection failed')
+        # The chunks are hashed as they pass, with the target's algorithm and any it can check with
+        server_algorithm = target._server_hash_algorithm() if target.verify_uploads else None
+        hasher = StreamHasher([target.checksum_algorithm, server_algorithm])
+        transferred = target._write_stream(task['target_path'], hasher.iterate(file_chunks()), task['size'])
+        verified = target._verify_upload(task['target_path'], hasher, server_algorithm)
+        if verified is False:
+            return {'success': False, 'error': f"Checksum mismatch: the target's {server_algorithm} differs from the relayed data"}
+        checksum = hasher.checksum(hasher.algorithms[0]) if hasher else None
+        return {'success': True, 'bytes_transferred': transferred, 'checksum': checksum, 'verified': bool(verified)}
+    except Exception as e:
+        if target._session_broken(e):
+            target.disconnect(discard=True)
+        if not state['done']:
+            # Stop the reader and drop what it already queued for this file
+            cancelled.add(index)
+            item = b''
+            while item is not None and not isinstance(item, Exception):
+                _, item = chunks.get()
+        return {'success': False, 'error': str(e)}
+
+
+def relay_parallel(source, target, tasks, max_workers=1):
+    """Copy tasks from source's site to target's site over up to max_workers session pairs
+
+    The calling clients form the first pair; the others are clones leasing their
+    own sessions. The result has the files_processed / bytes_transferred / log
+    shape of upload_parallel(), or None when both clients are on a site that
+    allows only one session, so the caller falls back to staging.
+    """
+    results = [None] * len(tasks)
+    workers = max(1, min(int(max_workers or 1), len(tasks)))
+    if source.pool_key == target.pool_key:
+        # Every pair holds two sessions from the same site's connection limit
+        if source.session_limit() < 2:
+            logger.info(f"{source.host} allows one session, so it cannot relay to itself")
+            return None
+        workers = min(workers, source.session_limit() // 2)
+    max_chunks = max(2, RELAY_BUFFER_BYTES // max(source.block_size, 8192))
+
+    if tasks:
+        pending = queue.Queue()
+        for index in range(len(tasks)):
+            pending.put(index)
+
+        with target.batch():
+            target._create_parent_directories(task['target_path'] for task in tasks)
+            pairs = [(source, target)] + [(source.clone(), target.clone()) for _ in range(workers - 1)]
+            logger.debug(f"Relaying {len(tasks)} files from {source.host} to {target.host} over {workers} connections")
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='relay') as executor:
+                list(executor.map(lambda pair: _relay_pair(*pair, tasks, pending, results, max_chunks), pairs))
+
+    files_processed = 0
+    bytes_transferred = 0
+    log_messages = []
+    completed = []
+
+    for task, result in zip(tasks, results):
+        if result is None:
+            result = {'success': False, 'error': 'Connection failed'}
+        if result['success']:
+            files_processed += 1
+            bytes_transferred += result['bytes_transferred']
+            completed.append(dict(task, checksum=result.get('checksum')))
+            log_messages.append(f"Uploaded: {task['name']}{' (checksum verified)' if result.get('verified') else ''}")
+        else:
+            log_messages.append(f"Failed to upload: {task['name']} - {result['error']}")
+
+    return {
+        'success': True,
+        'files_processed': files_processed,
+        'bytes_transferred': bytes_transferred,
+        'log': log_messages,
+        'connections': workers,
+        'completed': completed
+    }
@@ -0,0 +1,165 @@
+"""
+Resumable transfers.
+
+Downloads are written to '<name>.part' next to the target, with a small
+'<name>.part.json' record of the remote file's size and modification time,
+and only renamed into place once complete (synced to disk as the client's
+local_writes.LocalWrites says). When a download is retried - after
+a reconnect in the same run or by a later run of the job - a part whose record
+still matches the remote file is continued instead of restarted.
+
+Uploads keep a record of the local file's size and modification time under
+UPLOAD_STATE_DIR ('transfer_state' next to this module, or
+$TRANSFER_STATE_DIR) while they run, so a retry can continue at the size
+the server already has (FTP REST + STOR, SFTP write at offset).
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = '.part'
+RECORD_SUFFIX = '.part.json'
+# Next to the app rather than the working directory, which differs between gunicorn, scripts and tests
+UPLOAD_STATE_DIR = os.environ.get('TRANSFER_STATE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                         'transfer_state')
+
+
+def part_path(local_path):
+    return local_path + PART_SUFFIX
+
+
+def in_progress(name):
+    """Whether a local file name is a download still being written (a part or its record)"""
+    return name.endswith((PART_SUFFIX, RECORD_SUFFIX, RECORD_SUFFIX + '.tmp'))
+
+
+def _read_record(path):
+    try:
+        with open(path) as record_file:
+            return json.load(record_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_record(path, record):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as record_file:
+        json.dump(record, record_file)
+    os.replace(temp_path, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class PartialDownload:
+    """The '.part' file of one download and the record that says what it belongs to"""
+
+    def __init__(self, local_path, remote_path, remote_size, remote_mtime, segmented=False):
+        self.local_path = local_path
+        self.remote_path = remote_path
+        self.remote_size = remote_size
+        self.remote_mtime = remote_mtime
+        self.segmented = segmented
+        self.path = part_path(local_path)
+        self._record_path = local_path + RECORD_SUFFIX
+        self._lock = threading.Lock()
+        self.ranges_done = []  # (offset, length) already written by a segmented download
+        self.resumed = self._load()
+
+    def _load(self):
+        """Keep a matching part from an earlier attempt, otherwise start a fresh one"""
+        record = _read_record(self._record_path)
+        if (record and self.remote_size is not None and os.path.exists(self.path)
+                and record.get('remote_path') == self.remote_path
+                and record.get('size') == self.remote_size
+                and record.get('mtime') == self.remote_mtime
+                and record.get('segmented', False) == self.segmented
+                and os.path.getsize(self.path) <= self.remote_size):
+            self.ranges_done = [tuple(r) for r in record.get('ranges_done', [])]
+            return True
+
+        self.discard()
+        self._save()
+        return False
+
+    def _save(self):
+        _write_record(self._record_path, {
+            'remote_path': self.remote_path,
+            'size': self.remote_size,
+            'mtime': self.remote_mtime,
+            'segmented': self.segmented,
+            'ranges_done': self.ranges_done
+        })
+
+    def offset(self):
+        """Bytes already downloaded by a sequential transfer"""
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def has_progress(self):
+        """Whether the part holds downloaded bytes worth keeping for a retry"""
+        if self.segmented:
+            return bool(self.ranges_done)
+        return self.offset() > 0
+
+    def mark_range_done(self, offset, length):
+        with self._lock:
+            self.ranges_done.append((offset, length))
+            self._save()
+
+    def complete(self, local_writes=None):
+        """Check the part against the remote size and move it into place (through local_writes if given)"""
+        size = os.path.getsize(self.path)
+        if self.remote_size is not None and size != self.remote_size:
+            raise IOError(f"Size mismatch: local {size} bytes, remote {self.remote_size} bytes")
+        if local_writes is not None:
+            local_writes.commit(self.path, self.local_path)
+        else:
+            os.replace(self.path, self.local_path)
+        _remove(self._record_path)
+        return size
+
+    def discard(self):
+        _remove(self.path)
+        _remove(self._record_path)
+
+
+class PartialUpload:
+    """Record of an upload in progress, so a retry can continue where the server stopped"""
+
+    def __init__(self, site, local_path, remote_path):
+        stat_result = os.stat(local_path)
+        self.local_path = os.path.abspath(local_path)
+        self.local_size = stat_result.st_size
+        self.local_mtime = int(stat_result.st_mtime)
+        key = hashlib.sha1(f"{site}|{remote_path}".encode('utf-8')).hexdigest()
+        self._record_path = os.path.join(UPLOAD_STATE_DIR, f"{key}.json")
+
+    def resumable(self):
+        """Whether an earlier attempt uploaded this same local file to this remote path"""
+        record = _read_record(self._record_path)
+        return bool(record and record.get('local_path') == self.local_path
+                    and record.get('size') == self.local_size
+                    and record.get('mtime') == self.local_mtime)
+
+    def begin(self):
+        try:
+            os.makedirs(UPLOAD_STATE_DIR, exist_ok=True)
+            _write_record(self._record_path, {
+                'local_path': self.local_path,
+                'size': self.local_size,
+                'mtime': self.local_mtime
+            })
+        except OSError as e:
+            # Upload still works, it just cannot be resumed
+            logger.debug(f"Cannot record upload state: {str(e)}")
+
+    def complete(self):
+        _remove(self._record_path)
@@ -5,9 +5,17 @@ from crypto_utils import encrypt_password, decrypt_password
 from ftp_client import FTPClient
 from ftp_browser import FTPBrowser
 from email_service import send_notification, send_test_email
-from utils import log_system_message, get_setting, set_setting
+from utils import log_system_message, get_setting, set_setting, apply_bandwidth_settings
 from job_group_manager import JobGroupManager
 from network_drive_manager import NetworkDriveManager
+from sync_manifest import SyncManifest
+from checksums import algorithm_choices
+from compression import COMPRESSION_CHOICES
+from bandwidth import bandwidth_manager, parse_limit, parse_schedule
+from local_writes import FSYNC_POLICIES, normalize_fsync_policy
+from capabilities import capabilities
+from connection_pool import connection_pool
+from listing_cache import listing_cache
 from datetime import datetime, timedelta
 import os
 import json
@@ -87,6 +95,18 @@ def new_site():
             password = request.form['password']
             remote_path = request.form['remote_path'] or '/'
             transfer_type = request.form['transfer_type']
+            max_connections = int(request.form.get('max_connections') or 4)
+            block_size = int(request.form.get('block_size') or 32768)
+            prefetch_window = int(request.form.get('prefetch_window') or 64)
+            socket_buffer = int(request.form.get('socket_buffer') or 0) or None
+            segment_threshold_mb = int(request.form.get('segment_threshold_mb') or 0)
+            checksum_algorithm = request.form.get('checksum_algorithm', 'sha256')
+            verify_uploads = bool(request.form.get('verify_uploads'))
+            compression = request.form.get('compression', 'auto')
+            auto_tune = bool(request.form.get('auto_tune'))
+            bandwidth_limit_mbps = parse_limit(request.form.get('bandwidth_limit_mbps'))
+            bandwidth_schedule = request.form.get('bandwidth_schedule', '').strip() or None
+            parse_schedule(bandwidth_schedule)  # raises ValueError naming the bad line
             
             # NFS-specific fields
             nfs_export_path = request.form.get('nfs_export_path', '/') if protocol == 'nfs' else None
@@ -109,6 +129,17 @@ def new_site():
                 password_encrypted=encrypted_password,
                 remote_path=remote_path,
                 transfer_type=transfer_type,
+                max_connections=max_connections,
+                block_size=block_size,
+                prefetch_window=prefetch_window,
+                socket_buffer=socket_buffer,
+                segment_threshold_mb=segment_threshold_mb,
+                checksum_algorithm=checksum_algorithm,
+                verify_uploads=verify_uploads,
+                compression=compression,
+                auto_tune=auto_tune,
+                bandwidth_limit_mbps=bandwidth_limit_mbps,
+                bandwidth_schedule=bandwidth_schedule,
                 nfs_export_path=nfs_export_path,
                 nfs_version=nfs_version,
                 nfs_mount_options=nfs_mount_options,
@@ -117,6 +148,8 @@ def new_site():
             
             db.session.add(site)
             db.session.commit()
+            from scheduler import set_site_limit
+            set_site_limit(site)
             
             flash(f'Site "{name}" created successfully!', 'success')
             log_system_message('info', f'Site "{name}" created', 'sites')
@@ -127,7 +160,8 @@ def new_site():
             flash(f'Error creating site: {str(e)}', 'error')
             db.session.rollback()
     
-    return render_template('site_form.html')
+    return render_template('site_form.html', checksum_algorithms=algorithm_choices(),
+                           compression_choices=COMPRESSION_CHOICES)
 
 @app.route('/sites/<int:site_id>/edit', methods=['GET', 'POST'])
 def edit_site(site_id):
@@ -136,6 +170,10 @@ def edit_site(site_id):
     
     if request.method == 'POST':
         try:
+            from scheduler import set_site_limit, site_pool_key
+            pool_key_before = site_pool_key(site)
+            connection_before = (site.protocol, site.host, site.port)
+            compression_before = site.compression
             site.name = request.form['name']
             site.protocol = request.form['protocol']
             site.host = request.form['host']
@@ -143,6 +181,28 @@ def edit_site(site_id):
             site.username = request.form['username']
             site.remote_path = request.form['remote_path'] or '/'
             site.transfer_type = request.form['transfer_type']
+            site.max_connections = int(request.form.get('max_connections') or 4)
+            site.block_size = int(request.form.get('block_size') or 32768)
+            site.prefetch_window = int(request.form.get('prefetch_window') or 64)
+            site.socket_buffer = int(request.form.get('socket_buffer') or 0) or None
+            site.segment_threshold_mb = int(request.form.get('segment_threshold_mb') or 0)
+            site.checksum_algorithm = request.form.get('checksum_algorithm', 'sha256')
+            site.verify_uploads = bool(request.form.get('verify_uploads'))
+            site.compression = request.form.get('compression', 'auto')
+            site.auto_tune = bool(request.form.get('auto_tune'))
+            site.bandwidth_limit_mbps = parse_limit(request.form.get('bandwidth_limit_mbps'))
+            site.bandwidth_schedule = request.form.get('bandwidth_schedule', '').strip() or None
+            parse_schedule(site.bandwidth_schedule)  # raises ValueError naming the bad line
+            server_changed = (site.protocol, site.host, site.port) != connection_before
+            if server_changed or site.compression != compression_before:
+                # Another server or setting: 'auto' probes again before the next transfer
+                site.compression_enabled = None
+                site.compression_probe = None
+                site.compression_probed_at = None
+            if server_changed or not site.auto_tune:
+                # Auto-tune measures the new server before its next transfer
+                site.tuning_summary = None
+                site.tuned_at = None
             
             # NFS-specific fields
             if site.protocol == 'nfs':
@@ -159,6 +219,12 @@ def edit_site(site_id):
             
             site.updated_at = datetime.utcnow()
             db.session.commit()
+            if pool_key_before is not None:
+                # Pooled sessions were opened with the old login and transfer settings, and
+                # cached listings may belong to another server or account
+                connection_pool.close_site(pool_key_before)
+                listing_cache.invalidate_site(pool_key_before)
+            set_site_limit(site)
             
             flash(f'Site "{site.name}" updated successfully!', 'success')
             log_system_message('info', f'Site "{site.name}" updated', 'sites')
@@ -171,17 +237,23 @@ def edit_site(site_id):
     
     # Decrypt password for display (show placeholder)
     site.password_decrypted = ''
-    return render_template('site_form.html', site=site)
+    return render_template('site_form.html', site=site, checksum_algorithms=algorithm_choices(),
+                           compression_choices=COMPRESSION_CHOICES)
 
 @app.route('/sites/<int:site_id>/delete', methods=['POST'])
 def delete_site(site_id):
     """Delete an FTP/SFTP site"""
     try:
+        from scheduler import site_pool_key
         site = Site.query.get_or_404(site_id)
         name = site.name
+        pool_key = site_pool_key(site)
         
         db.session.delete(site)
         db.session.commit()
+        if pool_key is not None:
+            connection_pool.close_site(pool_key)
+            listing_cache.invalidate_site(pool_key)
         
         flash(f'Site "{name}" deleted successfully!', 'success')
         log_system_message('info', f'Site "{name}" deleted', 'sites')
@@ -232,6 +304,78 @@ def test_site(site_id):
             'message': f'Error testing site connection: {str(e)}'
         })
 
+@app.route('/sites/<int:site_id>/probe_compression', methods=['POST'])
+def probe_site_compression(site_id):
+    """Start measuring compressed against raw transfers for a site; the result is saved to the site"""
+    try:
+        site = Site.query.get_or_404(site_id)
+        if site.protocol not in ('ftp', 'sftp'):
+            return jsonify({'success': False, 'message': f'{site.protocol.upper()} sites have no wire compression'})
+        
+        from scheduler import queue_site_check
+        queued = queue_site_check('compression', site.id)
+        
+        return jsonify({
+            'success': True,
+            'message': f'Compression probe for "{site.name}" {"started" if queued else "is already running"}',
+            'status_url': url_for('probe_site_compression_status', site_id=site.id)
+        }), 202
+    except Exception as e:
+        logger.error(f"Error probing site compression: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error probing site compression: {str(e)}'
+        })
+
+@app.route('/sites/<int:site_id>/probe_compression/status')
+def probe_site_compression_status(site_id):
+    """Whether a site's compression probe is still running, and its last result"""
+    site = Site.query.get_or_404(site_id)
+    from scheduler import site_check_running
+    from compression import PROBE_FAILED
+    summary = site.compression_probe or ''
+    return jsonify({
+        'running': site_check_running('compression', site.id),
+        'success': bool(summary) and not summary.startswith(PROBE_FAILED),
+        'message': f'Compression probe for "{site.name}": {summary}' if summary else f'"{site.name}" was not probed yet'
+    })
+
+@app.route('/sites/<int:site_id>/tune', methods=['POST'])
+def tune_site(site_id):
+    """Start measuring the fastest block size for a site; the result is saved to the site"""
+    try:
+        site = Site.query.get_or_404(site_id)
+        if site.protocol not in ('ftp', 'sftp'):
+            return jsonify({'success': False, 'message': f'{site.protocol.upper()} sites have no block size to tune'})
+        
+        from scheduler import queue_site_check
+        queued = queue_site_check('tuning', site.id)
+        
+        return jsonify({
+            'success': True,
+            'message': f'Block size tuning for "{site.name}" {"started" if queued else "is already running"}',
+            'status_url': url_for('tune_site_status', site_id=site.id)
+        }), 202
+    except Exception as e:
+        logger.error(f"Error tuning site: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error tuning site: {str(e)}'
+        })
+
+@app.route('/sites/<int:site_id>/tune/status')
+def tune_site_status(site_id):
+    """Whether a site's block size tuning is still running, and its last result"""
+    site = Site.query.get_or_404(site_id)
+    from scheduler import site_check_running
+    from transfer_tuning import TUNING_FAILED
+    summary = site.tuning_summary or ''
+    return jsonify({
+        'running': site_check_running('tuning', site.id),
+        'success': bool(summary) and not summary.startswith(TUNING_FAILED),
+        'message': f'Block size tuning for "{site.name}": {summary}' if summary else f'"{site.name}" was not tuned yet'
+    })
+
 @app.route('/jobs')
 def jobs():
     """List all jobs"""
@@ -304,6 +448,10 @@ def new_job():
             job.enable_duplicate_renaming = bool(request.form.get('enable_duplicate_renaming'))
             job.use_date_folders = bool(request.form.get('use_date_folders'))
             job.date_folder_format = request.form.get('date_folder_format', 'YYYY-MM-DD')
+            job.incremental_sync = bool(request.form.get('incremental_sync'))
+            job.bandwidth_limit_mbps = parse_limit(request.form.get('bandwidth_limit_mbps'))
+            job.bandwidth_schedule = request.form.get('bandwidth_schedule', '').strip() or None
+            parse_schedule(job.bandwidth_schedule)  # raises ValueError naming the bad line
             
             # Handle job group assignment and job folder name
             if request.form.get('job_group_id'):
@@ -319,9 +467,11 @@ def new_job():
                 # Handle upload job options
                 job.use_local_folders = bool(request.form.get('use_local_folders'))
                 job.upload_date_folder_format = request.form.get('upload_date_folder_format', 'YYYY-MM')
+                job.upload_transfer_mode = request.form.get('upload_transfer_mode', 'relay')
             else:
                 job.use_local_folders = False
                 job.upload_date_folder_format = 'YYYY-MM'
+                job.upload_transfer_mode = 'relay'
             
             # Allow empty job folder names - if job_folder_name is empty, no job folder will be created
             
@@ -451,6 +601,13 @@ def edit_job(job_id):
             job.enable_duplicate_renaming = bool(request.form.get('enable_duplicate_renaming'))
             job.use_date_folders = bool(request.form.get('use_date_folders'))
             job.date_folder_format = request.form.get('date_folder_format', 'YYYY-MM-DD')
+            if job.incremental_sync and not request.form.get('incremental_sync'):
+                # Turning incremental sync off forgets what was transferred, so turning it back on starts over
+                SyncManifest.clear(job.id)
+            job.incremental_sync = bool(request.form.get('incremental_sync'))
+            job.bandwidth_limit_mbps = parse_limit(request.form.get('bandwidth_limit_mbps'))
+            job.bandwidth_schedule = request.form.get('bandwidth_schedule', '').strip() or None
+            parse_schedule(job.bandwidth_schedule)  # raises ValueError naming the bad line
             
             # Handle job group assignment and job folder name
             if request.form.get('job_group_id'):
@@ -479,10 +636,12 @@ def edit_job(job_id):
                 # Handle upload job options
                 job.use_local_folders = bool(request.form.get('use_local_folders'))
                 job.upload_date_folder_format = request.form.get('upload_date_folder_format', 'YYYY-MM')
+                job.upload_transfer_mode = request.form.get('upload_transfer_mode', 'relay')
             else:
                 job.target_site_id = None
                 job.use_local_folders = False
                 job.upload_date_folder_format = 'YYYY-MM'
+                job.upload_transfer_mode = 'relay'
             
             job.updated_at = datetime.utcnow()
             db.session.commit()
@@ -725,6 +884,17 @@ def settings():
                 encrypted = setting in ['db_password']
                 set_setting(setting, value, encrypted)
             
+            # Global bandwidth limit, validated before anything of it is saved
+            bandwidth_limit = parse_limit(request.form.get('bandwidth_limit_mbps'))
+            bandwidth_schedule = request.form.get('bandwidth_schedule', '').strip()
+            parse_schedule(bandwidth_schedule)
+            set_setting('bandwidth_limit_mbps', str(bandwidth_limit) if bandwidth_limit else '')
+            set_setting('bandwidth_schedule', bandwidth_schedule)
+            apply_bandwidth_settings()
+            
+            # How downloads are synced to disk
+            set_setting('fsync_policy', normalize_fsync_policy(request.form.get('fsync_policy')))
+            
             flash('Settings updated successfully!', 'success')
             log_system_message('info', 'System settings updated', 'settings')
             
@@ -738,7 +908,8 @@ def settings():
     setting_keys = [
         'smtp_server', 'smtp_port', 'smtp_use_tls', 'smtp_username', 
         'smtp_from_email', 'notification_email',
-        'db_host', 'db_port', 'db_name', 'db_username'
+        'db_host', 'db_port', 'db_name', 'db_username',
+        'bandwidth_limit_mbps', 'bandwidth_schedule', 'fsync_policy'
     ]
     
     for key in setting_keys:
@@ -748,7 +919,9 @@ def settings():
     current_settings['python_version'] = f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}"
     current_settings['flask_version'] = flask.__version__
     
-    return render_template('settings.html', settings=current_settings)
+    current_settings['fsync_policy'] = normalize_fsync_policy(current_settings['fsync_policy'])
+    
+    return render_template('settings.html', settings=current_settings, fsync_policies=FSYNC_POLICIES)
 
 @app.route('/upload', methods=['GET', 'POST'])
 def upload_files():
@@ -851,6 +1024,51 @@ def api_dashboard_stats():
         logger.error(f"Error getting dashboard stats: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/bandwidth')
+def api_bandwidth():
+    """API endpoint for bandwidth limits and current transfer rates (Mbit/s) globally and per site and job"""
+    try:
+        status = bandwidth_manager.status()
+        
+        def in_mbps(entry, name=None):
+            result = {
+                'limit_mbps': round(entry['limit'] / 125000, 2) if entry['limit'] else None,
+                'download_mbps': round(entry['download_rate'] / 125000, 2),
+                'upload_mbps': round(entry['upload_rate'] / 125000, 2)
+            }
+            if name is not None:
+                result['name'] = name
+            return result
+        
+        site_names = {site.id: site.name for site in Site.query.filter(Site.id.in_(list(status['sites']))).all()}
+        job_names = {job.id: job.name for job in Job.query.filter(Job.id.in_(list(status['jobs']))).all()}
+        return jsonify({
+            'global': in_mbps(status['global']) if status['global'] else None,
+            'sites': {site_id: in_mbps(entry, site_names.get(site_id, '')) for site_id, entry in status['sites'].items()},
+            'jobs': {job_id: in_mbps(entry, job_names.get(job_id, '')) for job_id, entry in status['jobs'].items()}
+        })
+    except Exception as e:
+        logger.error(f"Error getting bandwidth status: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/capabilities')
+def api_capabilities():
+    """API endpoint for the mount helpers, sudo access and kernel filesystems found on this host"""
+    try:
+        return jsonify(capabilities.snapshot())
+    except Exception as e:
+        logger.error(f"Error getting capabilities: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/capabilities/refresh', methods=['POST'])
+def api_capabilities_refresh():
+    """Probe the mount capabilities again, e.g. after installing nfs-common or cifs-utils"""
+    try:
+        return jsonify(capabilities.refresh())
+    except Exception as e:
+        logger.error(f"Error probing capabilities: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/test-email', methods=['POST'])
 def api_test_email():
     """API endpoint to test email configuration"""
@@ -906,7 +1124,8 @@ def browse_site(site_id, remote_path='.'):
             })
         
         browser = FTPBrowser(site.protocol, site.host, site.port, site.username, password, **browser_kwargs)
-        result = browser.browse_directory(remote_path)
+        # ?refresh=1 bypasses the listing cache
+        result = browser.browse_directory(remote_path, refresh=request.args.get('refresh') == '1')
         
         if not result['success']:
             flash(f'Error browsing directory: {result["error"]}', 'error')
@@ -929,6 +1148,7 @@ def browse_site(site_id, remote_path='.'):
                              current_path=result['current_path'],
                              parent_path=result['parent_path'],
                              items=result['items'],
+                             listed_at=result.get('listed_at'),
                              path_parts=path_parts)
                              
     except Exception as e:
@@ -1041,19 +1261,16 @@ def debug_nfs_status(site_id):
         if site.protocol != 'nfs':
             return jsonify({'error': 'Site is not NFS protocol'}), 400
         
-        from nfs_client import NFSClient
+        from nfs_mounts import nfs_mounts, make_mount_key
         
-        # Create NFS client
-        nfs_client = NFSClient(
-            host=site.host,
-            export_path=site.nfs_export_path or '/',
-            nfs_version=site.nfs_version or '4',
-            mount_options=site.nfs_mount_options or '',
-            auth_method=site.nfs_auth_method or 'sys'
-        )
-        
-        # Get detailed status
-        status = nfs_client.get_mount_status()
+        # Status of the site's shared mount (mounted if it is not already)
+        mount_key = make_mount_key(site.host, site.nfs_export_path, site.nfs_version,
+                                   site.nfs_mount_options, site.nfs_auth_method)
+        with nfs_mounts.use(mount_key) as nfs_client:
+            if nfs_client is None:
+                status = {'mounted': False, 'errors': ['Failed to mount NFS share']}
+            else:
+                status = nfs_client.get_mount_status()
         
         # Add site information
         debug_info = {
@@ -1067,6 +1284,7 @@ def debug_nfs_status(site_id):
                 'mount_options': site.nfs_mount_options
             },
             'nfs_status': status,
+            'shared_mounts': nfs_mounts.status(),
             'environment': {
                 'user': os.getenv('USER', 'unknown'),
                 'pwd': os.getcwd(),
@@ -4,13 +4,30 @@ from app import app, db, scheduler
 from models import Job, JobLog, Site
 from crypto_utils import decrypt_password
 from ftp_client import FTPClient
+from connection_pool import connection_pool, make_pool_key
+from transfer_engine import make_task, make_upload_task, DEFAULT_MAX_CONNECTIONS
+from relay_transfer import make_relay_task, relay_parallel, can_relay
+from fxp_transfer import make_fxp_task, fxp_parallel, probe_fxp, can_fxp
+from sftp_transfer import DEFAULT_BLOCK_SIZE, DEFAULT_PREFETCH_WINDOW
+from sync_manifest import SyncManifest
+from checksums import sidecars_for, checksum_lines, DEFAULT_ALGORITHM
+from compression import compression_setting, needs_probe, probe_compression, record_probe
+from transfer_tuning import needs_tuning, tune_block_sizes, record_tuning
+from bandwidth import bandwidth_manager
+from local_writes import LocalWrites
+from resumable import in_progress
 from email_service import send_notification
-from utils import log_system_message, calculate_rolling_date_range, filter_files_by_filename_date
+from utils import (log_system_message, calculate_rolling_date_range, filter_files_by_filename_date, apply_bandwidth_settings,
+                   get_setting)
 import os
 import glob
+import threading
 
 logger = logging.getLogger(__name__)
 
+_site_checks = set()  # (kind, site id) of the site checks queued or running, see queue_site_check()
+_site_checks_lock = threading.Lock()
+
 def schedule_job(job):
     """Schedule a job with APScheduler"""
     try:
@@ -104,6 +121,7 @@ def execute_job(job_id):
                 job_log.status = 'completed'
                 job_log.files_processed = result.get('files_processed', 0)
                 job_log.bytes_transferred = result.get('bytes_transferred', 0)
+                job_log.checksums = result.get('checksums')
                 
                 log_system_message('info', f'Job "{job.name}" completed successfully', 'scheduler')
                 
@@ -154,23 +172,199 @@ def execute_job(job_id):
                 is_success=False
             )
 
+def create_site_client(site, sync_manifest=None, probe=True, job=None):
+    """Create an FTPClient for a site with its NFS and transfer settings
+    
+    sync_manifest makes the client's downloads skip files an incremental job
+    already transferred. A site with automatic compression whose last probe
+    is missing or stale gets probed, and one with auto-tuning that was never
+    tuned gets tuned, both in the background (probe=False skips that). The
+    client's transfers are held to the global, site and (if given) job
+    bandwidth limits, and its downloads are synced to disk as the global
+    fsync policy says.
+    """
+    if probe and needs_tuning(site):
+        # Runs in the background; this client transfers with the current settings
+        queue_site_check('tuning', site.id)
+    if probe and needs_probe(site):
+        # Also in the background; until the probe is done 'auto' transfers uncompressed
+        queue_site_check('compression', site.id)
+    password = decrypt_password(site.password_encrypted)
+    apply_bandwidth_settings()
+    set_site_limit(site)
+    
+    client_kwargs = {
+        'max_connections': site.max_connections or DEFAULT_MAX_CONNECTIONS,
+        'block_size': site.block_size or DEFAULT_BLOCK_SIZE,
+        'prefetch_window': site.prefetch_window or DEFAULT_PREFETCH_WINDOW,
+        'socket_buffer': site.socket_buffer,
+        'segment_threshold_mb': site.segment_threshold_mb,
+        'checksum_algorithm': site.checksum_algorithm or DEFAULT_ALGORITHM,
+        'verify_uploads': site.verify_uploads,
+        'compression': compression_setting(site),
+        'sync_manifest': sync_manifest,
+        'throttle': bandwidth_manager.throttle(site=site, job=job),
+        'local_writes': LocalWrites(get_setting('fsync_policy'))
+    }
+    if site.protocol == 'nfs':
+        client_kwargs.update({
+            'nfs_export_path': site.nfs_export_path or '/',
+            'nfs_version': site.nfs_version or '4',
+            'nfs_mount_options': site.nfs_mount_options or '',
+            'nfs_auth_method': site.nfs_auth_method or 'sys'
+        })
+    
+    return FTPClient(site.protocol, site.host, site.port, site.username, password, **client_kwargs)
+
+def site_pool_key(site):
+    """The connection pool key of a site's sessions as it is currently configured, None without a usable password"""
+    try:
+        password = decrypt_password(site.password_encrypted)
+    except Exception:
+        return None
+    return make_pool_key(site.protocol, site.host, site.port, site.username, password)
+
+def set_site_limit(site):
+    """Hold all sessions to site (jobs, clones, the browser) to its max_connections"""
+    if site.protocol not in ('ftp', 'sftp'):
+        return
+    pool_key = site_pool_key(site)
+    if pool_key is not None:
+        connection_pool.set_limit(pool_key, site.max_connections or DEFAULT_MAX_CONNECTIONS)
+
+def apply_site_limits():
+    """Set the connection limit of every site on application start, before any job or browser uses it"""
+    with app.app_context():
+        try:
+            for site in Site.query.filter(Site.protocol.in_(['ftp', 'sftp'])).all():
+                set_site_limit(site)
+        except Exception as e:
+            logger.error(f"Error setting site connection limits: {str(e)}")
+
+def probe_site_compression(site):
+    """Time compressed against raw transfers for a site and store which one it uses"""
+    result = probe_compression(create_site_client(site, probe=False), site.remote_path or '/')
+    record_probe(site, result)
+    db.session.commit()
+    if result['success']:
+        log_system_message('info', f'Compression probe for "{site.name}": {result["summary"]}', 'scheduler')
+    else:
+        log_system_message('warning', f'Compression probe for "{site.name}" failed: {result["error"]}', 'scheduler')
+    return result
+
+def queue_site_check(kind, site_id):
+    """Tune ('tuning') or probe the compression of ('compression') a site on the scheduler's thread pool
+    
+    Both move a sample file many times, far longer than a web request or a
+    job's start may wait. Returns False when the same check of the site is
+    already queued or running.
+    """
+    with _site_checks_lock:
+        if (kind, site_id) in _site_checks:
+            return False
+        _site_checks.add((kind, site_id))
+    try:
+        scheduler.add_job(
+            func=run_site_check,
+            args=[kind, site_id],
+            trigger='date',
+            id=f'{kind}_site_{site_id}',
+            replace_existing=True
+        )
+    except Exception:
+        with _site_checks_lock:
+            _site_checks.discard((kind, site_id))
+        raise
+    return True
+
+def site_check_running(kind, site_id):
+    """Whether queue_site_check(kind, site_id) is still queued or running"""
+    with _site_checks_lock:
+        return (kind, site_id) in _site_checks
+
+def run_site_check(kind, site_id):
+    """Scheduler job of queue_site_check()"""
+    with app.app_context():
+        try:
+            site = Site.query.get(site_id)
+            if site is None:
+                return
+            if kind == 'tuning':
+                tune_site_transfers(site)
+            else:
+                probe_site_compression(site)
+        except Exception as e:
+            logger.error(f"Error running {kind} check of site {site_id}: {str(e)}")
+            db.session.rollback()
+        finally:
+            with _site_checks_lock:
+                _site_checks.discard((kind, site_id))
+
+def tune_site_transfers(site):
+    """Measure the fastest block size (and SFTP prefetch window) for a site and save it"""
+    result = tune_block_sizes(create_site_client(site, probe=False), site.remote_path or '/')
+    record_tuning(site, result)
+    db.session.commit()
+    if result['success']:
+        log_system_message('info', f'Block size tuning for "{site.name}": {result["summary"]}', 'scheduler')
+    else:
+        log_system_message('warning', f'Block size tuning for "{site.name}" failed: {result["error"]}', 'scheduler')
+    return result
+
+def _download_by_filename_date(client, site, local_path, pattern, date_from, date_to, log_messages):
+    """Download the files in the site's remote path whose names carry a date in the range
+    
+    Lists the directory, filters it with filter_files_by_filename_date() and
+    downloads the matching files over the site's parallel connections, with
+    the checksum sidecars listed next to them. Returns the download result,
+    or the failed listing; progress is logged to log_messages.
+    """
+    files_list = client.list_files(site.remote_path)
+    if not files_list['success']:
+        return files_list
+    
+    log_messages.append(f"Found {len(files_list['files'])} files before filtering")
+    filtered_files = filter_files_by_filename_date(files_list['files'], pattern, date_from, date_to)
+    log_messages.append(f"Files after filename date filter: {len(filtered_files)}")
+    
+    names = {file_info['name'] for file_info in files_list['files']}
+    tasks = []
+    for file_info in filtered_files:
+        if file_info['type'] == 'file':
+            remote_file_path = os.path.join(site.remote_path, file_info['name']).replace('\\', '/')
+            tasks.append(make_task(remote_file_path, os.path.join(local_path, file_info['name']),
+                                   size=file_info.get('size'), modify=file_info.get('modify'),
+                                   sidecars=sidecars_for(remote_file_path, names)))
+    result = client.download_many(tasks)
+    log_messages.extend(result['log'])
+    return result
+
+def _job_result(result, log_messages, manifest=None, recorded=None, key='remote_path'):
+    """Job result of a finished transfer, after recording its files in the job's sync manifest
+    
+    result is the transfer's files_processed / bytes_transferred / completed
+    result; recorded are the tasks to record instead of its completed ones.
+    """
+    completed = result.get('completed', [])
+    if manifest is not None:
+        manifest.record(completed if recorded is None else recorded, key=key)
+        manifest.save()
+        log_messages.append(manifest.summary())
+    
+    return {
+        'success': True,
+        'files_processed': result.get('files_processed', 0),
+        'bytes_transferred': result.get('bytes_transferred', 0),
+        'log': '\n'.join(log_messages),
+        'checksums': checksum_lines(completed)
+    }
+
 def execute_download_job(job, job_log):
     """Execute a download job"""
     try:
         site = job.site
-        password = decrypt_password(site.password_encrypted)
-        
-        # Build client parameters with NFS support
-        client_kwargs = {}
-        if site.protocol == 'nfs':
-            client_kwargs.update({
-                'nfs_export_path': site.nfs_export_path or '/',
-                'nfs_version': site.nfs_version or '4',
-                'nfs_mount_options': site.nfs_mount_options or '',
-                'nfs_auth_method': site.nfs_auth_method or 'sys'
-            })
-        
-        client = FTPClient(site.protocol, site.host, site.port, site.username, password, **client_kwargs)
+        manifest = SyncManifest.load(job.id) if job.incremental_sync else None
+        client = create_site_client(site, sync_manifest=manifest, job=job)
         
         # Create local directory - incorporate job group and folder structure
         from job_group_manager import JobGroupManager
@@ -280,42 +474,17 @@ def execute_download_job(job, job_log):
             # Local path - standard directory creation
             os.makedirs(local_path, exist_ok=True)
         
-        files_processed = 0
-        bytes_transferred = 0
         log_messages = []
         log_messages.append(f"Target folder: {local_path}")
         
         if job.download_all:
             # Download all files/folders (with optional filename date filtering)
             if job.use_filename_date_filter and job.filename_date_pattern and site.transfer_type == 'files':
-                # Get file list first, apply filename date filtering, then download
-                files_list = client.list_files(site.remote_path)
-                if not files_list['success']:
-                    return files_list
-                
-                log_messages.append(f"Found {len(files_list['files'])} files before filtering")
-                
-                # Apply filename date filtering (no date range - just files with valid dates)
-                filtered_files = filter_files_by_filename_date(files_list['files'], job.filename_date_pattern, None, None)
-                log_messages.append(f"Files after filename date filter: {len(filtered_files)}")
-                
-                # Download filtered files manually
-                files_processed = 0
-                bytes_transferred = 0
-                
-                for file_info in filtered_files:
-                    if file_info['type'] == 'file':
-                        remote_file_path = os.path.join(site.remote_path, file_info['name']).replace('\\', '/')
-                        local_file_path = os.path.join(local_path, file_info['name'])
-                        
-                        result = client.download_file(remote_file_path, local_file_path)
-                        
-                        if result['success']:
-                            files_processed += 1
-                            bytes_transferred += result['bytes_transferred']
-                            log_messages.append(f"Downloaded: {file_info['name']}")
-                        else:
-                            log_messages.append(f"Failed to download: {file_info['name']} - {result['error']}")
+                # No date range - just the files with valid dates in their names
+                result = _download_by_filename_date(client, site, local_path, job.filename_date_pattern, None, None,
+                                                    log_messages)
+                if not result['success']:
+                    return result
             else:
                 # Check if any advanced download features are enabled at job level
                 has_advanced_features = (job.enable_recursive_download or 
@@ -333,12 +502,9 @@ def execute_download_job(job, job_log):
                     else:
                         result = client.download_folder(site.remote_path, local_path)
                 
-                if result['success']:
-                    files_processed = result.get('files_processed', 0)
-                    bytes_transferred = result.get('bytes_transferred', 0)
-                    log_messages = result.get('log', [])
-                else:
+                if not result['success']:
                     return result
+                log_messages = result.get('log', [])
         
         elif job.use_date_range or job.use_rolling_date_range:
             # Determine date range
@@ -358,34 +524,10 @@ def execute_download_job(job, job_log):
             
             # Download files within date range (with optional filename date filtering)
             if job.use_filename_date_filter and job.filename_date_pattern and site.transfer_type == 'files':
-                # Get file list first, apply filename date filtering based on date range, then download
-                files_list = client.list_files(site.remote_path)
-                if not files_list['success']:
-                    return files_list
-                
-                log_messages.append(f"Found {len(files_list['files'])} files before filtering")
-                
-                # Apply filename date filtering with date range
-                filtered_files = filter_files_by_filename_date(files_list['files'], job.filename_date_pattern, date_from, date_to)
-                log_messages.append(f"Files after filename date filter: {len(filtered_files)}")
-                
-                # Download filtered files manually
-                files_processed = 0
-                bytes_transferred = 0
-                
-                for file_info in filtered_files:
-                    if file_info['type'] == 'file':
-                        remote_file_path = os.path.join(site.remote_path, file_info['name']).replace('\\', '/')
-                        local_file_path = os.path.join(local_path, file_info['name'])
-                        
-                        result = client.download_file(remote_file_path, local_file_path)
-                        
-                        if result['success']:
-                            files_processed += 1
-                            bytes_transferred += result['bytes_transferred']
-                            log_messages.append(f"Downloaded: {file_info['name']}")
-                        else:
-                            log_messages.append(f"Failed to download: {file_info['name']} - {result['error']}")
+                result = _download_by_filename_date(client, site, local_path, job.filename_date_pattern, date_from,
+                                                    date_to, log_messages)
+                if not result['success']:
+                    return result
             else:
                 # Regular date range download using file modification times
                 result = client.download_files_by_date_range(
@@ -395,12 +537,9 @@ def execute_download_job(job, job_log):
                     date_to
                 )
                 
-                if result['success']:
-                    files_processed = result.get('files_processed', 0)
-                    bytes_transferred = result.get('bytes_transferred', 0)
-                    log_messages = result.get('log', [])
-                else:
+                if not result['success']:
                     return result
+                log_messages = result.get('log', [])
         
         else:
             # Download specific files/folders
@@ -420,19 +559,11 @@ def execute_download_job(job, job_log):
                 else:
                     result = client.download_folder(site.remote_path, local_path)
             
-            if result['success']:
-                files_processed = result.get('files_processed', 0)
-                bytes_transferred = result.get('bytes_transferred', 0)
-                log_messages = result.get('log', [])
-            else:
+            if not result['success']:
                 return result
+            log_messages = result.get('log', [])
         
-        return {
-            'success': True,
-            'files_processed': files_processed,
-            'bytes_transferred': bytes_transferred,
-            'log': '\n'.join(log_messages)
-        }
+        return _job_result(result, log_messages, manifest)
         
     except Exception as e:
         logger.error(f"Error in download job: {str(e)}")
@@ -465,35 +596,18 @@ def execute_upload_job(job, job_log):
         # Original upload logic: download from source, then upload to target
         source_site = job.site
         
-        # Get passwords
-        source_password = decrypt_password(source_site.password_encrypted)
-        target_password = decrypt_password(target_site.password_encrypted)
-        
-        # Build source client parameters with NFS support
-        source_kwargs = {}
-        if source_site.protocol == 'nfs':
-            source_kwargs.update({
-                'nfs_export_path': source_site.nfs_export_path or '/',
-                'nfs_version': source_site.nfs_version or '4',
-                'nfs_mount_options': source_site.nfs_mount_options or '',
-                'nfs_auth_method': source_site.nfs_auth_method or 'sys'
-            })
-        
-        # Build target client parameters with NFS support
-        target_kwargs = {}
-        if target_site.protocol == 'nfs':
-            target_kwargs.update({
-                'nfs_export_path': target_site.nfs_export_path or '/',
-                'nfs_version': target_site.nfs_version or '4',
-                'nfs_mount_options': target_site.nfs_mount_options or '',
-                'nfs_auth_method': target_site.nfs_auth_method or 'sys'
-            })
-        
-        # Create clients
-        source_client = FTPClient(source_site.protocol, source_site.host, source_site.port, source_site.username, source_password, **source_kwargs)
-        target_client = FTPClient(target_site.protocol, target_site.host, target_site.port, target_site.username, target_password, **target_kwargs)
-        
-        # Download from source first
+        # Create clients; an incremental job's source client skips unchanged files
+        manifest = SyncManifest.load(job.id) if job.incremental_sync else None
+        source_client = create_site_client(source_site, sync_manifest=manifest, job=job)
+        target_client = create_site_client(target_site, job=job)
+        
+        relay = (job.upload_transfer_mode or 'relay') == 'relay' and can_relay(source_client, target_client)
+        if relay or can_fxp(source_client, target_client):
+            result = execute_direct_upload(job, source_client, target_client, source_site, target_site, relay)
+            if result is not None:
+                return result
+        
+        # Staging: download from source first
         temp_path = f'./temp_transfer_{job.id}'
         os.makedirs(temp_path, exist_ok=True)
         
@@ -514,33 +628,23 @@ def execute_upload_job(job, job_log):
             if not download_result['success']:
                 return download_result
             
-            # Upload to target
-            files_processed = 0
-            bytes_transferred = 0
-            log_messages = []
-            
-            # Upload all downloaded files
+            # Upload all downloaded files to target
+            upload_tasks = []
             for root, dirs, files in os.walk(temp_path):
                 for file in files:
                     local_file_path = os.path.join(root, file)
                     relative_path = os.path.relpath(local_file_path, temp_path)
                     remote_file_path = os.path.join(target_site.remote_path, relative_path).replace('\\', '/')
-                    
-                    upload_result = target_client.upload_file(local_file_path, remote_file_path)
-                    
-                    if upload_result['success']:
-                        files_processed += 1
-                        bytes_transferred += os.path.getsize(local_file_path)
-                        log_messages.append(f"Uploaded: {relative_path}")
-                    else:
-                        log_messages.append(f"Failed to upload: {relative_path} - {upload_result.get('error', 'Unknown error')}")
+                    upload_tasks.append(make_upload_task(local_file_path, remote_file_path, relative_path))
             
-            return {
-                'success': True,
-                'files_processed': files_processed,
-                'bytes_transferred': bytes_transferred,
-                'log': '\n'.join(log_messages)
-            }
+            upload_result = target_client.upload_many(upload_tasks)
+            log_messages = upload_result['log']
+            
+            # Only files that made it all the way to the target count as transferred
+            uploaded = {os.path.normpath(task['local_path']) for task in upload_result['completed']}
+            return _job_result(upload_result, log_messages, manifest,
+                               (task for task in download_result.get('completed', [])
+                                if os.path.normpath(task['local_path']) in uploaded))
             
         finally:
             # Clean up temp directory
@@ -557,24 +661,72 @@ def execute_upload_job(job, job_log):
             'error': str(e)
         }
 
+def execute_direct_upload(job, source_client, target_client, source_site, target_site, relay):
+    """Copy the job's files without staging them locally
+    
+    Server-to-server (FXP) when both sites are FTP servers that allow it,
+    otherwise streamed through this host if relay is set. Returns None when
+    neither applies, so the caller falls back to staging.
+    """
+    with source_client.batch():
+        # Same file selection as the staging download
+        if job.download_all:
+            plan = source_client.plan_all_files(source_site.remote_path, '')
+        elif job.use_date_range:
+            plan = source_client.plan_files_by_date_range(source_site.remote_path, '', job.date_from, job.date_to)
+        else:
+            plan = source_client.plan_files(source_site.remote_path, '')
+        
+        if not plan['success']:
+            return plan
+        
+        tasks = plan['tasks']
+        manifest = source_client.sync_manifest
+        if manifest is not None:
+            tasks = list(manifest.pending(tasks))
+        
+        max_workers = min(source_client.max_connections, target_client.max_connections)
+        transfer_result = None
+        log_messages = list(plan['log'])
+        
+        if can_fxp(source_client, target_client) and probe_fxp(source_client, target_client):
+            fxp_tasks = []
+            for task in tasks:
+                relative_path = task['local_path']
+                remote_file_path = os.path.join(target_site.remote_path, relative_path).replace('\\', '/')
+                fxp_tasks.append(make_fxp_task(task['remote_path'], remote_file_path, relative_path,
+                                               task['size'], task['require_content']))
+            with target_client.batch():
+                target_client._create_parent_directories(task['target_path'] for task in fxp_tasks)
+                transfer_result = fxp_parallel(source_client, target_client, fxp_tasks, max_workers)
+            if transfer_result is not None:
+                log_messages.append(f"Server-to-server transfer (FXP) from {source_site.host} to {target_site.host}")
+        
+        if transfer_result is None:
+            if not relay:
+                return None
+            relay_tasks = []
+            for task in tasks:
+                relative_path = task['local_path']
+                remote_file_path = os.path.join(target_site.remote_path, relative_path).replace('\\', '/')
+                relay_tasks.append(make_relay_task(task['remote_path'], remote_file_path, relative_path,
+                                                   task['require_content'], task.get('size')))
+            transfer_result = relay_parallel(source_client, target_client, relay_tasks, max_workers)
+            if transfer_result is None:
+                return None
+    
+    log_messages.extend(transfer_result['log'])
+    copied = {task['source_path']: task['checksum'] for task in transfer_result['completed']}
+    return _job_result(transfer_result, log_messages, manifest,
+                       (dict(task, checksum=copied[task['remote_path']]) for task in tasks
+                        if task['remote_path'] in copied))
+
 def execute_local_folder_upload(job, job_log, target_site):
     """Execute upload from local folders (automatic monthly folders)"""
     try:
-        # Get target site password
-        target_password = decrypt_password(target_site.password_encrypted)
-        
-        # Build target client parameters with NFS support
-        target_kwargs = {}
-        if target_site.protocol == 'nfs':
-            target_kwargs.update({
-                'nfs_export_path': target_site.nfs_export_path or '/',
-                'nfs_version': target_site.nfs_version or '4',
-                'nfs_mount_options': target_site.nfs_mount_options or '',
-                'nfs_auth_method': target_site.nfs_auth_method or 'sys'
-            })
-        
         # Create target client
-        target_client = FTPClient(target_site.protocol, target_site.host, target_site.port, target_site.username, target_password, **target_kwargs)
+        target_client = create_site_client(target_site, job=job)
+        manifest = SyncManifest.load(job.id) if job.incremental_sync else None
         
         # Test connection first
         connection_test = target_client.test_connection()
@@ -624,15 +776,25 @@ def execute_local_folder_upload(job, job_log, target_site):
         import time
         time.sleep(0.1)  # Small delay to ensure filesystem consistency
         
-        # Check if folder has files
+        # Check if folder has files, planning the uploads on the way
         file_count = 0
-        file_paths = []
+        upload_tasks = []
         for root, dirs, files in os.walk(local_folder):
             for file in files:
+                if in_progress(file):
+                    # A download into this folder is still writing it
+                    continue
                 file_count += 1
-                file_paths.append(os.path.join(root, file))
-                if len(file_paths) <= 5:  # Log first 5 files for debugging
-                    log_messages.append(f"Found file: {os.path.join(root, file)}")
+                local_file_path = os.path.join(root, file)
+                relative_path = os.path.relpath(local_file_path, local_folder)
+                if file_count <= 5:  # Log first 5 files for debugging
+                    log_messages.append(f"Found file: {local_file_path}")
+                
+                # Upload files to root directory only - don't recreate nested folder structure
+                remote_file_path = os.path.join(target_site.remote_path, file).replace('\\', '/')
+                stat = os.stat(local_file_path)
+                upload_tasks.append(make_upload_task(local_file_path, remote_file_path, f"{file} (from {relative_path})",
+                                                     stat.st_size, datetime.fromtimestamp(stat.st_mtime).isoformat()))
         
         log_messages.append(f"Total files found: {file_count}")
         
@@ -643,36 +805,17 @@ def execute_local_folder_upload(job, job_log, target_site):
                 'log': '\n'.join(log_messages)
             }
         
-        # Upload files from local folder
-        files_processed = 0
-        bytes_transferred = 0
-        
         log_messages.append(f"Uploading from local folder: {local_folder}")
         
-        # Upload all files from local folder (flatten structure - upload only filenames)
-        for root, dirs, files in os.walk(local_folder):
-            for file in files:
-                local_file_path = os.path.join(root, file)
-                relative_path = os.path.relpath(local_file_path, local_folder)
-                
-                # Upload files to root directory only - don't recreate nested folder structure
-                remote_file_path = os.path.join(target_site.remote_path, file).replace('\\', '/')
-                
-                upload_result = target_client.upload_file(local_file_path, remote_file_path)
-                
-                if upload_result['success']:
-                    files_processed += 1
-                    bytes_transferred += os.path.getsize(local_file_path)
-                    log_messages.append(f"Uploaded: {file} (from {relative_path})")
-                else:
-                    log_messages.append(f"Failed to upload: {file} (from {relative_path}) - {upload_result.get('error', 'Unknown error')}")
+        if manifest is not None:
+            upload_tasks = list(manifest.pending(upload_tasks, key='local_path'))
         
-        return {
-            'success': True,
-            'files_processed': files_processed,
-            'bytes_transferred': bytes_transferred,
-            'log': '\n'.join(log_messages)
-        }
+        # Files with the same name in different subfolders land on the same remote path;
+        # the engine uploads those one after another, so the last one wins as before
+        upload_result = target_client.upload_many(upload_tasks)
+        log_messages.extend(upload_result['log'])
+        
+        return _job_result(upload_result, log_messages, manifest, key='local_path')
         
     except Exception as e:
         logger.error(f"Error in local folder upload job: {str(e)}")
@@ -789,3 +932,4 @@ def reschedule_existing_jobs():
 
 # Schedule existing jobs on startup
 reschedule_existing_jobs()
+apply_site_limits()
@@ -0,0 +1,107 @@
+"""
+Segmented download of single large files.
+
+A file above the site's segment threshold is split into byte ranges that are
+fetched over several sessions at once (FTP REST + RETR, SFTP offset reads)
+and written at their offsets into a preallocated '.part' file. Finished ranges
+are recorded, so a retried download only fetches the bytes still missing.
+"""
+import logging
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEGMENT_THRESHOLD_MB = 100  # files at least this large are segmented; 0 disables
+MIN_SEGMENT_SIZE = 16 * 1024 * 1024  # never split into ranges smaller than this
+
+
+def split_ranges(file_size, segments):
+    """Split file_size bytes into at most segments (offset, length) ranges"""
+    segments = max(1, min(segments, -(-file_size // MIN_SEGMENT_SIZE)))
+    base = file_size // segments
+    ranges = []
+    offset = 0
+    for index in range(segments):
+        length = base if index < segments - 1 else file_size - offset
+        ranges.append((offset, length))
+        offset += length
+    return ranges
+
+
+def preallocate_file(local_path, file_size):
+    """Create local_path with file_size bytes reserved so ranges can be written in any order"""
+    with open(local_path, 'wb') as local_file:
+        if file_size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(local_file.fileno(), 0, file_size)
+                return
+            except OSError:
+                # Some network filesystems do not support fallocate
+                pass
+        local_file.truncate(file_size)
+
+
+def missing_ranges(file_size, ranges_done):
+    """The (offset, length) gaps of file_size not covered by ranges_done"""
+    missing = []
+    position = 0
+    for offset, length in sorted(ranges_done):
+        if offset > position:
+            missing.append((position, offset - position))
+        position = max(position, offset + length)
+    if position < file_size:
+        missing.append((position, file_size - position))
+    return missing
+
+
+def download_segmented(client, remote_path, partial, segments):
+    """Download remote_path into partial (a resumable.PartialDownload) over up to segments sessions
+
+    The calling client fetches ranges itself; the extra sessions only use free
+    slots of the site's connection limit and are skipped when none is free.
+    """
+    remote_size = partial.remote_size
+    local_path = partial.path
+    if partial.resumed:
+        ranges = [(gap_offset + offset, length)
+                  for gap_offset, gap_length in missing_ranges(remote_size, partial.ranges_done)
+                  for offset, length in split_ranges(gap_length, segments)]
+    else:
+        ranges = split_ranges(remote_size, segments)
+        preallocate_file(local_path, remote_size)
+
+    pending = queue.Queue()
+    for byte_range in ranges:
+        pending.put(byte_range)
+    errors = []
+
+    def run_worker(worker, lease_timeout):
+        with worker.batch():
+            if not worker.connect(lease_timeout=lease_timeout):
+                return
+            while not errors:
+                try:
+                    offset, length = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    worker._with_reconnect(worker._fetch_range, remote_path, local_path, offset, length)
+                    partial.mark_range_done(offset, length)
+                except Exception as e:
+                    errors.append(f"bytes {offset}-{offset + length - 1}: {str(e)}")
+
+    if ranges:
+        workers = [(client, None)] + [(client.clone(), 0) for _ in range(min(len(ranges), segments) - 1)]
+        logger.debug(f"Downloading {remote_path} ({remote_size} bytes) in {len(ranges)} segments")
+        with ThreadPoolExecutor(max_workers=len(workers), thread_name_prefix='segment') as executor:
+            list(executor.map(lambda args: run_worker(*args), workers))
+
+    if errors:
+        raise IOError(f"Segmented download failed at {errors[0]}")
+    if not pending.empty():
+        raise ConnectionError('Connection failed')
+    if missing_ranges(remote_size, partial.ranges_done):
+        raise IOError(f"Segmented download of {remote_path} is incomplete")
+    return remote_size
@@ -0,0 +1,125 @@
+"""
+Pipelined SFTP transfers.
+
+A plain SFTP read waits one round trip per block, so on a high-latency link
+throughput is capped at block_size / RTT however fast the link is. These
+helpers keep a window of read requests in flight (prefetch) and send writes
+without waiting for each acknowledgement, with a configurable block size.
+"""
+import logging
+import os
+
+from local_writes import open_part
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = 32768  # largest read every SFTP server accepts
+# OpenSSH serves reads up to 255 KiB; a server that returns shorter reads than
+# requested makes paramiko fall back to one request at a time for the rest of the file
+MAX_BLOCK_SIZE = 261120
+DEFAULT_PREFETCH_WINDOW = 64  # outstanding read requests per file
+
+
+def normalize_block_size(block_size):
+    """Clamp a configured block size to what SFTP servers accept"""
+    try:
+        block_size = int(block_size or DEFAULT_BLOCK_SIZE)
+    except (TypeError, ValueError):
+        return DEFAULT_BLOCK_SIZE
+    return max(4096, min(block_size, MAX_BLOCK_SIZE))
+
+
+def pipelined_read(sftp, remote_path, callback, block_size=DEFAULT_BLOCK_SIZE,
+                   window=DEFAULT_PREFETCH_WINDOW, offset=0):
+    """Pass remote_path to callback in block_size chunks, keeping up to window read requests in flight"""
+    block_size = normalize_block_size(block_size)
+    transferred = offset
+
+    with sftp.open(remote_path, 'rb', bufsize=block_size) as remote_file:
+        file_size = remote_file.stat().st_size
+        # paramiko splits prefetch and read requests at MAX_REQUEST_SIZE
+        remote_file.MAX_REQUEST_SIZE = block_size
+        if offset:
+            remote_file.seek(offset)
+        # prefetch starts at the current position
+        remote_file.prefetch(file_size, max_concurrent_requests=max(1, int(window or 1)))
+
+        while True:
+            data = remote_file.read(block_size)
+            if not data:
+                break
+            callback(data)
+            transferred += len(data)
+
+    if transferred != file_size:
+        raise IOError(f"Short download of {remote_path}: got {transferred} of {file_size} bytes")
+    return transferred
+
+
+def pipelined_get(sftp, remote_path, local_path, block_size=DEFAULT_BLOCK_SIZE,
+                  window=DEFAULT_PREFETCH_WINDOW, offset=0, hasher=None, throttle=None, size=None):
+    """Download remote_path keeping up to window read requests of block_size in flight
+
+    With offset the first offset bytes are already in local_path and the rest is appended.
+    hasher (a checksums.StreamHasher) sees every block as it is written, and
+    throttle (a bandwidth.Throttle) paces the writes. size, when known,
+    reserves the file's space up front (see local_writes.open_part).
+    """
+    with open_part(local_path, offset, size) as local_file:
+        write = hasher.wrap(local_file.write) if hasher is not None else local_file.write
+        if throttle is not None:
+            write = throttle.wrap(write)
+        return pipelined_read(sftp, remote_path, write, block_size, window, offset)
+
+
+def pipelined_put(sftp, local_path, remote_path, block_size=DEFAULT_BLOCK_SIZE, offset=0, hasher=None,
+                  throttle=None):
+    """Upload local_path in block_size writes without waiting for each acknowledgement
+
+    With offset the server already has the first offset bytes and only the rest is written.
+    hasher (a checksums.StreamHasher) sees every block as it is read, and
+    throttle (a bandwidth.Throttle) paces the writes.
+    """
+    block_size = normalize_block_size(block_size)
+    file_size = os.path.getsize(local_path)
+    transferred = 0
+
+    with open(local_path, 'rb') as local_file:
+        # 'r+' keeps the bytes already uploaded, 'w' starts over
+        with sftp.open(remote_path, 'r+b' if offset else 'wb', bufsize=block_size) as remote_file:
+            remote_file.MAX_REQUEST_SIZE = block_size
+            if offset:
+                local_file.seek(offset)
+                remote_file.seek(offset)
+            # paramiko collects the acknowledgements when the window fills up and on close
+            remote_file.set_pipelined(True)
+            while True:
+                data = local_file.read(block_size)
+                if not data:
+                    break
+                if hasher is not None:
+                    hasher.update(data)
+                if throttle is not None:
+                    throttle.consume(len(data))
+                remote_file.write(data)
+                transferred += len(data)
+
+    remote_size = sftp.stat(remote_path).st_size
+    if remote_size != file_size:
+        raise IOError(f"Short upload of {remote_path}: server has {remote_size} of {file_size} bytes")
+    return transferred
+
+
+def pipelined_write(sftp, remote_path, chunks, block_size=DEFAULT_BLOCK_SIZE):
+    """Write the byte strings from chunks to remote_path without waiting for each acknowledgement"""
+    block_size = normalize_block_size(block_size)
+    transferred = 0
+
+    with sftp.open(remote_path, 'wb', bufsize=block_size) as remote_file:
+        remote_file.MAX_REQUEST_SIZE = block_size
+        remote_file.set_pipelined(True)
+        for data in chunks:
+            remote_file.write(data)
+            transferred += len(data)
+
+    return transferred
@@ -14,6 +14,9 @@ function initializeSitesPage() {
     // Initialize test connection handlers
     initializeTestHandlers();
     
+    // Initialize compression probe and tuning handlers
+    initializeProbeHandlers();
+    
     // Initialize delete confirmations
     initializeDeleteConfirmations();
     
@@ -218,6 +221,66 @@ function testConnection(siteId, button) {
         });
 }
 
+function initializeProbeHandlers() {
+    // Compression probe and block size tuning
+    const probeButtons = document.querySelectorAll('.site-probe');
+    
+    probeButtons.forEach(button => {
+        button.addEventListener('click', function(e) {
+            e.preventDefault();
+            
+            runSiteProbe(this.dataset.url, this);
+        });
+    });
+}
+
+function runSiteProbe(url, button) {
+    const originalHtml = button.innerHTML;
+    const headers = {};
+    
+    // Add CSRF token if available
+    const csrfToken = document.querySelector('meta[name="csrf-token"]');
+    if (csrfToken) {
+        headers['X-CSRFToken'] = csrfToken.content;
+    }
+    
+    // Show loading state; probes download a sample file several times
+    button.innerHTML = '<span class="loading-spinner"></span>';
+    button.classList.add('disabled');
+    
+    // Probes change the site's settings, so they are POSTed
+    fetch(url, { method: 'POST', headers: headers })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success && data.status_url) {
+                // Started in the background; report once it has finished
+                showAlert(data.message, 'info');
+                return waitForSiteProbe(data.status_url);
+            }
+            showAlert(data.message, data.success ? 'success' : 'danger');
+        })
+        .catch(error => {
+            console.error('Error probing site:', error);
+            showAlert('Error probing site. Please try again.', 'danger');
+        })
+        .finally(() => {
+            button.innerHTML = originalHtml;
+            button.classList.remove('disabled');
+        });
+}
+
+function waitForSiteProbe(statusUrl) {
+    return new Promise(resolve => setTimeout(resolve, 5000))
+        .then(() => fetch(statusUrl))
+        .then(response => response.json())
+        .then(data => {
+            if (data.running) {
+                return waitForSiteProbe(statusUrl);
+            }
+            showAlert(data.message, data.success ? 'success' : 'danger');
+        });
+}
+
 function initializeDeleteConfirmations() {
     const deleteButtons = document.querySelectorAll('.delete-site');
     
@@ -0,0 +1,84 @@
+"""
+Per-job record of transferred files, for incremental sync.
+
+A job with incremental sync enabled loads its manifest before it runs: one
+entry per source file it transferred before, with the size and modification
+time the listing showed at that time. Planned tasks whose source file still
+has the same size and modification time are dropped before any transfer
+starts, and files that transfer successfully are recorded afterwards, so the
+next run only fetches new or changed files. A file with no known size or
+modification time is always transferred.
+
+Tasks are the dicts from transfer_engine.make_task() / make_upload_task();
+downloads and relays key the manifest on the source's remote path, local
+folder uploads on the local path.
+"""
+import logging
+from datetime import datetime
+
+from app import db
+from models import SyncManifestEntry
+
+logger = logging.getLogger(__name__)
+
+
+class SyncManifest:
+    """The transferred files of one job, loaded once per run and saved at its end"""
+
+    def __init__(self, job_id, entries=()):
+        self.job_id = job_id
+        self._entries = {entry.path: entry for entry in entries}
+        self.skipped = 0  # unchanged files left out this run
+        self.recorded = 0  # files recorded as transferred this run
+
+    @classmethod
+    def load(cls, job_id):
+        return cls(job_id, SyncManifestEntry.query.filter_by(job_id=job_id).all())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def unchanged(self, path, size, modify):
+        """True if path was transferred before with this size and modification time"""
+        entry = self._entries.get(path)
+        if entry is None or size is None or not modify:
+            return False
+        return entry.size == size and entry.modify == modify
+
+    def pending(self, tasks, key='remote_path'):
+        """Yield the tasks whose source file is new or changed, counting the others in skipped"""
+        for task in tasks:
+            if self.unchanged(task[key], task.get('size'), task.get('modify')):
+                self.skipped += 1
+                continue
+            yield task
+
+    def record(self, tasks, key='remote_path'):
+        """Remember tasks as transferred with their listed size and modification time"""
+        for task in tasks:
+            path = task[key]
+            entry = self._entries.get(path)
+            if entry is None:
+                entry = SyncManifestEntry(job_id=self.job_id, path=path)
+                db.session.add(entry)
+                self._entries[path] = entry
+            entry.size = task.get('size')
+            entry.modify = task.get('modify') or None
+            entry.checksum = task.get('checksum')
+            entry.transferred_at = datetime.utcnow()
+            self.recorded += 1
+
+    def summary(self):
+        """Job log line for this run"""
+        return f"Incremental sync: {self.skipped} unchanged files skipped, {self.recorded} files recorded"
+
+    def save(self):
+        """Commit the entries recorded this run"""
+        if self.recorded:
+            db.session.commit()
+            logger.debug(f"Saved {self.recorded} sync manifest entries for job {self.job_id}")
+
+    @staticmethod
+    def clear(job_id):
+        """Forget everything a job transferred, so its next run transfers all files again"""
+        SyncManifestEntry.query.filter_by(job_id=job_id).delete()
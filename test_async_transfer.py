@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Async downloads over pooled sessions against a local FTP server
+"""
+import os
+
+from async_transfer import download_tasks
+from transfer_engine import make_task
+
+
+def test_pooled_session_is_reused_by_blocking_client_after_async_downloads(ftp_server, tmp_path):
+    names = ['a.csv', 'b.csv']
+    for name in names:
+        with open(os.path.join(ftp_server.root, name), 'wb') as f:
+            f.write(name.encode() * 1000)
+    client = ftp_server.client()
+
+    tasks, results, _ = download_tasks(client, [make_task(f'/{name}', str(tmp_path / name)) for name in names])
+    assert all(result['success'] for result in results)
+
+    # The session the loop drove is back with ftplib, timeout and all
+    assert client.connect()
+    assert client.connection.sock.gettimeout() == 30
+    assert sorted(f['name'] for f in client.list_files('/')['files']) == names
+    assert client.download_file('/b.csv', str(tmp_path / 'again.csv'))['success']
+    assert (tmp_path / 'again.csv').read_bytes() == b'b.csv' * 1000
+    client.disconnect()
+    assert ftp_server.logins == 1
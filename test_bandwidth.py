@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Token buckets, throttles and bandwidth schedules
+"""
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from bandwidth import BYTES_PER_MBIT, Throttle, TokenBucket, parse_limit, parse_schedule
+
+CHUNK = 16 * 1024
+
+
+def _bucket(mbps, schedule=None):
+    bucket = TokenBucket('test')
+    bucket.configure(mbps * BYTES_PER_MBIT if mbps else None, parse_schedule(schedule))
+    return bucket
+
+
+def _send(throttle, size):
+    for _ in range(size // CHUNK):
+        throttle.consume(CHUNK)
+
+
+def test_parse_schedule():
+    assert parse_schedule('# nights\n01:00-05:00 unlimited\n\n22:30 - 02:00 2.5\n') == [
+        (60, 300, None), (22 * 60 + 30, 120, 2.5 * BYTES_PER_MBIT)]
+    for text in ('01:00-05:00', '25:00-26:00 5', '01:00-02:00 0', '01:00-02:00 fast'):
+        with pytest.raises(ValueError):
+            parse_schedule(text)
+    assert parse_limit('') is None and parse_limit('0') is None and parse_limit('2.5') == 2.5
+
+
+def test_schedule_windows_override_the_base_limit():
+    bucket = _bucket(10, '08:00-18:00 2\n22:00-06:00 unlimited')
+
+    assert bucket.limit(datetime(2026, 10, 17, 12, 0)) == 2 * BYTES_PER_MBIT
+    assert bucket.limit(datetime(2026, 10, 17, 23, 0)) is None
+    assert bucket.limit(datetime(2026, 10, 17, 3, 0)) is None
+    assert bucket.limit(datetime(2026, 10, 17, 19, 0)) == 10 * BYTES_PER_MBIT
+    assert _bucket(None, '08:00-18:00 2').limited and not _bucket(None).limited
+
+
+def test_bucket_goes_into_debt_and_tells_how_long_to_wait():
+    bucket = _bucket(8)  # 1 MB/s
+
+    assert bucket.take(1000000) == pytest.approx(1.0, abs=0.05)
+    assert _bucket(None).take(10 ** 9) == 0.0
+
+
+def test_throttle_holds_a_transfer_to_the_limit():
+    throttle = Throttle([_bucket(16)])  # 2 MB/s
+
+    started = time.monotonic()
+    _send(throttle, 1024 * 1024)
+
+    assert 0.4 <= time.monotonic() - started < 1.5
+
+
+def test_parallel_transfers_share_the_limit():
+    throttle = Throttle([_bucket(16)])
+    threads = [threading.Thread(target=_send, args=(throttle, 512 * 1024)) for _ in range(4)]
+
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 2 MB at 2 MB/s, not four times 512 KB at the full rate each
+    assert 0.8 <= time.monotonic() - started < 2.5
+
+
+def test_lowest_bucket_wins_and_rates_are_metered():
+    fast, slow = _bucket(None), _bucket(16)
+    throttle = Throttle([fast, slow])
+
+    started = time.monotonic()
+    _send(throttle, 1024 * 1024)
+
+    assert time.monotonic() - started >= 0.4
+    assert fast.status()['rate'] > 0 and fast.status()['limit'] is None
+    assert slow.status()['limit'] == 16 * BYTES_PER_MBIT
+
+
+def test_empty_throttle_leaves_writes_alone():
+    def write(data):
+        return len(data)
+
+    throttle = Throttle([])
+    assert not throttle and throttle.wrap(write) is write
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+The mount capability registry
+"""
+import threading
+
+import capabilities
+from capabilities import Capabilities
+
+
+def _probes(monkeypatch, helpers=('mount.nfs4', 'showmount'), sudo=True):
+    calls = {'sudo': 0, 'which': 0}
+
+    def find_helper(name):
+        calls['which'] += 1
+        return f'/usr/sbin/{name}' if name in helpers else None
+
+    def probe_sudo():
+        calls['sudo'] += 1
+        return sudo
+
+    monkeypatch.setattr(capabilities, '_find_helper', find_helper)
+    monkeypatch.setattr(capabilities, '_probe_sudo', probe_sudo)
+    return calls
+
+
+def test_probed_once_for_all_callers(monkeypatch):
+    calls = _probes(monkeypatch)
+    registry = Capabilities()
+
+    threads = [threading.Thread(target=registry.can_mount_nfs) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    registry.has_helper('showmount')
+    registry.snapshot()
+
+    assert calls == {'sudo': 1, 'which': len(capabilities.MOUNT_HELPERS)}
+
+
+def test_mounting_needs_a_helper_and_sudo(monkeypatch):
+    _probes(monkeypatch)
+    registry = Capabilities()
+    assert registry.can_mount_nfs() and not registry.can_mount_cifs()
+    assert registry.snapshot()['helpers']['mount.cifs'] is None
+
+    _probes(monkeypatch, sudo=False)
+    assert not Capabilities().can_mount_nfs()
+
+
+def test_refresh_probes_again(monkeypatch):
+    calls = _probes(monkeypatch, helpers=())
+    registry = Capabilities()
+    assert not registry.has_helper('mount.nfs4')
+
+    _probes(monkeypatch)
+    snapshot = registry.refresh()
+
+    assert snapshot['can_mount_nfs'] and registry.has_helper('mount.nfs4')
+    assert calls['sudo'] == 1
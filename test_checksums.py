@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Checksum sidecars, parsed and checked on downloads from a local FTP server
+"""
+import hashlib
+import os
+
+from checksums import parse_sidecar, sidecars_for
+
+DIGEST = hashlib.sha256(b'x').hexdigest()
+
+
+def test_parse_sidecar_formats():
+    assert parse_sidecar(f'{DIGEST}  data.csv\n'.encode()) == DIGEST
+    assert parse_sidecar(f'SHA256 (data.csv) = {DIGEST.upper()}\n'.encode()) == DIGEST
+    assert parse_sidecar(b'not a checksum\n') is None
+
+
+def test_sidecars_for_lists_only_present_files():
+    names = {'data.csv', 'data.csv.sha256', 'data.csv.md5', 'other.csv'}
+    assert sidecars_for('/in/data.csv', names) == {'sha256': '/in/data.csv.sha256', 'md5': '/in/data.csv.md5'}
+    assert sidecars_for('/in/other.csv', names) is None
+
+
+def _remote_file_with_sidecar(server, sidecar_data):
+    data = os.urandom(50000)
+    with open(os.path.join(server.root, 'data.csv'), 'wb') as f:
+        f.write(data)
+    with open(os.path.join(server.root, 'data.csv.sha256'), 'wb') as f:
+        f.write(sidecar_data(data))
+    return data
+
+
+def test_download_matching_sidecar_is_verified(ftp_server, tmp_path):
+    _remote_file_with_sidecar(ftp_server, lambda data: f'{hashlib.sha256(data).hexdigest()}  data.csv\n'.encode())
+    local_path = str(tmp_path / 'data.csv')
+
+    result = ftp_server.client().download_file('/data.csv', local_path, sidecars={'sha256': '/data.csv.sha256'})
+
+    assert result['success'] and result['verified']
+    assert result['checksum'].startswith('sha256:')
+
+
+def test_download_mismatching_sidecar_fails_and_removes_file(ftp_server, tmp_path):
+    _remote_file_with_sidecar(ftp_server, lambda data: f'{DIGEST}  data.csv\n'.encode())
+    local_path = str(tmp_path / 'data.csv')
+
+    result = ftp_server.client().download_file('/data.csv', local_path, sidecars={'sha256': '/data.csv.sha256'})
+
+    assert not result['success'] and 'Checksum mismatch' in result['error']
+    assert not os.path.exists(local_path)
+
+
+def test_unreadable_sidecar_leaves_download_unverified(ftp_server, tmp_path):
+    _remote_file_with_sidecar(ftp_server, lambda data: b'pending\n')
+    local_path = str(tmp_path / 'data.csv')
+
+    result = ftp_server.client().download_file('/data.csv', local_path, sidecars={'sha256': '/data.csv.sha256'})
+
+    assert result['success'] and not result['verified']
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+MODE Z transfers and when 'auto' sites are probed
+"""
+import io
+import os
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from compression import (PROBE_FAILED, PROBE_MAX_AGE, PROBE_RETRY_AGE, needs_probe, retrieve_compressed,
+                         store_compressed)
+
+
+class FakeDataConnection:
+    def __init__(self, incoming=b''):
+        self.incoming = io.BytesIO(incoming)
+        self.sent = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def recv(self, size):
+        return self.incoming.read(size)
+
+    def sendall(self, data):
+        self.sent += data
+
+
+class FakeFTP:
+    """Just enough of ftplib.FTP for one data transfer"""
+
+    def __init__(self, incoming=b''):
+        self.commands = []
+        self.data = FakeDataConnection(incoming)
+
+    def voidcmd(self, command):
+        self.commands.append(command)
+
+    def transfercmd(self, command):
+        self.commands.append(command)
+        return self.data
+
+    def voidresp(self):
+        return '226 Transfer complete'
+
+
+def test_mode_z_round_trip():
+    data = b''.join(b'20261017,1000,+4930123456,+4940654321,%d\n' % index for index in range(20000)) + os.urandom(5000)
+    upload = FakeFTP()
+
+    store_compressed(upload, 'STOR cdr.csv', io.BytesIO(data), 8192)
+
+    assert len(upload.data.sent) < len(data) // 5
+    download = FakeFTP(bytes(upload.data.sent))
+    received = bytearray()
+    retrieve_compressed(download, 'RETR cdr.csv', received.extend, 1000)
+    assert bytes(received) == data
+    # Both sessions are back in stream mode afterwards
+    for ftp in (upload, download):
+        assert ftp.commands[1] == 'MODE Z' and ftp.commands[-1] == 'MODE S'
+
+
+def _site(**kwargs):
+    fields = {'protocol': 'ftp', 'compression': 'auto', 'compression_probed_at': None, 'compression_probe': None}
+    fields.update(kwargs)
+    return SimpleNamespace(**fields)
+
+
+def test_needs_probe():
+    now = datetime.utcnow()
+    assert needs_probe(_site())
+    assert not needs_probe(_site(compression='off'))
+    assert not needs_probe(_site(compression='on'))
+    assert not needs_probe(_site(protocol='nfs'))
+    # A successful probe holds for PROBE_MAX_AGE
+    assert not needs_probe(_site(compression_probed_at=now - PROBE_RETRY_AGE * 2, compression_probe='compression on'))
+    assert needs_probe(_site(compression_probed_at=now - PROBE_MAX_AGE, compression_probe='compression on'))
+    # ... a failed one only for PROBE_RETRY_AGE
+    failed = f'{PROBE_FAILED} timed out'
+    assert not needs_probe(_site(compression_probed_at=now - timedelta(hours=1), compression_probe=failed))
+    assert needs_probe(_site(compression_probed_at=now - PROBE_RETRY_AGE, compression_probe=failed))
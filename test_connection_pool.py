@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Session pooling against a local FTP server
+"""
+from connection_pool import connection_pool, describe_pool_key
+
+
+def _pool_stats(client):
+    return connection_pool.stats().get(describe_pool_key(client.pool_key), {'idle': 0, 'leased': 0})
+
+
+def test_sessions_are_reused_across_clients(ftp_server):
+    for _ in range(3):
+        client = ftp_server.client()
+        assert client.list_files('/')['files'] == []
+
+    assert ftp_server.logins == 1
+    assert _pool_stats(client)['idle'] == 1
+
+
+def test_limit_is_held_across_clients(ftp_server):
+    first, second = ftp_server.client(max_connections=1), ftp_server.client(max_connections=1)
+
+    with first.batch():
+        assert first.connect()
+        assert not second.connect(lease_timeout=0)
+    assert second.connect(lease_timeout=0)
+    second.disconnect()
+    assert ftp_server.logins == 1
+
+
+def test_client_does_not_change_the_site_limit(ftp_server):
+    site_client = ftp_server.client(max_connections=1)
+    from ftp_client import FTPClient
+    FTPClient('ftp', '127.0.0.1', ftp_server.port, 'user', 'secret', max_connections=8)
+    assert connection_pool.limit(site_client.pool_key) == 1
+
+
+def test_close_site_closes_idle_and_returning_sessions(ftp_server):
+    idle, leased = ftp_server.client(), ftp_server.client()
+    with idle.batch(), leased.batch():
+        assert idle.connect() and leased.connect()
+    with leased.batch():
+        assert leased.connect()
+        connection_pool.close_site(idle.pool_key)
+        assert _pool_stats(idle)['idle'] == 0
+    # The session leased across close_site() is not pooled again
+    assert _pool_stats(leased) == {'idle': 0, 'leased': 0, 'limit': _pool_stats(leased)['limit']}
+
+    ftp_server.client().list_files('/')
+    assert ftp_server.logins == 3
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Kernel copy methods of file_copy and their fallbacks
+"""
+import errno
+import hashlib
+import os
+
+import pytest
+
+import file_copy
+from checksums import StreamHasher
+from file_copy import copy_file
+
+SIZE = 3 * 1024 * 1024 + 123
+
+
+@pytest.fixture(autouse=True)
+def fresh_method_cache(monkeypatch):
+    # Every test starts without methods remembered as unsupported
+    monkeypatch.setattr(file_copy, '_unsupported', set())
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'source.bin'
+    path.write_bytes(os.urandom(SIZE))
+    os.utime(path, (1700000000, 1700000000))
+    return path
+
+
+class RecordingThrottle:
+    limited = True
+
+    def __init__(self):
+        self.consumed = 0
+
+    def consume(self, count):
+        self.consumed += count
+
+
+def _check_copy(source, dest, hasher=None):
+    data = source.read_bytes()
+    assert dest.read_bytes() == data
+    assert os.stat(dest).st_mtime == 1700000000
+    if hasher is not None:
+        assert hasher.hexdigest('sha256') == hashlib.sha256(data).hexdigest()
+
+
+@pytest.mark.parametrize('method', ['copy_file_range', 'sendfile', 'read/write'])
+def test_each_method_copies_and_hashes(source, tmp_path, method):
+    if method != 'read/write' and not file_copy._supported(method, (0, 0)):
+        pytest.skip(f'{method} is not available here')
+    dest = tmp_path / 'dest.bin'
+    hasher = StreamHasher(['sha256'])
+    throttle = RecordingThrottle()
+
+    assert copy_file(str(source), str(dest), hasher, throttle, methods=(method, 'read/write')) == method
+
+    _check_copy(source, dest, hasher)
+    assert throttle.consumed == SIZE
+
+
+def test_unsupported_method_falls_back_at_offset(source, tmp_path, monkeypatch):
+    calls = []
+
+    def copy_file_range(source_fd, dest_fd, count, offset_src, offset_dst):
+        # Copies the first chunk, then refuses like a cross-filesystem pair
+        if offset_src:
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        calls.append(offset_src)
+        data = os.pread(source_fd, min(count, 1024 * 1024), offset_src)
+        return os.pwrite(dest_fd, data, offset_dst)
+
+    monkeypatch.setattr(os, 'copy_file_range', copy_file_range, raising=False)
+    dest = tmp_path / 'dest.bin'
+    hasher = StreamHasher(['sha256'])
+
+    method = copy_file(str(source), str(dest), hasher, RecordingThrottle(), methods=('copy_file_range', 'read/write'))
+
+    assert method == 'read/write' and calls == [0]
+    _check_copy(source, dest, hasher)
+
+    # The pair is not tried with copy_file_range again
+    copy_file(str(source), str(tmp_path / 'again.bin'), methods=('copy_file_range', 'read/write'))
+    assert calls == [0]
+
+
+def test_end_of_file_at_start_is_treated_as_unsupported(source, tmp_path, monkeypatch):
+    monkeypatch.setattr(os, 'copy_file_range', lambda *args: 0, raising=False)
+    dest = tmp_path / 'dest.bin'
+
+    assert copy_file(str(source), str(dest), methods=('copy_file_range', 'read/write')) == 'read/write'
+    _check_copy(source, dest)
+
+
+def test_other_errors_are_raised(source, tmp_path, monkeypatch):
+    def copy_file_range(*args):
+        raise OSError(errno.ENOSPC, 'No space left on device')
+
+    monkeypatch.setattr(os, 'copy_file_range', copy_file_range, raising=False)
+
+    with pytest.raises(OSError) as raised:
+        copy_file(str(source), str(tmp_path / 'dest.bin'), methods=('copy_file_range', 'read/write'))
+    assert raised.value.errno == errno.ENOSPC
+
+
+def test_empty_file(tmp_path):
+    source = tmp_path / 'empty'
+    source.write_bytes(b'')
+    dest = tmp_path / 'dest'
+
+    copy_file(str(source), str(dest))
+    assert dest.read_bytes() == b''
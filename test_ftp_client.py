@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Multi-file operations of FTPClient against a local FTP server
+"""
+import ftplib
+import os
+
+
+def _write(root, relative_path, data):
+    path = os.path.join(root, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_download_files_uses_one_session(ftp_server, tmp_path):
+    for index in range(5):
+        _write(ftp_server.root, f'in/cdr{index}.csv', b'x' * index)
+
+    result = ftp_server.client().download_files('/in', str(tmp_path))
+
+    assert result['success']
+    assert sorted(os.listdir(tmp_path)) == [f'cdr{index}.csv' for index in range(5)]
+    assert ftp_server.logins == 1
+
+
+def test_download_folder_uses_one_session_for_the_whole_tree(ftp_server, tmp_path):
+    _write(ftp_server.root, 'in/a.csv', b'a')
+    _write(ftp_server.root, 'in/2026/b.csv', b'b')
+    _write(ftp_server.root, 'in/2026/10/c.csv', b'c')
+
+    result = ftp_server.client().download_folder('/in', str(tmp_path))
+
+    assert result['success']
+    assert (tmp_path / '2026' / '10' / 'c.csv').read_bytes() == b'c'
+    assert ftp_server.logins == 1
+
+
+def test_batch_holds_the_session_between_calls(ftp_server):
+    client = ftp_server.client()
+    with client.batch():
+        client.list_files('/')
+        session = client._session
+        client.list_files('/')
+        assert client._session is session
+    assert client._session is None
+
+
+def test_list_files_sends_one_mlsd_per_directory(ftp_server):
+    for index in range(20):
+        _write(ftp_server.root, f'in/cdr{index:02}.csv', b'x' * index)
+    os.makedirs(os.path.join(ftp_server.root, 'in', 'archive'))
+
+    files = ftp_server.client().list_files('/in')['files']
+
+    assert ftp_server.commands.count('MLSD') == 1
+    assert 'LIST' not in ftp_server.commands and 'SIZE' not in ftp_server.commands
+    assert {f['name']: (f['type'], f['size']) for f in files}['cdr07.csv'] == ('file', 7)
+    assert {f['name']: f['type'] for f in files}['archive'] == 'directory'
+    assert all(len(f['modify']) == 14 for f in files)
+
+
+def test_list_files_falls_back_to_list_without_mlsd(ftp_server):
+    _write(ftp_server.root, 'in/cdr.csv', b'abc')
+    client = ftp_server.client()
+
+    def refuse_mlsd(*args, **kwargs):
+        raise ftplib.error_perm('502 Command not implemented')
+
+    with client.batch():
+        assert client.connect()
+        client.connection.mlsd = refuse_mlsd
+        files = client.list_files('/in')['files']
+        assert not client._mlsd_supported
+        client.list_files('/in')
+
+    assert [(f['name'], f['size']) for f in files] == [('cdr.csv', 3)]
+    assert ftp_server.commands.count('LIST') == 2
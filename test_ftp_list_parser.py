@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Parsing of Unix, MS-DOS and MLSD directory listings
+"""
+from datetime import date, datetime
+
+from ftp_list_parser import _stamp_times, entry_from_mlsd, parse_list, to_record
+
+
+def _epoch_day(year, month, day):
+    return (date(year, month, day) - date(1970, 1, 1)).days
+
+
+def test_unix_listing():
+    entries = parse_list([
+        'total 12',
+        'drwxr-xr-x   2 ftp ftp     4096 Jan  5  2025 .',
+        'drwxr-xr-x   5 ftp ftp     4096 Jan  5  2025 ..',
+        '-rw-r--r--   1 ftp ftp     1234 Mar 15  2025 cdr 2025.csv',
+        'drwxr-xr-x   2 ftp ftp     4096 Mar 15  2025 archive',
+        'lrwxrwxrwx   1 ftp ftp       11 Mar 15  2025 latest -> cdr 2025.csv',
+        'crw-rw----   1 root tty  4,  64 Mar 15  2025 ttyS0',
+        '-rw-r--r--   1 owner      77 Mar 15  2025 no-group.csv',
+    ])
+
+    assert [(e.name, e.type, e.size) for e in entries] == [
+        ('cdr 2025.csv', 'file', 1234), ('archive', 'directory', 4096), ('latest', 'link', 11),
+        ('ttyS0', 'file', 64), ('no-group.csv', 'file', 77)]
+    assert entries[0].mtime == datetime(2025, 3, 15)
+    assert to_record(entries[0]) == {'name': 'cdr 2025.csv', 'size': 1234, 'modify': '20250315000000',
+                                     'type': 'file'}
+
+
+def test_recent_unix_dates_take_the_year_from_today():
+    today = _epoch_day(2024, 1, 1)
+
+    assert _stamp_times('Jan 1 10:01', today)[0] == datetime(2024, 1, 1, 10, 1)
+    # Later than the day after tomorrow, so listed last year
+    assert _stamp_times('Dec 31 23:59', today)[0] == datetime(2023, 12, 31, 23, 59)
+    assert _stamp_times('Jan 2 08:00', today)[0] == datetime(2024, 1, 2, 8, 0)
+
+
+def test_dos_listing():
+    entries = parse_list([
+        '01-16-26  02:30PM       <DIR>          reports',
+        '01-16-26  02:30AM                 1234 cdr 1.csv',
+        '01-16-2026  14:30                   99 cdr2.csv',
+        '12-31-99  12:00PM                    5 old.csv',
+    ])
+
+    assert [(e.name, e.type, e.size) for e in entries] == [
+        ('reports', 'directory', 0), ('cdr 1.csv', 'file', 1234), ('cdr2.csv', 'file', 99), ('old.csv', 'file', 5)]
+    assert [e.mtime for e in entries] == [datetime(2026, 1, 16, 14, 30), datetime(2026, 1, 16, 2, 30),
+                                          datetime(2026, 1, 16, 14, 30), datetime(1999, 12, 31, 12, 0)]
+
+
+def test_dialect_is_remembered_per_site_and_mixed_lines_still_parse():
+    lines = ['01-16-26  02:30PM                 1 a.csv',
+             '-rw-r--r--   1 ftp ftp        2 Mar 15  2025 b.csv']
+
+    assert [e.name for e in parse_list(lines, 'dos-site')] == ['a.csv', 'b.csv']
+    assert [e.name for e in parse_list(lines[:1], 'dos-site')] == ['a.csv']
+
+
+def test_unparsable_lines_and_dates():
+    assert parse_list(['', 'garbage', '?']) == []
+    entry = parse_list(['-rw-r--r--   1 ftp ftp  1 Feb 30  2025 bad-date.csv'])[0]
+    assert entry.mtime is None and entry.modify == ''
+
+
+def test_mlsd_entries():
+    assert entry_from_mlsd('.', {'type': 'cdir'}) is None
+    assert entry_from_mlsd('..', {'type': 'pdir'}) is None
+
+    entry = entry_from_mlsd('cdr.csv', {'type': 'file', 'size': '42', 'modify': '20260116143000',
+                                        'unix.mode': '0644'})
+    assert (entry.name, entry.type, entry.size, entry.permissions) == ('cdr.csv', 'file', 42, '0644')
+    assert entry.mtime == datetime(2026, 1, 16, 14, 30)
+    assert entry_from_mlsd('in', {'type': 'dir'}).type == 'directory'
+    assert entry_from_mlsd('latest', {'type': 'OS.unix=slink:cdr.csv'}).type == 'link'
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+FXP (server-to-server) transfers between two local FTP servers
+"""
+import os
+import time
+
+from connection_pool import connection_pool, describe_pool_key
+from ftp_client import FTPClient
+from fxp_transfer import _fxp_task, fxp_parallel, make_fxp_task, probe_fxp
+
+
+def _write_files(root, count):
+    os.makedirs(os.path.join(root, 'src'), exist_ok=True)
+    contents = {}
+    for index in range(count):
+        name = f'f{index}.bin'
+        contents[name] = os.urandom(50000 + index * 1000)
+        with open(os.path.join(root, 'src', name), 'wb') as f:
+            f.write(contents[name])
+    return contents
+
+
+def _idle_sessions(client):
+    return connection_pool.stats().get(describe_pool_key(client.pool_key), {}).get('idle', 0)
+
+
+def test_probe_does_not_return_sessions_with_pending_port(make_ftp_server):
+    source_server, target_server = make_ftp_server(), make_ftp_server()
+    source, target = source_server.client(), target_server.client()
+
+    assert probe_fxp(source, target)
+
+    # Both sessions had a PASV listener / PORT pending, so they were closed
+    assert _idle_sessions(source) == 0
+    assert _idle_sessions(target) == 0
+    assert 'PASV' in source_server.commands and 'PORT' in target_server.commands
+
+
+def test_fxp_copies_files_between_servers(make_ftp_server):
+    source_server, target_server = make_ftp_server(), make_ftp_server()
+    contents = _write_files(source_server.root, 4)
+    os.makedirs(os.path.join(target_server.root, 'dst'))
+    source, target = source_server.client(max_connections=2), target_server.client(max_connections=2)
+    tasks = [make_fxp_task(f'/src/{name}', f'/dst/{name}', name, size=len(data)) for name, data in contents.items()]
+
+    assert probe_fxp(source, target)
+    result = fxp_parallel(source, target, tasks, 2)
+
+    assert result['files_processed'] == len(contents)
+    assert result['bytes_transferred'] == sum(len(data) for data in contents.values())
+    for name, data in contents.items():
+        with open(os.path.join(target_server.root, 'dst', name), 'rb') as f:
+            assert f.read() == data
+    # The target only ever connected to the source; this host opened no data connection to it
+    assert 'PASV' not in target_server.commands
+
+
+def test_fxp_within_one_session_site_falls_back(ftp_server):
+    contents = _write_files(ftp_server.root, 1)
+    source, target = ftp_server.client(max_connections=1), ftp_server.client(max_connections=1)
+    tasks = [make_fxp_task(f'/src/{name}', f'/dst/{name}', name) for name in contents]
+
+    start = time.monotonic()
+    assert not probe_fxp(source, target)
+    assert fxp_parallel(source, target, tasks, 4) is None
+    assert time.monotonic() - start < 5
+
+
+def _existing_target(server):
+    os.makedirs(os.path.join(server.root, 'dst'), exist_ok=True)
+    with open(os.path.join(server.root, 'dst', 'f0.bin'), 'wb') as f:
+        f.write(b'keep me')
+
+
+def _target_contents(server):
+    with open(os.path.join(server.root, 'dst', 'f0.bin'), 'rb') as f:
+        return f.read()
+
+
+def test_failed_source_connect_leaves_existing_target_file(make_ftp_server):
+    source_server, target_server = make_ftp_server(), make_ftp_server()
+    _write_files(source_server.root, 1)
+    _existing_target(target_server)
+    source = FTPClient('ftp', '127.0.0.1', source_server.port, 'user', 'wrong password')
+    task = make_fxp_task('/src/f0.bin', '/dst/f0.bin', 'f0.bin')
+
+    result = _fxp_task(source, target_server.client(), task)
+
+    assert not result['success']
+    assert _target_contents(target_server) == b'keep me'
+    assert 'DELE' not in target_server.commands
+
+
+def test_refused_retr_leaves_existing_target_file(make_ftp_server):
+    source_server, target_server = make_ftp_server(), make_ftp_server()
+    _existing_target(target_server)
+    task = make_fxp_task('/src/missing.bin', '/dst/f0.bin', 'f0.bin')
+
+    result = _fxp_task(source_server.client(), target_server.client(), task)
+
+    assert not result['success']
+    assert 'DELE' not in target_server.commands
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Invalidation of cached browser listings
+"""
+import os
+
+from ftp_browser import FTPBrowser
+from listing_cache import ListingCache, listing_cache
+
+
+def test_invalidate_site_drops_only_that_site():
+    cache = ListingCache()
+    cache.put('a', '/in', {'files': []})
+    cache.put('a', '/out', {'files': []})
+    cache.put('b', '/in', {'files': []})
+
+    cache.invalidate_site('a')
+
+    assert cache.get('a', '/in') is None and cache.get('a', '/out') is None
+    assert cache.get('b', '/in') is not None
+
+
+def test_upload_drops_listing_of_target_directory(ftp_server, tmp_path):
+    client = ftp_server.client()
+    listing_cache.put(client.pool_key, '/', {'files': []})
+    local_path = tmp_path / 'new.csv'
+    local_path.write_bytes(b'a,b\n')
+
+    try:
+        assert client.upload_file(str(local_path), '/new.csv')['success']
+        assert listing_cache.get(client.pool_key, '/') is None
+    finally:
+        listing_cache.invalidate_site(client.pool_key)
+
+
+def test_relative_listing_is_dropped_by_write_below_non_root_home(make_ftp_server, tmp_path):
+    server = make_ftp_server(home='/data')
+    (tmp_path / 'new.csv').write_bytes(b'a,b\n')
+    os.makedirs(os.path.join(server.root, 'data', 'in'))
+    browser = FTPBrowser('ftp', '127.0.0.1', server.port, 'user', 'secret')
+
+    try:
+        assert browser.browse_directory('in')['items'] == []
+        assert listing_cache.get(browser.pool_key, '/data/in') is not None
+        assert server.client().upload_file(str(tmp_path / 'new.csv'), '/data/in/new.csv')['success']
+        assert listing_cache.get(browser.pool_key, 'in') is None
+
+        assert browser.browse_directory('in')['items']
+        assert server.client().upload_file(str(tmp_path / 'new.csv'), 'in/other.csv')['success']
+        assert listing_cache.get(browser.pool_key, '/data/in') is None
+    finally:
+        listing_cache.invalidate_site(browser.pool_key)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+fsync policies of downloads from a local FTP server
+"""
+import os
+
+import local_writes
+from local_writes import DEFAULT_FSYNC_POLICY, LocalWrites, open_part, reserve_space
+
+
+def _remote_file(server, name='f.bin'):
+    with open(os.path.join(server.root, name), 'wb') as f:
+        f.write(os.urandom(20000))
+    return f'/{name}'
+
+
+def test_download_outside_a_batch_is_synced(ftp_server, tmp_path):
+    local_writes = LocalWrites('batch')
+    client = ftp_server.client(local_writes=local_writes)
+
+    result = client.download_file(_remote_file(ftp_server), str(tmp_path / 'f.bin'))
+
+    assert result['success']
+    assert local_writes._pending == []
+
+
+def test_downloads_in_a_batch_wait_for_flush(ftp_server, tmp_path):
+    local_writes = LocalWrites('batch')
+    client = ftp_server.client(local_writes=local_writes)
+    local_path = str(tmp_path / 'f.bin')
+
+    with client.batch():
+        assert client.download_file(_remote_file(ftp_server), local_path)['success']
+        assert local_writes._pending == [local_path]
+    assert local_writes.flush() == 1
+    assert local_writes._pending == []
+
+
+def test_file_policy_syncs_before_the_rename(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(local_writes, '_fsync_file', lambda path: synced.append((path, os.path.exists(path))))
+    monkeypatch.setattr(local_writes, '_fsync_directory', lambda path: synced.append((path, True)))
+    part = tmp_path / 'f.bin.part'
+    part.write_bytes(b'data')
+
+    LocalWrites('file').commit(str(part), str(tmp_path / 'f.bin'))
+
+    assert synced == [(str(part), True), (str(tmp_path), True)]
+    assert (tmp_path / 'f.bin').read_bytes() == b'data' and not part.exists()
+
+
+def test_unknown_policy_falls_back_to_the_default():
+    assert LocalWrites('sometimes').fsync_policy == DEFAULT_FSYNC_POLICY
+    assert LocalWrites(' None ').fsync_policy == 'none'
+
+
+def test_part_space_is_reserved_without_changing_its_size(tmp_path):
+    path = str(tmp_path / 'f.bin.part')
+    with open_part(path, size=4 * 1024 * 1024) as part:
+        reserved = reserve_space(part, 4 * 1024 * 1024)
+        part.write(b'abc')
+    assert os.path.getsize(path) == 3
+    if reserved:
+        assert os.stat(path).st_blocks * 512 >= 4 * 1024 * 1024
+
+    with open_part(path, offset=3, size=6) as part:
+        part.write(b'def')
+    assert open(path, 'rb').read() == b'abcdef'
+
+
+def test_failed_download_leaves_the_existing_file_in_place(ftp_server, tmp_path):
+    local_path = tmp_path / 'f.bin'
+    local_path.write_bytes(b'previous version')
+    client = ftp_server.client()
+
+    # The listed size no longer matches what the server sends
+    result = client.download_file(_remote_file(ftp_server), str(local_path), remote_size=30000)
+
+    assert not result['success']
+    assert local_path.read_bytes() == b'previous version'
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Parsing and caching of the mount table
+"""
+import mount_table
+from mount_table import MountTable, parse_mountinfo
+
+MOUNTINFO = """\
+22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw,errors=remount-ro
+35 22 0:31 / /mnt/cdrs rw,nosuid shared:20 - nfs4 10.0.0.5:/export/cdrs rw,vers=4.2,addr=10.0.0.5
+36 22 0:32 / /mnt/share\\040one rw master:3 - cifs //files/share\\040one rw,uid=1000
+"""
+
+
+def test_parse_mountinfo():
+    mounts = parse_mountinfo(MOUNTINFO + 'garbage line\n')
+
+    assert set(mounts) == {'/', '/mnt/cdrs', '/mnt/share one'}
+    assert mounts['/mnt/cdrs'] == {'mount_id': 35, 'fstype': 'nfs4', 'source': '10.0.0.5:/export/cdrs',
+                                   'options': 'rw,nosuid,vers=4.2,addr=10.0.0.5'}
+    assert mounts['/mnt/share one']['source'] == '//files/share one'
+
+
+def test_parse_mountinfo_last_mount_wins():
+    mounts = parse_mountinfo(MOUNTINFO + '40 35 0:33 / /mnt/cdrs rw - tmpfs tmpfs rw\n')
+    assert mounts['/mnt/cdrs']['mount_id'] == 40 and mounts['/mnt/cdrs']['fstype'] == 'tmpfs'
+
+
+def _table(tmp_path, monkeypatch, text=MOUNTINFO):
+    # Without poll() the table is re-read on invalidate() or after REFRESH_INTERVAL
+    monkeypatch.setattr(mount_table, 'select', None)
+    path = tmp_path / 'mountinfo'
+    path.write_text(text)
+    return MountTable(str(path)), path
+
+
+def test_lookup_and_refresh(tmp_path, monkeypatch):
+    table, path = _table(tmp_path, monkeypatch)
+
+    assert table.is_mounted('/mnt/cdrs/')
+    assert not table.is_mounted('/mnt/other')
+
+    path.write_text(MOUNTINFO.replace('/mnt/cdrs', '/mnt/other'))
+    assert table.is_mounted('/mnt/cdrs')  # still the cached table
+    table.invalidate()
+    assert table.is_mounted('/mnt/other') and not table.is_mounted('/mnt/cdrs')
+
+
+def test_write_probe_is_cached_per_mount(tmp_path, monkeypatch):
+    table, path = _table(tmp_path, monkeypatch)
+    probes = []
+
+    def probe():
+        probes.append(1)
+        return True
+
+    assert table.probe_write('/mnt/cdrs', probe) and table.probe_write('/mnt/cdrs', probe)
+    assert len(probes) == 1
+
+    # A remount gets a new mount id, so it is probed again
+    path.write_text(MOUNTINFO.replace('35 22', '41 22'))
+    table.invalidate()
+    table.probe_write('/mnt/cdrs', probe)
+    assert len(probes) == 2
+
+    table.probe_write('/mnt/cdrs', probe, ttl=0)
+    assert len(probes) == 3
+
+
+def test_without_procfs_falls_back_to_ismount(tmp_path):
+    table = MountTable(str(tmp_path / 'missing'))
+
+    assert table.is_mounted('/')
+    assert not table.is_mounted(str(tmp_path))
+    assert table.mounts() == {}
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Verification of NFS mounts and scandir listings of the mounted tree
+"""
+import os
+
+import nfs_client
+from mount_table import MountTable
+from nfs_client import NFSClient
+
+
+def _client(tmp_path, monkeypatch, mounted):
+    mount_point = tmp_path / 'mnt'
+    mount_point.mkdir()
+    mountinfo = tmp_path / 'mountinfo'
+    mountinfo.write_text('22 1 8:1 / / rw - ext4 /dev/sda1 rw\n' +
+                         (f'35 22 0:31 / {mount_point} rw - nfs4 nfs:/export rw\n' if mounted else ''))
+    monkeypatch.setattr(nfs_client, 'mount_table', MountTable(str(mountinfo)))
+    client = NFSClient('nfs', '/export')
+    client.mount_point = str(mount_point)
+    return client
+
+
+def test_mounted_share_is_verified_by_mount_table(tmp_path, monkeypatch):
+    assert _client(tmp_path, monkeypatch, mounted=True)._verify_mount()
+
+
+def test_listable_directory_without_mount_fails_verification(tmp_path, monkeypatch):
+    assert not _client(tmp_path, monkeypatch, mounted=False)._verify_mount()
+
+
+def test_alternative_access_is_verified_by_listing(tmp_path, monkeypatch):
+    client = _client(tmp_path, monkeypatch, mounted=False)
+    client.alternative_access = True
+    assert client._verify_mount()
+
+
+def _nfs_tree(tmp_path):
+    client = NFSClient('nfs', '/export')
+    client.mount_point = str(tmp_path)
+    for path in ['a/x', 'a/y', 'b/z/deep']:
+        os.makedirs(tmp_path / path)
+    for path in ['top.csv', 'a/x/1.csv', 'b/z/deep/2.csv']:
+        (tmp_path / path).write_bytes(path.encode())
+    os.symlink(tmp_path / 'missing', tmp_path / 'dangling')
+    return client
+
+
+def test_list_files_uses_one_scandir_record_per_entry(tmp_path):
+    files = _nfs_tree(tmp_path).list_files('/')['files']
+
+    assert sorted((f['name'], f['type'], f['size']) for f in files) == [
+        ('a', 'directory', 0), ('b', 'directory', 0), ('top.csv', 'file', 7)]
+
+
+def test_walk_is_breadth_first_and_respects_max_depth(tmp_path):
+    client = _nfs_tree(tmp_path)
+
+    walked = list(client.walk('/'))
+    assert [d.depth for d in walked] == sorted(d.depth for d in walked)
+    assert {d.relative_path: [f['name'] for f in d.files] for d in walked} == {
+        '': ['top.csv'], 'a': [], 'b': [], 'a/x': ['1.csv'], 'a/y': [], 'b/z': [], 'b/z/deep': ['2.csv']}
+
+    shallow = list(client.walk('/', max_depth=1))
+    assert sorted(d.relative_path for d in shallow) == ['', 'a', 'b']
+    assert sorted(next(d for d in shallow if d.relative_path == 'b').folders) == ['z']
+
+
+def test_walk_reports_an_unreadable_directory(tmp_path):
+    walked = list(_nfs_tree(tmp_path).walk('/missing'))
+
+    assert len(walked) == 1 and walked[0].error
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Relay transfers between two local FTP servers
+"""
+import os
+import time
+
+from relay_transfer import make_relay_task, relay_parallel
+
+
+def _write_files(root, names):
+    os.makedirs(os.path.join(root, 'src'), exist_ok=True)
+    contents = {}
+    for index, name in enumerate(names):
+        contents[name] = os.urandom(100000 + index * 1000)
+        with open(os.path.join(root, 'src', name), 'wb') as f:
+            f.write(contents[name])
+    return contents
+
+
+def test_relay_copies_files_between_sites(make_ftp_server):
+    source_server, target_server = make_ftp_server(), make_ftp_server()
+    contents = _write_files(source_server.root, [f'f{i}.bin' for i in range(6)])
+    tasks = [make_relay_task(f'/src/{name}', f'/dst/{name}', name) for name in contents]
+
+    result = relay_parallel(source_server.client(max_connections=2), target_server.client(max_connections=2), tasks, 2)
+
+    assert result['files_processed'] == len(contents)
+    assert result['connections'] == 2
+    for name, data in contents.items():
+        with open(os.path.join(target_server.root, 'dst', name), 'rb') as f:
+            assert f.read() == data
+
+
+def test_relay_reports_missing_source_file(make_ftp_server):
+    source_server, target_server = make_ftp_server(), make_ftp_server()
+    _write_files(source_server.root, ['present.bin'])
+    tasks = [make_relay_task('/src/present.bin', '/dst/present.bin', 'present.bin'),
+             make_relay_task('/src/missing.bin', '/dst/missing.bin', 'missing.bin')]
+
+    result = relay_parallel(source_server.client(), target_server.client(), tasks, 1)
+
+    assert result['files_processed'] == 1
+    assert any(line.startswith('Failed to upload: missing.bin') for line in result['log'])
+
+
+def test_relay_within_one_session_site_falls_back(ftp_server):
+    _write_files(ftp_server.root, ['f0.bin'])
+    source, target = ftp_server.client(max_connections=1), ftp_server.client(max_connections=1)
+    tasks = [make_relay_task('/src/f0.bin', '/dst/f0.bin', 'f0.bin')]
+
+    start = time.monotonic()
+    assert relay_parallel(source, target, tasks, 4) is None
+    # Returns at once instead of waiting for a second session
+    assert time.monotonic() - start < 5
+
+
+def test_relay_within_one_site_uses_session_pairs(ftp_server):
+    contents = _write_files(ftp_server.root, [f'f{i}.bin' for i in range(4)])
+    source, target = ftp_server.client(max_connections=4), ftp_server.client(max_connections=4)
+    tasks = [make_relay_task(f'/src/{name}', f'/dst/{name}', name) for name in contents]
+
+    result = relay_parallel(source, target, tasks, 4)
+
+    assert result['files_processed'] == len(contents)
+    assert result['connections'] == 2
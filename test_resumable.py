@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Resuming interrupted downloads and uploads against a local FTP server
+"""
+import os
+
+from connection_pool import describe_pool_key
+from resumable import PartialDownload, PartialUpload
+
+
+def _remote_file(server, size=300000):
+    data = os.urandom(size)
+    with open(os.path.join(server.root, 'f.bin'), 'wb') as f:
+        f.write(data)
+    return data
+
+
+def _interrupted_download(client, local_path, data, mtime=None):
+    """A part holding the first third of the file, as a dropped session leaves it"""
+    with client.batch():
+        assert client.connect()
+        size, remote_mtime = client._remote_stat('/f.bin')
+    partial = PartialDownload(local_path, '/f.bin', size, mtime or remote_mtime)
+    with open(partial.path, 'wb') as f:
+        f.write(data[:len(data) // 3])
+
+
+def test_download_continues_matching_part(ftp_server, tmp_path):
+    data = _remote_file(ftp_server)
+    client = ftp_server.client()
+    local_path = str(tmp_path / 'f.bin')
+    _interrupted_download(client, local_path, data)
+
+    assert client.download_file('/f.bin', local_path)['success']
+
+    with open(local_path, 'rb') as f:
+        assert f.read() == data
+    assert 'REST' in ftp_server.commands
+    assert not any(name.startswith('f.bin.part') for name in os.listdir(tmp_path))
+
+
+def test_download_restarts_when_remote_file_changed(ftp_server, tmp_path):
+    data = _remote_file(ftp_server)
+    client = ftp_server.client()
+    local_path = str(tmp_path / 'f.bin')
+    _interrupted_download(client, local_path, os.urandom(len(data)), mtime='19700101000000')
+
+    assert client.download_file('/f.bin', local_path)['success']
+
+    with open(local_path, 'rb') as f:
+        assert f.read() == data
+    assert 'REST' not in ftp_server.commands
+
+
+def test_upload_continues_at_server_size(ftp_server, tmp_path, upload_state_dir):
+    data = os.urandom(300000)
+    local_path = tmp_path / 'up.bin'
+    local_path.write_bytes(data)
+    client = ftp_server.client()
+    # An earlier attempt got the first third onto the server
+    with open(os.path.join(ftp_server.root, 'up.bin'), 'wb') as f:
+        f.write(data[:100000])
+    PartialUpload(describe_pool_key(client.pool_key), str(local_path), '/up.bin').begin()
+
+    result = client.upload_file(str(local_path), '/up.bin')
+
+    assert result['success']
+    with open(os.path.join(ftp_server.root, 'up.bin'), 'rb') as f:
+        assert f.read() == data
+    assert 'REST' in ftp_server.commands
+    assert os.listdir(upload_state_dir) == []
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Byte-range splitting and segmented downloads from a local FTP server
+"""
+import os
+
+import segmented_download
+from resumable import PartialDownload
+from segmented_download import missing_ranges, split_ranges
+
+SIZE = 1024 * 1024
+
+
+def test_split_ranges_covers_file_without_overlap(monkeypatch):
+    monkeypatch.setattr(segmented_download, 'MIN_SEGMENT_SIZE', 1000)
+    ranges = split_ranges(10001, 4)
+
+    assert len(ranges) == 4
+    assert ranges[0][0] == 0 and sum(length for _, length in ranges) == 10001
+    assert all(offset + length == following for (offset, length), (following, _) in zip(ranges, ranges[1:]))
+
+
+def test_split_ranges_keeps_minimum_segment_size(monkeypatch):
+    monkeypatch.setattr(segmented_download, 'MIN_SEGMENT_SIZE', 1000)
+    assert split_ranges(2500, 8) == [(0, 833), (833, 833), (1666, 834)]
+    assert split_ranges(0, 4) == [(0, 0)]
+
+
+def test_missing_ranges_finds_gaps():
+    assert missing_ranges(100, [(10, 20), (50, 10), (25, 10)]) == [(0, 10), (35, 15), (60, 40)]
+    assert missing_ranges(100, [(0, 100)]) == []
+
+
+def _large_remote_file(server, monkeypatch):
+    monkeypatch.setattr(segmented_download, 'MIN_SEGMENT_SIZE', SIZE // 4)
+    data = os.urandom(SIZE)
+    with open(os.path.join(server.root, 'big.bin'), 'wb') as f:
+        f.write(data)
+    return data
+
+
+def test_large_file_is_fetched_in_ranges(ftp_server, tmp_path, monkeypatch):
+    data = _large_remote_file(ftp_server, monkeypatch)
+    client = ftp_server.client(max_connections=4, segment_threshold_mb=1)
+    local_path = str(tmp_path / 'big.bin')
+
+    assert client.download_file('/big.bin', local_path)['success']
+
+    with open(local_path, 'rb') as f:
+        assert f.read() == data
+    assert ftp_server.commands.count('RETR') == 4
+    assert ftp_server.logins == 4
+
+
+def test_resumed_segmented_download_fetches_only_missing_ranges(ftp_server, tmp_path, monkeypatch):
+    data = _large_remote_file(ftp_server, monkeypatch)
+    client = ftp_server.client(max_connections=4, segment_threshold_mb=1)
+    local_path = str(tmp_path / 'big.bin')
+    with client.batch():
+        assert client.connect()
+        size, mtime = client._remote_stat('/big.bin')
+    # An earlier run finished the first half
+    partial = PartialDownload(local_path, '/big.bin', size, mtime, segmented=True)
+    with open(partial.path, 'wb') as f:
+        f.write(data[:SIZE // 2] + bytes(SIZE // 2))
+    partial.mark_range_done(0, SIZE // 2)
+
+    assert client.download_file('/big.bin', local_path)['success']
+
+    with open(local_path, 'rb') as f:
+        assert f.read() == data
+    assert ftp_server.commands.count('RETR') == 2
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Pipelined SFTP reads and writes against an in-memory SFTP client
+"""
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from sftp_transfer import MAX_BLOCK_SIZE, normalize_block_size, pipelined_get, pipelined_put
+
+
+class FakeRemoteFile:
+    """The parts of paramiko's SFTPFile the helpers use"""
+
+    def __init__(self, sftp, path, mode):
+        self.sftp, self.path, self.mode = sftp, path, mode
+        self.position = 0
+        self.pipelined = False
+        self.prefetched = None
+        self.MAX_REQUEST_SIZE = 32768
+        if mode == 'wb':
+            sftp.files[path] = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sftp.opened.append(self)
+
+    def stat(self):
+        return self.sftp.stat(self.path)
+
+    def seek(self, offset):
+        self.position = offset
+
+    def prefetch(self, file_size, max_concurrent_requests=None):
+        self.prefetched = (self.position, file_size, max_concurrent_requests)
+
+    def read(self, size):
+        data = self.sftp.files[self.path][self.position:self.position + min(size, self.MAX_REQUEST_SIZE)]
+        self.position += len(data)
+        return data
+
+    def set_pipelined(self, pipelined):
+        self.pipelined = pipelined
+
+    def write(self, data):
+        content = self.sftp.files[self.path]
+        self.sftp.files[self.path] = content[:self.position] + data + content[self.position + len(data):]
+        self.position += len(data)
+
+
+class FakeSFTP:
+    def __init__(self, files=None):
+        self.files = dict(files or {})
+        self.opened = []
+        self.stat_size = None  # overrides the size stat() reports
+
+    def open(self, path, mode='r', bufsize=-1):
+        return FakeRemoteFile(self, path, mode)
+
+    def stat(self, path):
+        return SimpleNamespace(st_size=len(self.files[path]) if self.stat_size is None else self.stat_size)
+
+
+def test_block_size_is_clamped():
+    assert normalize_block_size(None) == 32768
+    assert normalize_block_size('junk') == 32768
+    assert normalize_block_size(1) == 4096
+    assert normalize_block_size(10 * MAX_BLOCK_SIZE) == MAX_BLOCK_SIZE
+
+
+def test_get_prefetches_a_window_from_the_resume_offset(tmp_path):
+    data = os.urandom(100000)
+    sftp = FakeSFTP({'/cdr.bin': data})
+    local_path = tmp_path / 'cdr.bin'
+    local_path.write_bytes(data[:40000])
+
+    assert pipelined_get(sftp, '/cdr.bin', str(local_path), block_size=8192, window=16, offset=40000) == 100000
+    assert local_path.read_bytes() == data
+    remote_file = sftp.opened[0]
+    assert remote_file.prefetched == (40000, 100000, 16)
+    assert remote_file.MAX_REQUEST_SIZE == 8192
+
+
+def test_get_fails_on_a_short_read(tmp_path):
+    sftp = FakeSFTP({'/cdr.bin': b'x' * 1000})
+    sftp.stat_size = 2000
+
+    with pytest.raises(IOError):
+        pipelined_get(sftp, '/cdr.bin', str(tmp_path / 'cdr.bin'))
+
+
+def test_put_pipelines_writes_and_resumes(tmp_path):
+    data = os.urandom(50000)
+    local_path = tmp_path / 'cdr.bin'
+    local_path.write_bytes(data)
+    sftp = FakeSFTP()
+
+    assert pipelined_put(sftp, str(local_path), '/cdr.bin', block_size=4096) == 50000
+    assert sftp.files['/cdr.bin'] == data
+    assert sftp.opened[0].pipelined and sftp.opened[0].mode == 'wb'
+
+    sftp.files['/cdr.bin'] = data[:20000]
+    assert pipelined_put(sftp, str(local_path), '/cdr.bin', block_size=4096, offset=20000) == 30000
+    assert sftp.files['/cdr.bin'] == data
+    assert sftp.opened[1].mode == 'r+b'
+
+
+def test_put_fails_when_the_server_has_another_size(tmp_path):
+    local_path = tmp_path / 'cdr.bin'
+    local_path.write_bytes(b'x' * 1000)
+    sftp = FakeSFTP()
+    sftp.stat_size = 10
+
+    with pytest.raises(IOError):
+        pipelined_put(sftp, str(local_path), '/cdr.bin')
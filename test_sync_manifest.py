@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Incremental sync: skipping unchanged files and refreshing the manifest
+"""
+import os
+import tempfile
+
+# app creates its tables on import: keep them in a scratch SQLite file, never in a configured database
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+
+import pytest  # noqa: E402
+
+from app import app, db  # noqa: E402
+from models import SyncManifestEntry  # noqa: E402
+from sync_manifest import SyncManifest  # noqa: E402
+from transfer_engine import make_task  # noqa: E402
+
+JOB_ID = 424242
+
+
+@pytest.fixture
+def manifest():
+    with app.app_context():
+        SyncManifest.clear(JOB_ID)
+        db.session.commit()
+        yield SyncManifest.load(JOB_ID)
+        db.session.rollback()
+        SyncManifest.clear(JOB_ID)
+        db.session.commit()
+
+
+def _task(name, size, modify):
+    return make_task(f'/in/{name}', f'/tmp/{name}', size=size, modify=modify)
+
+
+def test_unchanged_files_are_skipped(manifest):
+    manifest.record([_task('same.csv', 10, '20261016120000'), _task('grown.csv', 10, '20261016120000'),
+                     _task('touched.csv', 10, '20261016120000'), _task('unknown.csv', 10, '20261016120000')])
+    manifest.save()
+    manifest = SyncManifest.load(JOB_ID)
+
+    pending = manifest.pending([_task('same.csv', 10, '20261016120000'), _task('grown.csv', 20, '20261016120000'),
+                                _task('touched.csv', 10, '20261017080000'), _task('unknown.csv', None, ''),
+                                _task('new.csv', 5, '20261017080000')])
+
+    assert [task['name'] for task in pending] == ['grown.csv', 'touched.csv', 'unknown.csv', 'new.csv']
+    assert manifest.skipped == 1
+
+
+def test_recording_a_changed_file_refreshes_its_entry(manifest):
+    manifest.record([_task('cdr.csv', 10, '20261016120000')])
+    manifest.save()
+
+    manifest = SyncManifest.load(JOB_ID)
+    changed = _task('cdr.csv', 20, '20261017080000')
+    assert list(manifest.pending([changed])) == [changed]
+    manifest.record([dict(changed, checksum='abc')])
+    manifest.save()
+
+    entries = SyncManifestEntry.query.filter_by(job_id=JOB_ID).all()
+    assert [(e.path, e.size, e.modify, e.checksum) for e in entries] == [('/in/cdr.csv', 20, '20261017080000', 'abc')]
+    assert list(SyncManifest.load(JOB_ID).pending([changed])) == []
+    assert manifest.summary() == 'Incremental sync: 0 unchanged files skipped, 1 files recorded'
+
+
+def test_clear_forgets_the_job(manifest):
+    manifest.record([_task('cdr.csv', 10, '20261016120000')])
+    manifest.save()
+
+    SyncManifest.clear(JOB_ID)
+    db.session.commit()
+
+    assert len(SyncManifest.load(JOB_ID)) == 0
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Worker fan-out of the parallel transfer engine
+"""
+import os
+import threading
+
+from ftp_client import FTPClient
+from transfer_engine import _run_parallel, _run_streaming, make_upload_task
+
+
+def _nfs_client():
+    # Never mounted: the workers below only record which client ran each task
+    return FTPClient('nfs', 'nfs.example.invalid', 2049, '', '', nfs_export_path='/export')
+
+
+def _recording_task(seen, barrier):
+    lock = threading.Lock()
+
+    def run_task(worker, task):
+        with lock:
+            seen.append((id(worker), worker._batch_depth))
+        barrier.wait(5)
+        return {'success': True}
+
+    return run_task
+
+
+def test_parallel_nfs_workers_get_their_own_clients():
+    seen = []
+    tasks = [{'local_path': f'/tmp/f{i}'} for i in range(3)]
+
+    results, workers = _run_parallel(_nfs_client(), tasks, 3, _recording_task(seen, threading.Barrier(3)),
+                                     'local_path', 'Downloading')
+
+    assert workers == 3 and all(result['success'] for result in results)
+    # Three clients at once, each in its own batch()
+    assert len({worker for worker, _ in seen}) == 3
+    assert all(depth == 1 for _, depth in seen)
+
+
+def test_streaming_nfs_workers_get_their_own_clients():
+    seen = []
+    tasks = [{'local_path': f'/tmp/f{i}'} for i in range(2)]
+
+    task_list, results, workers = _run_streaming(_nfs_client(), iter(tasks), 2, 2,
+                                                 _recording_task(seen, threading.Barrier(2)),
+                                                 'local_path', 'Downloading')
+
+    assert len(task_list) == 2 and all(result['success'] for result in results)
+    assert len({worker for worker, _ in seen}) == 2
+    assert all(depth == 1 for _, depth in seen)
+
+
+def test_upload_many_creates_directories_once_and_uploads_in_parallel(ftp_server, tmp_path):
+    tasks = []
+    for index in range(8):
+        local_path = tmp_path / f'cdr{index}.csv'
+        local_path.write_bytes(b'x' * (index + 1))
+        tasks.append(make_upload_task(str(local_path), f'/out/{index % 2}/cdr{index}.csv'))
+
+    result = ftp_server.client(max_connections=3).upload_many(tasks)
+
+    assert result['files_processed'] == 8 and result['bytes_transferred'] == 36
+    assert 1 < result['connections'] <= 3
+    for index in range(8):
+        with open(os.path.join(ftp_server.root, 'out', str(index % 2), f'cdr{index}.csv'), 'rb') as f:
+            assert f.read() == b'x' * (index + 1)
+    assert ftp_server.commands.count('MKD') == 3
+    assert ftp_server.logins <= 3
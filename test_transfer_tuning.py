@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+Block size tuning against a local FTP server
+"""
+import os
+
+import transfer_tuning
+from transfer_tuning import TUNING_SCRATCH_NAME, tune_block_sizes
+
+
+def test_tuning_removes_its_scratch_upload(ftp_server, monkeypatch):
+    monkeypatch.setattr(transfer_tuning, 'FTP_BLOCK_SIZES', (32768, 65536))
+    monkeypatch.setattr(transfer_tuning, 'SOCKET_BUFFERS', (None, 262144))
+    with open(os.path.join(ftp_server.root, 'sample.bin'), 'wb') as f:
+        f.write(os.urandom(2 * 1024 * 1024))
+    # Left behind by a tuning run whose worker was killed
+    with open(os.path.join(ftp_server.root, TUNING_SCRATCH_NAME), 'wb') as f:
+        f.write(b'partial')
+
+    result = tune_block_sizes(ftp_server.client(), '/')
+
+    assert result['success'] and result['uploads']
+    assert result['block_size'] in (32768, 65536)
+    assert os.listdir(ftp_server.root) == ['sample.bin']
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Breadth-first tree scans against a local FTP server
+"""
+import os
+
+from tree_scanner import scan_tree
+
+
+def _make_tree(root):
+    for path in ['a/x/1', 'a/x/2', 'a/y', 'b/z/3/4', 'c']:
+        os.makedirs(os.path.join(root, 'in', path))
+        with open(os.path.join(root, 'in', path, 'cdr.csv'), 'wb') as f:
+            f.write(path.encode())
+
+
+def _scan(client, **kwargs):
+    return [(d.relative_path, d.depth, sorted(f['name'] for f in d.files))
+            for d in scan_tree(client, '/in', **kwargs)]
+
+
+def test_parallel_scan_keeps_sequential_order(ftp_server):
+    _make_tree(ftp_server.root)
+
+    sequential = _scan(ftp_server.client())
+    parallel = _scan(ftp_server.client(max_connections=4), max_workers=4, max_queued=1)
+
+    assert parallel == sequential
+    assert [depth for _, depth, _ in sequential] == sorted(depth for _, depth, _ in sequential)
+    assert {path for path, _, _ in sequential} == {
+        '', 'a', 'b', 'c', 'a/x', 'a/y', 'b/z', 'a/x/1', 'a/x/2', 'b/z/3', 'b/z/3/4'}
+    assert dict((path, files) for path, _, files in sequential)['b/z/3/4'] == ['cdr.csv']
+
+
+def test_max_depth_lists_folders_without_entering_them(ftp_server):
+    _make_tree(ftp_server.root)
+
+    scanned = list(scan_tree(ftp_server.client(max_connections=2), '/in', max_workers=2, max_depth=1))
+
+    assert sorted(d.relative_path for d in scanned) == ['', 'a', 'b', 'c']
+    assert sorted(next(d for d in scanned if d.relative_path == 'a').folders) == ['x', 'y']
+
+
+def test_missing_root_is_reported_once(ftp_server):
+    scanned = list(scan_tree(ftp_server.client(), '/missing', max_workers=2))
+
+    assert len(scanned) == 1 and scanned[0].error
@@ -0,0 +1,328 @@
+"""
+Parallel transfer engine.
+
+A job first builds its list of files (remote path -> local path, or the other
+way round for uploads) and then hands it to download_parallel() or
+upload_parallel(), which fan the list out over up to N concurrent sessions to
+the same site. Every worker holds one pooled session for its whole share of the
+list, and the result keeps the files_processed / bytes_transferred / log
+contract of the sequential transfer methods. download_streaming() does the
+same for a list that is still being built, such as the output of a tree scan.
+
+FTP downloads run on the asyncio transfer core instead of worker threads
+(see async_transfer.py), except for the files it leaves to the threads.
+Each download batch ends with the client's local_writes.flush(), which
+syncs the downloaded files under the 'batch' fsync policy.
+"""
+import logging
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from async_transfer import ASYNC_PROTOCOLS, download_tasks, runs_async
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 4
+
+
+def make_task(remote_path, local_path, name=None, note='', skip_existing=False, require_content=False, size=None,
+              modify=None, sidecars=None):
+    """Describe one file to download
+
+    name is what the job log shows, note is appended to the success line,
+    skip_existing leaves non-empty local files alone, require_content
+    treats an empty download as a failure, size and modify are the remote
+    size and modification time from the listing, if known, and sidecars
+    are the checksum files listed next to it (checksums.sidecars_for).
+    """
+    return {
+        'remote_path': remote_path,
+        'local_path': local_path,
+        'name': name or os.path.basename(local_path),
+        'note': note,
+        'skip_existing': skip_existing,
+        'require_content': require_content,
+        'size': size,
+        'modify': modify,
+        'sidecars': sidecars
+    }
+
+
+def _download_task(client, task):
+    """Download one task on the worker's client"""
+    local_path = task['local_path']
+    try:
+        if task['skip_existing'] and os.path.exists(local_path) and os.path.getsize(local_path) > 0:
+            return {'success': True, 'skipped': True}
+
+        result = client.download_file(task['remote_path'], local_path, task['size'], task.get('sidecars'))
+
+        if result['success'] and task['require_content'] and result['bytes_transferred'] == 0:
+            if os.path.exists(local_path):
+                os.remove(local_path)
+            return {'success': False, 'error': 'empty file (0 bytes)'}
+        if not result['success'] and task['require_content'] and os.path.exists(local_path):
+            os.remove(local_path)
+        return result
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+
+def make_upload_task(local_path, remote_path, name=None, size=None, modify=None):
+    """Describe one file to upload; name is what the job log shows, size and modify describe the local file"""
+    return {
+        'local_path': local_path,
+        'remote_path': remote_path,
+        'name': name or os.path.basename(local_path),
+        'size': size,
+        'modify': modify
+    }
+
+
+def _upload_task(client, task):
+    """Upload one task on the worker's client"""
+    try:
+        return client.upload_file(task['local_path'], task['remote_path'], create_dirs=False)
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+
+def _run_parallel(client, tasks, max_workers, run_task, target_key, action):
+    """Run run_task(worker, task) for every task over up to max_workers sessions
+
+    Tasks with the same target_key go to one worker in list order, so two
+    files that end up at the same path are never written at the same time.
+    Returns the per-task results (None where no worker got to the task) and
+    the number of workers used.
+    """
+    groups = {}
+    for index, task in enumerate(tasks):
+        groups.setdefault(task[target_key], []).append(index)
+
+    results = [None] * len(tasks)
+    workers = max(1, min(int(max_workers or 1), len(groups)))
+
+    if tasks:
+        pending = queue.Queue()
+        for indexes in groups.values():
+            pending.put(indexes)
+
+        def run_worker(worker):
+            with worker.batch():
+                if worker.protocol != 'nfs' and not worker.connect():
+                    return
+                while True:
+                    try:
+                        indexes = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    for index in indexes:
+                        results[index] = run_task(worker, tasks[index])
+
+        if workers == 1:
+            run_worker(client)
+        else:
+            # Every worker needs its own client for batch() state; NFS clones each
+            # take a reference to the same shared mount
+            clients = [client] + [client.clone() for _ in range(workers - 1)]
+            logger.debug(f"{action} {len(tasks)} files on {client.host} over {workers} connections")
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=action.lower()) as executor:
+                list(executor.map(run_worker, clients))
+
+    return results, workers
+
+
+def _run_streaming(client, tasks, max_workers, initial_workers, run_task, target_key, action):
+    """Run run_task(worker, task) for tasks while the tasks iterable is still producing them
+
+    initial_workers workers (the calling client first) start right away; the
+    rest of max_workers join once tasks is exhausted, when whatever produced
+    them no longer needs its sessions. As in _run_parallel() tasks with the
+    same target_key run one after another on one worker. Returns the list of
+    tasks seen, their results and the number of workers used.
+    """
+    task_list = []
+    results = []
+    waiting = {}  # target_key -> indexes queued behind the one being transferred
+    lock = threading.Lock()
+    pending = queue.Queue()
+
+    def run_worker(worker):
+        with worker.batch():
+            if worker.protocol != 'nfs' and not worker.connect():
+                return
+            while True:
+                index = pending.get()
+                if index is None:
+                    # Pass the end marker on to the next worker
+                    pending.put(None)
+                    return
+                key = task_list[index][target_key]
+                while index is not None:
+                    results[index] = run_task(worker, task_list[index])
+                    with lock:
+                        if waiting[key]:
+                            index = waiting[key].popleft()
+                        else:
+                            del waiting[key]
+                            index = None
+
+    max_workers = max(1, int(max_workers or 1))
+    initial_workers = max(1, min(int(initial_workers or max_workers), max_workers))
+    clients = [client] + [client.clone() for _ in range(max_workers - 1)]
+    workers = initial_workers
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=action.lower()) as executor:
+        for worker in clients[:initial_workers]:
+            executor.submit(run_worker, worker)
+        try:
+            for task in tasks:
+                with lock:
+                    index = len(task_list)
+                    task_list.append(task)
+                    results.append(None)
+                    key = task[target_key]
+                    if key in waiting:
+                        waiting[key].append(index)
+                        continue
+                    waiting[key] = deque()
+                pending.put(index)
+        finally:
+            pending.put(None)
+
+        # The producer is done; bring in the remaining workers if there is work left
+        extra = min(max_workers - initial_workers, pending.qsize() - 1)
+        for worker in clients[initial_workers:initial_workers + max(0, extra)]:
+            executor.submit(run_worker, worker)
+            workers += 1
+        logger.debug(f"{action} {len(task_list)} files on {client.host} over {workers} connections")
+
+    return task_list, results, workers
+
+
+def _run_async_downloads(client, tasks, max_workers, initial_workers=None):
+    """Run download tasks on the asyncio core, and the ones it does not take on worker threads afterwards
+
+    Returns the tasks in the order they ran, their results and the most
+    sessions used at once.
+    """
+    threaded = []
+
+    def async_tasks():
+        for task in tasks:
+            if runs_async(client, task):
+                yield task
+            else:
+                threaded.append(task)
+
+    task_list, results, workers = download_tasks(client, async_tasks(), max_workers, initial_workers)
+    if threaded:
+        threaded_results, threaded_workers = _run_parallel(client, threaded, max_workers, _download_task,
+                                                           'local_path', 'Downloading')
+        task_list = task_list + threaded
+        results = results + threaded_results
+        workers = max(workers, threaded_workers)
+    return task_list, results, workers
+
+
+def _download_summary(tasks, results, workers):
+    """The files_processed / bytes_transferred / log result for finished download tasks"""
+    files_processed = 0
+    bytes_transferred = 0
+    log_messages = []
+    completed = []
+
+    # Log in listing order regardless of which worker finished first
+    for task, result in zip(tasks, results):
+        if result is None:
+            result = {'success': False, 'error': 'Connection failed'}
+        if result.get('skipped'):
+            continue
+        if result['success']:
+            files_processed += 1
+            bytes_transferred += result['bytes_transferred']
+            completed.append(dict(task, checksum=result.get('checksum')))
+            verified = ', checksum verified' if result.get('verified') else ''
+            log_messages.append(f"Downloaded: {task['name']}{task['note']} ({result['bytes_transferred']} bytes{verified})")
+        else:
+            log_messages.append(f"Failed to download: {task['name']} - {result['error']}")
+
+    return {
+        'success': True,
+        'files_processed': files_processed,
+        'bytes_transferred': bytes_transferred,
+        'log': log_messages,
+        'connections': workers,
+        'completed': completed
+    }
+
+
+def download_parallel(client, tasks, max_workers=1):
+    """Download tasks over up to max_workers sessions of client's site
+
+    The calling client is the first worker; the others are clones that lease
+    their own sessions from the connection pool. A worker that cannot get a
+    session (site connection limit reached, login refused) simply stops and
+    leaves the remaining files to the workers that did connect. FTP
+    downloads run on the asyncio core, where the files are logged in the
+    order they were handed out.
+    """
+    if client.protocol in ASYNC_PROTOCOLS:
+        tasks, results, workers = _run_async_downloads(client, tasks, max_workers)
+    else:
+        results, workers = _run_parallel(client, tasks, max_workers, _download_task, 'local_path', 'Downloading')
+    client.local_writes.flush()
+    return _download_summary(tasks, results, workers)
+
+
+def download_streaming(client, tasks, max_workers=1, initial_workers=None):
+    """Download tasks from an iterable that is still producing them, e.g. a tree scan
+
+    Downloads start on initial_workers sessions as soon as the first task
+    arrives; the other workers up to max_workers join once the iterable is
+    exhausted. The result is the same as download_parallel()'s.
+    """
+    if client.protocol in ASYNC_PROTOCOLS:
+        tasks, results, workers = _run_async_downloads(client, tasks, max_workers, initial_workers)
+    else:
+        tasks, results, workers = _run_streaming(client, tasks, max_workers, initial_workers,
+                                                 _download_task, 'local_path', 'Downloading')
+    client.local_writes.flush()
+    return _download_summary(tasks, results, workers)
+
+
+def upload_parallel(client, tasks, max_workers=1):
+    """Upload tasks over up to max_workers sessions of client's site
+
+    Works like download_parallel(); the remote directories are expected to
+    exist already (see FTPClient.upload_many).
+    """
+    results, workers = _run_parallel(client, tasks, max_workers, _upload_task, 'remote_path', 'Uploading')
+
+    files_processed = 0
+    bytes_transferred = 0
+    log_messages = []
+    completed = []
+
+    for task, result in zip(tasks, results):
+        if result is None:
+            result = {'success': False, 'error': 'Connection failed'}
+        if result['success']:
+            files_processed += 1
+            bytes_transferred += result['bytes_transferred']
+            completed.append(dict(task, checksum=result.get('checksum')))
+            log_messages.append(f"Uploaded: {task['name']}{' (checksum verified)' if result.get('verified') else ''}")
+        else:
+            log_messages.append(f"Failed to upload: {task['name']} - {result.get('error', 'Unknown error')}")
+
+    return {
+        'success': True,
+        'files_processed': files_processed,
+        'bytes_transferred': bytes_transferred,
+        'log': log_messages,
+        'connections': workers,
+        'completed': completed
+    }
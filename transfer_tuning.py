@@ -0,0 +1,262 @@
+"""
+Auto-tuning of transfer block sizes per site.
+
+Every FTP data connection read/write and every SFTP request moves one block,
+and each block costs a Python callback (the local write, the checksum), so
+small blocks burn CPU on fast links while blocks larger than the path can
+fill gain nothing. SFTP throughput also depends on how many requests are in
+flight (the prefetch window) on high-latency links, and both depend on the
+kernel socket buffers on long fat links.
+
+Tuning moves a sample file from the site's remote path the way a transfer
+would, on a fresh uncompressed session that takes one of the site's
+connection slots: it is downloaded into a local temporary file and uploaded
+back next to it as TUNING_SCRATCH_NAME, which is deleted afterwards (or, if
+the process died first, at the start of the next tuning run). One
+untimed round warms the server's cache, then every candidate is timed
+TUNING_RUNS times in each direction and scored by its median:
+
+- FTP: each of FTP_BLOCK_SIZES as the retrbinary/storbinary block size
+- SFTP: each of SFTP_BLOCK_SIZES at the site's prefetch window, then each of
+  PREFETCH_WINDOWS at the best block size
+- both: each of SOCKET_BUFFERS as SO_RCVBUF/SO_SNDBUF at the best settings
+  (None keeps the kernel's autotuning)
+
+A site that refuses the upload cannot receive uploads at all, so it is tuned
+for downloads alone. The fastest values are saved to the site's block_size,
+prefetch_window and socket_buffer, which all FTP/SFTP transfer paths of its
+clients use. Tuning takes minutes, so it runs as a background scheduler job
+(scheduler.queue_site_check): for sites with auto-tune enabled when their
+first transfer starts, which goes ahead with the current settings, and
+when a site is re-tuned from the sites page.
+"""
+import ftplib
+import logging
+import os
+import socket
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from connection_pool import connection_pool
+from sftp_transfer import pipelined_get, pipelined_put
+
+logger = logging.getLogger(__name__)
+
+FTP_BLOCK_SIZES = (32768, 65536, 131072, 262144, 524288, 1048576)
+SFTP_BLOCK_SIZES = (32768, 65536, 131072, 261120)  # up to the 255 KiB OpenSSH serves
+PREFETCH_WINDOWS = (16, 32, 64, 128, 256)
+SOCKET_BUFFERS = (None, 262144, 1048576, 4194304)  # None = kernel autotuning; must stay first
+TUNING_RUNS = 3  # timed transfers per candidate and direction
+
+TUNING_MIN_SIZE = 1024 * 1024  # sample files for tuning are between these sizes
+TUNING_MAX_SIZE = 16 * 1024 * 1024
+SLOT_RETRY_INTERVAL = 0.5  # seconds between attempts to get a connection slot
+TUNING_FAILED = 'Tuning failed:'  # tuning_summary prefix of a failed tuning
+TUNING_SCRATCH_NAME = '.transfer-tuning.tmp'  # the upload next to the sample; one fixed name, see _Bench.open()
+
+
+def needs_tuning(site):
+    """Whether site has auto-tune enabled and was never tuned"""
+    return site.protocol in ('ftp', 'sftp') and bool(site.auto_tune) and site.tuned_at is None
+
+
+def apply_socket_buffer(sock, size):
+    """Set SO_RCVBUF and SO_SNDBUF of sock to size bytes; None leaves the kernel's autotuning alone"""
+    if not size or sock is None:
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, size)
+    except OSError as e:
+        logger.debug(f"Cannot set socket buffers to {size} bytes: {str(e)}")
+
+
+def _format_size(size):
+    return f"{size // 1024} KB"
+
+
+def _reserve_slot(client):
+    """Take one of the site's connection slots for the tuning session, waiting as long as a lease would"""
+    deadline = time.monotonic() + connection_pool.lease_timeout
+    while not connection_pool.reserve(client.pool_key):
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"No free connection to {client.host} after {connection_pool.lease_timeout}s")
+        time.sleep(SLOT_RETRY_INTERVAL)
+
+
+class _Bench:
+    """Times transfers of the sample file on one session of a tuning client"""
+
+    def __init__(self, client, sample_path, sample_size, local_path):
+        self.client = client
+        self.sample_path = sample_path
+        self.sample_size = sample_size
+        self.local_path = local_path
+        self.upload_path = f"{sample_path.rsplit('/', 1)[0]}/{TUNING_SCRATCH_NAME}"
+        self.uploads = True  # cleared when the site refuses the upload
+        self.uploaded = False
+        self.rates = {}  # (block_size, window, socket_buffer) -> {'download', 'upload'} bytes per second
+        self.session = None
+        self.socket_buffer = None
+
+    def open(self):
+        self.session = self.client._open_session(compress=False)
+        if self.uploads and self._remove_upload():
+            # Left behind by a tuning run that was killed before it could clean up
+            logger.info(f"Removed {self.upload_path} of an earlier tuning run from {self.client.host}")
+
+    def _remove_upload(self):
+        """Delete the scratch upload; False if there was none (or it cannot be deleted)"""
+        try:
+            if self.client.protocol == 'ftp':
+                self.session.connection.delete(self.upload_path)
+            else:
+                self.session.connection.remove(self.upload_path)
+        except ftplib.all_errors:
+            return False
+        self.client._invalidate_listing(self.upload_path)
+        return True
+
+    def close(self):
+        if self.session is None:
+            return
+        if self.uploaded and not self._remove_upload():
+            logger.warning(f"Cannot remove tuning file {self.upload_path} from {self.client.host}, "
+                           f"the next tuning run removes it")
+        self.session.close()
+        self.session = None
+
+    def _use_socket_buffer(self, socket_buffer):
+        if socket_buffer == self.socket_buffer:
+            return
+        self.socket_buffer = socket_buffer
+        if self.client.protocol == 'ftp':
+            # Applied to each data connection as it opens
+            self.session.connection.socket_buffer = socket_buffer
+        else:
+            # Everything shares the SSH socket, whose buffers are set before the handshake
+            self.close()
+            self.client.socket_buffer = socket_buffer
+            self.open()
+
+    def _download(self, block_size, window):
+        started = time.monotonic()
+        if self.client.protocol == 'ftp':
+            with open(self.local_path, 'wb') as local_file:
+                self.session.connection.retrbinary(f'RETR {self.sample_path}', local_file.write, block_size)
+        else:
+            pipelined_get(self.session.connection, self.sample_path, self.local_path, block_size, window)
+        return time.monotonic() - started
+
+    def _upload(self, block_size):
+        started = time.monotonic()
+        self.uploaded = True
+        if self.client.protocol == 'ftp':
+            with open(self.local_path, 'rb') as local_file:
+                self.session.connection.storbinary(f'STOR {self.upload_path}', local_file, block_size)
+        else:
+            pipelined_put(self.session.connection, self.local_path, self.upload_path, block_size)
+        return time.monotonic() - started
+
+    def warm_up(self, block_size, window):
+        """One untimed round trip; finds out whether the site takes uploads"""
+        self._download(block_size, window)
+        try:
+            self._upload(block_size)
+        except (ftplib.error_perm, PermissionError) as e:
+            logger.info(f"{self.client.host} refused the tuning upload, tuning for downloads only: {str(e)}")
+            self.uploads = False
+            self.uploaded = False
+
+    def score(self, block_size, window=None, socket_buffer=None):
+        """Bytes per second moving the sample down (and up) with these settings"""
+        key = (block_size, window, socket_buffer)
+        if key not in self.rates:
+            self._use_socket_buffer(socket_buffer)
+            download = statistics.median(self._download(block_size, window) for _ in range(TUNING_RUNS))
+            upload = statistics.median(self._upload(block_size) for _ in range(TUNING_RUNS)) if self.uploads else None
+            self.rates[key] = {'download': self.sample_size / max(download, 1e-6),
+                               'upload': self.sample_size / max(upload, 1e-6) if upload is not None else None}
+            logger.debug(f"{self.client.host}: {_format_size(block_size)} blocks"
+                         f"{f', window {window}' if window else ''}"
+                         f"{f', socket buffer {_format_size(socket_buffer)}' if socket_buffer else ''}: "
+                         + ', '.join(f"{direction} {rate / (1024 * 1024):.1f} MB/s"
+                                     for direction, rate in self.rates[key].items() if rate))
+        rates = self.rates[key]
+        if rates['upload'] is None:
+            return rates['download']
+        # Time to move the sample both ways: a harmonic mean, so a slow direction is not hidden
+        return 2 / (1 / rates['download'] + 1 / rates['upload'])
+
+
+def tune_block_sizes(client, remote_path):
+    """Find the fastest block size, SFTP prefetch window and socket buffer for client's site
+
+    Returns {'success', 'block_size', 'prefetch_window', 'socket_buffer',
+    'uploads', 'summary', 'rates'} where rates maps each tried (block_size,
+    prefetch_window, socket_buffer) to download and upload bytes per second;
+    prefetch_window is None for FTP, uploads is False when the site refused
+    the upload and only downloads were measured.
+    """
+    if client.protocol not in ('ftp', 'sftp'):
+        return {'success': False, 'error': f'{client.protocol.upper()} has no block size to tune'}
+    try:
+        sample = client.find_sample_file(remote_path, TUNING_MIN_SIZE, TUNING_MAX_SIZE)
+        if sample is None:
+            return {'success': False,
+                    'error': f'No file between {TUNING_MIN_SIZE // (1024 * 1024)} MB and '
+                             f'{TUNING_MAX_SIZE // (1024 * 1024)} MB in {remote_path} to tune with'}
+        sample_path, sample_size = sample
+
+        # A separate client, so trying socket buffers does not change the caller's
+        tuner = client.clone()
+        tuner.socket_buffer = None
+        _reserve_slot(client)
+        try:
+            with tempfile.TemporaryDirectory(prefix='tune_') as temp_dir:
+                bench = _Bench(tuner, sample_path, sample_size, os.path.join(temp_dir, 'sample'))
+                try:
+                    bench.open()
+                    if client.protocol == 'ftp':
+                        window = None
+                        bench.warm_up(client.block_size, window)
+                        block_size = max(FTP_BLOCK_SIZES, key=bench.score)
+                    else:
+                        window = client.prefetch_window
+                        bench.warm_up(client.block_size, window)
+                        block_size = max(SFTP_BLOCK_SIZES, key=lambda size: bench.score(size, window))
+                        window = max(PREFETCH_WINDOWS, key=lambda candidate: bench.score(block_size, candidate))
+                    socket_buffer = max(SOCKET_BUFFERS, key=lambda size: bench.score(block_size, window, size))
+                finally:
+                    bench.close()
+        finally:
+            connection_pool.unreserve(client.pool_key)
+
+        best = bench.rates[(block_size, window, socket_buffer)]
+        summary = (f"{sample_path.rsplit('/', 1)[-1]} ({sample_size} bytes): "
+                   f"download {best['download'] / (1024 * 1024):.1f} MB/s"
+                   + (f", upload {best['upload'] / (1024 * 1024):.1f} MB/s" if best['upload'] else ' (uploads refused)')
+                   + f" with {_format_size(block_size)} blocks"
+                   + (f", {window} requests in flight" if window else '')
+                   + (f", {_format_size(socket_buffer)} socket buffers" if socket_buffer else ', default socket buffers'))
+        logger.info(f"Block size tuning for {client.host}: {summary}")
+        return {'success': True, 'block_size': block_size, 'prefetch_window': window,
+                'socket_buffer': socket_buffer, 'uploads': bench.uploads, 'summary': summary, 'rates': bench.rates}
+    except Exception as e:
+        logger.error(f"Block size tuning for {client.host} failed: {str(e)}")
+        return {'success': False, 'error': str(e)}
+
+
+def record_tuning(site, result):
+    """Store a tuning result on site (the caller commits)"""
+    site.tuned_at = datetime.utcnow()
+    if result['success']:
+        site.block_size = result['block_size']
+        if result['prefetch_window']:
+            site.prefetch_window = result['prefetch_window']
+        site.socket_buffer = result['socket_buffer']
+        site.tuning_summary = result['summary']
+    else:
+        site.tuning_summary = f"{TUNING_FAILED} {result['error']}"
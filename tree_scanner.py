@@ -0,0 +1,175 @@
+"""
+Concurrent breadth-first scan of a remote directory tree.
+
+The recursive download modes used to cwd into one directory at a time on a
+single session, so deep trees spent most of a run waiting on listings.
+scan_tree() lists directories breadth first over a small pool of sessions
+instead: workers take directories from a bounded queue, list them and queue
+the subdirectories they find, and every listed directory is handed to the
+caller as soon as it is available, so transfers can start while the rest of
+the tree is still being scanned.
+
+With ordered output (the default) directories come out in the order a
+single-session breadth-first walk would produce them, whatever order the
+workers finish in, so job logs and first-come name handling stay
+deterministic.
+
+An NFS mount has no sessions to spread listings over: its tree is walked
+with one scandir() per directory by NFSClient.walk(), in the same order.
+"""
+import heapq
+import logging
+import queue
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_QUEUED = 1000  # directories waiting in the shared work queue
+
+ScannedDirectory = namedtuple('ScannedDirectory', ['path', 'relative_path', 'depth', 'files', 'folders', 'error'])
+# files are list_files() records of the non-directory entries, folders the
+# subdirectory names (including those beyond max_depth, which are not
+# listed); error is the listing error, with files and folders empty
+
+
+def _join(parent, name):
+    if not parent:
+        return name
+    return f"{parent.rstrip('/')}/{name}"
+
+
+def _list_directory(client, path, relative_path, depth):
+    """List one directory on the worker's client"""
+    listing = client.list_files(path)
+    if not listing['success']:
+        return ScannedDirectory(path, relative_path, depth, [], [], listing['error'])
+    files = [f for f in listing['files'] if f['type'] != 'directory']
+    folders = [f['name'] for f in listing['files'] if f['type'] == 'directory' and f['name'] not in ('.', '..')]
+    return ScannedDirectory(path, relative_path, depth, files, folders, None)
+
+
+def scan_tree(client, remote_path, max_workers=1, max_depth=None, max_queued=DEFAULT_MAX_QUEUED, ordered=True):
+    """Yield a ScannedDirectory for remote_path and every directory below it, breadth first
+
+    Directories are listed over up to max_workers sessions: the calling client
+    and clones leasing their own sessions from the pool, which only join if
+    the site has a free session.
+    max_depth limits how far below remote_path the scan goes (0 lists
+    remote_path only). At most max_queued directories wait in the shared
+    queue; a worker keeps any overflow for itself and hands it back as the
+    queue drains. Closing the generator stops the scan. NFS sites are walked
+    through their mount in the calling thread instead (see NFSClient.walk).
+    """
+    if client.protocol == 'nfs':
+        with client.nfs_mount() as nfs_client:
+            if nfs_client is None:
+                yield ScannedDirectory(remote_path, '', 0, [], [], 'Failed to mount NFS share')
+            else:
+                yield from nfs_client.walk(remote_path, max_depth)
+        return
+
+    workers = max(1, int(max_workers or 1))
+    pending = queue.Queue(maxsize=max(1, max_queued))
+    output = queue.Queue()
+    state = {'outstanding': 1, 'stopped': False}
+    state_lock = threading.Lock()
+
+    # key orders directories like a sequential breadth-first walk: depth,
+    # then the position of each ancestor in its parent's listing
+    pending.put(((0,), remote_path, ''))
+
+    def finish_one():
+        with state_lock:
+            state['outstanding'] -= 1
+            return state['outstanding'] == 0
+
+    def run_worker(worker):
+        overflow = []
+        with worker.batch():
+            # Only the first worker waits for a session; the others help if a slot is free
+            if not worker.connect(lease_timeout=None if worker is client else 0):
+                return
+            while not state['stopped']:
+                # Hand overflow back to the shared queue so idle workers can take it
+                while len(overflow) > 1:
+                    try:
+                        pending.put_nowait(overflow[0])
+                    except queue.Full:
+                        break
+                    overflow.pop(0)
+
+                if overflow:
+                    item = overflow.pop()
+                else:
+                    try:
+                        item = pending.get(timeout=0.1)
+                    except queue.Empty:
+                        with state_lock:
+                            if state['outstanding'] == 0:
+                                return
+                        continue
+
+                key, path, relative_path = item
+                depth = key[0]
+                try:
+                    directory = _list_directory(worker, path, relative_path, depth)
+                except Exception as e:
+                    directory = ScannedDirectory(path, relative_path, depth, [], [], str(e))
+
+                children = []
+                if max_depth is None or depth < max_depth:
+                    children = [((depth + 1,) + key[1:] + (index,), _join(path, name), _join(relative_path, name))
+                                for index, name in enumerate(directory.folders)]
+                with state_lock:
+                    state['outstanding'] += len(children)
+                for child in children:
+                    try:
+                        pending.put_nowait(child)
+                    except queue.Full:
+                        overflow.append(child)
+
+                output.put((key, directory, [child[0] for child in children]))
+                if finish_one():
+                    return
+
+    def run_all(clients):
+        try:
+            with ThreadPoolExecutor(max_workers=len(clients), thread_name_prefix='scan') as executor:
+                list(executor.map(run_worker, clients))
+        finally:
+            output.put(None)
+
+    clients = [client] + [client.clone() for _ in range(workers - 1)]
+    logger.debug(f"Scanning {remote_path} on {client.host} over {workers} connections")
+    runner = threading.Thread(target=run_all, args=(clients,), name='scan', daemon=True)
+    runner.start()
+
+    try:
+        known = [(0,)]  # directories whose listing is due, in walk order
+        ready = {}
+        listed = False
+        while True:
+            item = output.get()
+            if item is None:
+                break
+            key, directory, child_keys = item
+            listed = True
+            if not ordered:
+                yield directory
+                continue
+
+            ready[key] = (directory, child_keys)
+            while known and known[0] in ready:
+                directory, child_keys = ready.pop(heapq.heappop(known))
+                for child_key in child_keys:
+                    heapq.heappush(known, child_key)
+                yield directory
+
+        if not listed:
+            # No worker got a session
+            yield ScannedDirectory(remote_path, '', 0, [], [], 'Connection failed')
+    finally:
+        state['stopped'] = True
+        runner.join()
@@ -75,6 +75,11 @@ def set_setting(key, value, encrypted=False):
         db.session.rollback()
         return False
 
+def apply_bandwidth_settings():
+    """Load the global bandwidth limit and schedule from the settings into the bandwidth manager"""
+    from bandwidth import bandwidth_manager
+    bandwidth_manager.configure('global', get_setting('bandwidth_limit_mbps'), get_setting('bandwidth_schedule'))
+
 def ensure_directory_exists(path):
     """Ensure a directory exists"""
     try: